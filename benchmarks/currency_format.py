@@ -0,0 +1,46 @@
+"""Micro-benchmark of currency formatting.
+
+    Compares ``Currency.format_many`` with a loop over
+    ``Currency.format_currency``, which both use the compiled
+    ``CurrencyFormat`` formatters.
+
+    Run from the repository root:
+
+        python benchmarks/currency_format.py
+"""
+import os
+import sys
+import timeit
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from subscriptions.currency import Currency  # noqa: E402 pylint: disable=wrong-import-position
+
+
+NUMBER = 100000
+REPORT = [Decimal(index) / 7 for index in range(-NUMBER // 2, NUMBER // 2)]
+
+
+def main():
+    """Prints the time taken by both approaches."""
+    for locale in ('en_us', 'de_de', 'fr_ca'):
+        currency = Currency(locale)
+        loop = min(timeit.repeat(
+            lambda: [currency.format_currency(value) for value in REPORT],  # pylint: disable=cell-var-from-loop
+            number=1,
+            repeat=3,
+        ))
+        batch = min(timeit.repeat(
+            lambda: list(currency.format_many(REPORT)),  # pylint: disable=cell-var-from-loop
+            number=1,
+            repeat=3,
+        ))
+
+        print('{}: {} values, loop {:.3f}s, format_many {:.3f}s ({:.1f}x)'.format(
+            locale, len(REPORT), loop, batch, loop / batch,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,11 @@
 """Abstract templates for the Djanog Flexible Subscriptions app."""
+import binascii
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
 from django.views import generic
 
 from subscriptions.conf import SETTINGS
@@ -118,3 +125,193 @@ class DeleteView(generic.DeleteView):
         context['template_extends'] = self.template_extends
 
         return context
+
+
+class KeysetPage():
+    """A page of objects selected by keyset (cursor) pagination.
+
+        Attributes:
+            object_list (list): The objects on this page.
+            next_cursor (str): The cursor of the following page or
+                ``None`` if this is the last page.
+            previous_cursor (str): The cursor of the preceding page or
+                ``None`` if this is the first page.
+    """
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        """Returns whether there is a following page."""
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        """Returns whether there is a preceding page."""
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        """Returns whether there is a preceding or following page."""
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginationMixin():
+    """Paginates a ListView by keyset (cursor) instead of page number.
+
+        Each page is selected with a condition on the ordering values
+        of the last object of the previous page instead of an OFFSET,
+        and no COUNT query is made, so a deep page costs the same as
+        the first one. Pages are requested with the ``after`` and
+        ``before`` query parameters.
+
+        Attributes:
+            keyset_ordering (tuple): Fields of the model that order
+                the list; prefix a field with ``-`` for descending
+                order. The fields together must be unique and not
+                null (e.g. end with ``pk``).
+            after_kwarg (str): Query parameter of the cursor to list
+                the objects after.
+            before_kwarg (str): Query parameter of the cursor to list
+                the objects before.
+            keyset_pagination (bool): Whether to use keyset pagination;
+                if ``False``, the list is paginated by page number in
+                the ``keyset_ordering`` order.
+    """
+    keyset_ordering = ('pk',)
+    after_kwarg = 'after'
+    before_kwarg = 'before'
+    keyset_pagination = True
+
+    def paginate_queryset(self, queryset, page_size):
+        """Returns the requested page of the queryset.
+
+            Parameters:
+                queryset (obj): The queryset to paginate.
+                page_size (int): The number of objects per page.
+
+            Returns:
+                tuple: the paginator (``None`` for keyset pagination),
+                    the page, the list of objects on the page and
+                    whether the list has more than one page.
+        """
+        if not self.keyset_pagination:
+            return super().paginate_queryset(
+                queryset.order_by(*self.keyset_ordering), page_size
+            )
+
+        after = self.request.GET.get(self.after_kwarg)
+        before = self.request.GET.get(self.before_kwarg)
+
+        try:
+            if before:
+                queryset = queryset.filter(
+                    self._keyset_condition(before, backwards=True)
+                ).order_by(*[
+                    field[1:] if field.startswith('-') else '-{}'.format(field)
+                    for field in self.keyset_ordering
+                ])
+            else:
+                queryset = queryset.order_by(*self.keyset_ordering)
+
+                if after:
+                    queryset = queryset.filter(self._keyset_condition(after))
+        except (TypeError, ValueError, ValidationError) as error:
+            # Cursor values that do not match the field types
+            raise Http404('Invalid page cursor.') from error
+
+        # Fetch one extra object to know if there is a further page
+        object_list = list(queryset[:page_size + 1])
+        more = len(object_list) > page_size
+        object_list = object_list[:page_size]
+
+        if before:
+            object_list.reverse()
+            has_next, has_previous = True, more
+        else:
+            has_next, has_previous = more, bool(after)
+
+        page = KeysetPage(object_list)
+
+        if object_list and has_next:
+            page.next_cursor = self.encode_cursor(object_list[-1])
+
+        if object_list and has_previous:
+            page.previous_cursor = self.encode_cursor(object_list[0])
+
+        return None, page, object_list, page.has_other_pages()
+
+    def encode_cursor(self, obj):
+        """Returns the cursor pointing at an object.
+
+            Parameters:
+                obj (obj): A model instance from the list.
+
+            Returns:
+                str: The URL-safe cursor.
+        """
+        values = []
+
+        for field in self.keyset_ordering:
+            value = getattr(obj, field.lstrip('-'))
+
+            # Keeps full precision (e.g. datetime microseconds)
+            values.append(value if isinstance(value, (int, float)) else str(value))
+
+        return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        """Returns the ordering values of a cursor.
+
+            Parameters:
+                cursor (str): A cursor from ``encode_cursor``.
+
+            Returns:
+                list: The values of the ``keyset_ordering`` fields.
+
+            Raises:
+                Http404: The cursor is not valid.
+        """
+        try:
+            values = json.loads(urlsafe_b64decode(cursor.encode()))
+        except (binascii.Error, ValueError) as error:
+            raise Http404('Invalid page cursor.') from error
+
+        if not isinstance(values, list) or len(values) != len(self.keyset_ordering):
+            raise Http404('Invalid page cursor.')
+
+        # Only the strings and numbers written by encode_cursor are valid
+        for value in values:
+            if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                raise Http404('Invalid page cursor.')
+
+        return values
+
+    def _keyset_condition(self, cursor, backwards=False):
+        """Returns the condition selecting the objects past a cursor.
+
+            Parameters:
+                cursor (str): A cursor from ``encode_cursor``.
+                backwards (bool): Whether to select the objects before
+                    the cursor instead of after it.
+
+            Returns:
+                obj: A Q object for the condition.
+        """
+        condition = Q()
+        equal = {}
+
+        for field, value in zip(self.keyset_ordering, self.decode_cursor(cursor)):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != backwards
+            lookup = '{}__{}'.format(name, 'lt' if descending else 'gt')
+
+            condition |= Q(**equal, **{lookup: value})
+            equal[name] = value
+
+        return condition
@@ -60,6 +60,9 @@ class UserSubscriptionAdmin(admin.ModelAdmin):
         'date_billing_next',
         'active',
         'cancelled',
+        'payment_failures',
+        'date_payment_retry',
+        'payment_error',
     )
     list_display = (
         'user',
@@ -67,6 +70,32 @@ class UserSubscriptionAdmin(admin.ModelAdmin):
         'date_billing_next',
         'active',
         'cancelled',
+        'payment_failures',
+    )
+
+
+class BillingAttemptAdmin(admin.ModelAdmin):
+    """Admin class for the BillingAttempt model."""
+    list_display = (
+        'subscription',
+        'date_period_start',
+        'number',
+        'status',
+        'date_created',
+        'date_transaction',
+    )
+    list_filter = (
+        'status',
+    )
+
+
+class BillingRunAdmin(admin.ModelAdmin):
+    """Admin class for the BillingRun model."""
+    list_display = (
+        'date_started',
+        'date_reference',
+        'phase',
+        'date_updated',
     )
 
 
@@ -78,4 +107,6 @@ if SETTINGS['enable_admin']:
     admin.site.register(models.PlanCost, PlanCostAdmin)
     admin.site.register(models.SubscriptionPlan, SubscriptionPlanAdmin)
     admin.site.register(models.UserSubscription, UserSubscriptionAdmin)
+    admin.site.register(models.BillingAttempt, BillingAttemptAdmin)
+    admin.site.register(models.BillingRun, BillingRunAdmin)
     admin.site.register(models.SubscriptionTransaction, TransactionAdmin)
@@ -6,3 +6,7 @@ class FlexibleSubscriptionsConfig(AppConfig):
     """Configuration details for django-flexible-subscriptions."""
     name = 'subscriptions'
     verbose_name = 'django-flexible-subscriptions'
+
+    def ready(self):
+        """Connects the signal receivers."""
+        from subscriptions import signals  # noqa: F401 pylint: disable=import-outside-toplevel, unused-import
@@ -0,0 +1,132 @@
+"""Server-side caching of the public subscription plan list."""
+from datetime import timedelta
+from uuid import uuid4
+
+from django.core.cache import caches
+from django.utils import timezone
+
+from subscriptions import models
+from subscriptions.conf import SETTINGS
+
+
+# Cache key holding the current version of the plan list entry, a
+# (token, last modified datetime) tuple
+SUBSCRIBE_LIST_VERSION_KEY = 'dfs_subscribe_list_version'
+SUBSCRIBE_LIST_KEY = 'dfs_subscribe_list:{}'
+
+
+def _get_cache():
+    """Returns the cache for the plan list or None if it is disabled."""
+    alias = SETTINGS['subscribe_list_cache']
+
+    return caches[alias] if alias else None
+
+
+def load_subscribe_list():
+    """Queries the active PlanList and its details.
+
+        Returns:
+            tuple: The first active PlanList (or ``None``) and a list
+                of its PlanListDetail instances, in display order, with
+                their plans loaded.
+    """
+    plan_list = models.PlanList.objects.filter(active=True).first()
+
+    if plan_list is None:
+        return None, []
+
+    details = list(
+        models.PlanListDetail.objects.filter(
+            plan_list=plan_list,
+            # TODO: if plan_lists are going to be used,
+            # we need to figure out how to check that a plan
+            # has an attached cost.
+            # NOTE: check offers/management cmd
+            # plan__costs__exists=1,
+            # plan__costs__isnull=False
+        ).select_related('plan').order_by('order')
+    )
+
+    return plan_list, details
+
+
+def get_subscribe_list():
+    """Returns the active PlanList and its details, cached if possible.
+
+        The entry is stored under a versioned key, so an invalidation
+        that happens while the database is read cannot be overwritten
+        by the stale result.
+
+        Returns:
+            tuple: The first active PlanList (or ``None``) and a list
+                of its PlanListDetail instances.
+    """
+    cache = _get_cache()
+
+    if cache is None:
+        return load_subscribe_list()
+
+    key = SUBSCRIBE_LIST_KEY.format(get_subscribe_list_version()[0])
+    subscribe_list = cache.get(key)
+
+    if subscribe_list is None:
+        subscribe_list = load_subscribe_list()
+        cache.set(key, subscribe_list)
+
+    return subscribe_list
+
+
+def _new_version(cache):
+    """Stores and returns a new version of the plan list.
+
+        The last modified time is in whole seconds (the precision of
+        the ``Last-Modified`` header) and always later than the one of
+        the previous version, so ``If-Modified-Since`` requests never
+        match a changed list.
+
+        The version expires with the default timeout of the cache, like
+        the entry, so a list reloaded after a change that did not send
+        signals gets new validators.
+    """
+    modified = timezone.now().replace(microsecond=0)
+    previous = cache.get(SUBSCRIBE_LIST_VERSION_KEY)
+
+    if previous is not None and modified <= previous[1]:
+        modified = previous[1] + timedelta(seconds=1)
+
+    version = (uuid4().hex, modified)
+    cache.set(SUBSCRIBE_LIST_VERSION_KEY, version)
+
+    return version
+
+
+def get_subscribe_list_version():
+    """Returns the current version of the plan list.
+
+        The version changes whenever the plan list is invalidated, so
+        it can be used to validate client caches without any database
+        queries.
+
+        Returns:
+            tuple: A token and the last modified datetime, or ``None``
+                if the cache is disabled.
+    """
+    cache = _get_cache()
+
+    if cache is None:
+        return None
+
+    version = cache.get(SUBSCRIBE_LIST_VERSION_KEY)
+
+    if version is None:
+        version = _new_version(cache)
+
+    return version
+
+
+def invalidate_subscribe_list():
+    """Makes the next request load the plan list from the database."""
+    cache = _get_cache()
+
+    if cache is not None:
+        _new_version(cache)
@@ -104,6 +104,9 @@ def compile_settings():
     # -------------------------------------------------------------------------
     currency = determine_currency_settings()
 
+    # Number of formatted values the currency template filter keeps
+    currency_cache_size = getattr(settings, 'DFS_CURRENCY_CACHE_SIZE', 256)
+
     # TEMPLATE & VIEW SETTINGS
     # -------------------------------------------------------------------------
     base_template = getattr(
@@ -116,6 +119,9 @@ def compile_settings():
     )
     subscribe_view = string_to_module_and_class(subscribe_view_path)
 
+    # Cache alias for the public plan list (None disables the cache)
+    subscribe_list_cache = getattr(settings, 'DFS_SUBSCRIBE_LIST_CACHE', None)
+
     # MANAGEMENT COMMANDS SETTINGS
     # ------------------------------------------------------------------------
     # Get module and class for the Management Command Manager class
@@ -129,8 +135,10 @@ def compile_settings():
     return {
         'enable_admin': enable_admin,
         'currency': currency,
+        'currency_cache_size': currency_cache_size,
         'base_template': base_template,
         'subscribe_view': subscribe_view,
+        'subscribe_list_cache': subscribe_list_cache,
         'management_manager': management_manager,
     }
 
@@ -1,4 +1,5 @@
 """Module to handle details involving currency formating."""
+import warnings
 from decimal import Decimal, ROUND_HALF_UP
 
 
@@ -234,6 +235,154 @@ CURRENCY = {
 }
 
 
+class CurrencyFormat():
+    """Compiled, immutable formatter for one set of currency conventions.
+
+        The conventions are resolved once into the rounding quantum,
+        the separators and the text placed before and after the number
+        for positive and negative values, so formatting a value is a
+        single pass without any shared mutable state. Instances are
+        safe to share between threads.
+
+        Parameters:
+            conventions (dict): the currency formating conventions.
+            international (bool): whether to use the international
+                currency symbol and fractional digits.
+    """
+    __slots__ = (
+        'quantum', 'decimal_point', 'grouping', 'thousands_sep',
+        'positive', 'negative',
+    )
+
+    def __init__(self, conventions, international=False):
+        if international:
+            symbol = conventions['int_curr_symbol']
+            digits = conventions['int_frac_digits']
+        else:
+            symbol = conventions['currency_symbol']
+            digits = conventions['frac_digits']
+
+        set_slot = super().__setattr__
+        set_slot('quantum', Decimal(10) ** -digits)
+        set_slot(
+            'decimal_point',
+            str(conventions['mon_decimal_point']) if digits > 0 else '',
+        )
+        set_slot('grouping', conventions['mon_grouping'])
+        set_slot('thousands_sep', str(conventions['mon_thousands_sep']))
+        set_slot('positive', self._compile_layout(
+            symbol,
+            conventions['p_cs_precedes'],
+            conventions['p_sep_by_space'],
+            conventions['positive_sign'],
+            conventions['p_sign_posn'],
+        ))
+        set_slot('negative', self._compile_layout(
+            symbol,
+            conventions['n_cs_precedes'],
+            conventions['n_sep_by_space'],
+            conventions['negative_sign'],
+            conventions['n_sign_posn'],
+        ))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CurrencyFormat instances are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('CurrencyFormat instances are immutable')
+
+    @staticmethod
+    def _compile_layout(symbol, precedes, separated, sign, sign_position):
+        """Returns the text to place before and after the number.
+
+            Parameters:
+                symbol (str): the currency symbol.
+                precedes (bool): whether the symbol precedes the number.
+                separated (bool): whether a space separates the symbol
+                    and the number.
+                sign (str): the positive or negative sign.
+                sign_position (int): one of the ``SIGN_*`` positions.
+
+            Returns:
+                tuple: the prefix and suffix strings.
+        """
+        symbol = str(symbol)
+        sign = str(sign)
+        space = ' ' if separated else ''
+        prefix = '{}{}'.format(symbol, space) if precedes else ''
+        suffix = '' if precedes else '{}{}'.format(space, symbol)
+
+        if sign_position == SIGN_PARANTHESES:
+            return '({}'.format(prefix), '{})'.format(suffix)
+
+        if sign_position == SIGN_FOLLOW_VALUE_SYMBOL:
+            return prefix, '{}{}'.format(suffix, sign)
+
+        if sign_position == SIGN_PRECEDE_VALUE:
+            return '{}{}'.format(prefix, sign), suffix
+
+        if sign_position == SIGN_FOLLOW_VALUE:
+            return prefix, '{}{}'.format(sign, suffix)
+
+        # SIGN_PRECEDE_VALUE_SYMBOL and any unknown position
+        return '{}{}'.format(sign, prefix), suffix
+
+    def format(self, value):
+        """Returns the provided value in this currency format.
+
+            Parameters:
+                value (dec): The decimal to represent as a currency.
+
+            Returns:
+                str: The formatted currency value.
+        """
+        return next(self.format_many((value,)))
+
+    def format_many(self, values):
+        """Yields each of the provided values in this currency format.
+
+            The formatting state is looked up once for all values, so
+            this is faster than calling ``format`` for each value.
+
+            Parameters:
+                values (iterable): The decimals to represent as
+                    currencies.
+
+            Yields:
+                str: The formatted currency values, in order.
+        """
+        quantum = self.quantum
+        decimal_point = self.decimal_point
+        grouping = self.grouping
+        join_groups = self.thousands_sep.join
+        positive = self.positive
+        negative = self.negative
+
+        for value in values:
+            if not isinstance(value, Decimal):
+                value = Decimal(value)
+
+            # Uses ROUND_HALF_UP, to give the most intuitive result to a
+            # typical user; the sign is part of the compiled layout
+            num_whole, _, num_frac = str(
+                abs(value).quantize(quantum, rounding=ROUND_HALF_UP)
+            ).partition('.')
+            length = len(num_whole)
+
+            if 0 < grouping < length:
+                first = length % grouping or grouping
+                num_whole = join_groups(
+                    [num_whole[:first]] + [
+                        num_whole[index:index + grouping]
+                        for index in range(first, length, grouping)
+                    ]
+                )
+
+            prefix, suffix = negative if value < 0 else positive
+
+            yield prefix + num_whole + decimal_point + num_frac + suffix
+
+
 class Currency():
     """Defines and outputs formatted currency strings.
 
@@ -246,6 +395,10 @@ class Currency():
         self.international = False
         self.locale = None
         self.conventions = self._assign_currency_conventions(currency_locale)
+        self.formats = (
+            CurrencyFormat(self.conventions),
+            CurrencyFormat(self.conventions, international=True),
+        )
 
     def _assign_currency_conventions(self, currency_locale):
         """Assigns currency conventions based on specified locale.
@@ -288,16 +441,25 @@ class Currency():
 
         return CURRENCY[self.locale]
 
+    def _legacy_format(self):
+        """Returns the compiled formatter selected by ``international``.
+
+            The helper methods below predate ``format_currency`` and
+            are kept for compatibility; they delegate to the compiled
+            formatters instead of reading the conventions again.
+
+            Returns:
+                obj: The CurrencyFormat instance.
+        """
+        return self.formats[bool(self.international)]
+
     def _determine_frac_digits(self):
         """Determines number of fractional digits to round to.
 
             Returns:
                 int: the number of fractional digits for currency display.
         """
-        if self.international:
-            return self.conventions['int_frac_digits']
-
-        return self.conventions['frac_digits']
+        return -self._legacy_format().quantum.as_tuple().exponent
 
     def _split_value(self, value):
         """Splits provided value into whole and fractional parts.
@@ -309,22 +471,11 @@ class Currency():
                 tuple: the whole number and fractional number
                     components as strings.
         """
-        # Determine number of fractional digits to use for this value
-        digits = self._determine_frac_digits()
-
-        # Round to required number of digits:
-        #   - uses ROUND_HALF_UP, to give the most intuitive result to a
-        #     typical user
-        #   - uses absolute value as negative signs will be applied later
-        decimal_str = abs(value).quantize(
-            Decimal(10) ** -digits, rounding=ROUND_HALF_UP,
-        )
-
-        # Split decimal into whole and fractions
-        try:
-            num_whole, num_frac = str(decimal_str).split('.')
-        except ValueError:
-            num_whole, num_frac = str(decimal_str), ''
+        num_whole, _, num_frac = str(
+            abs(value).quantize(
+                self._legacy_format().quantum, rounding=ROUND_HALF_UP,
+            )
+        ).partition('.')
 
         return num_whole, num_frac
 
@@ -359,22 +510,16 @@ class Currency():
             Returns:
                 str: combined value, separated by the decimal separator.
         """
-        frac_digits = self._determine_frac_digits()
-
-        # Determines decimal separator (only required if currency uses fractions)
-        if frac_digits > 0:
-            dec_separator = self.conventions['mon_decimal_point']
-        else:
-            dec_separator = ''
-
-        # Assemble and return the formatted value
         return '{}{}{}'.format(
-            num_whole, dec_separator, num_frac
+            num_whole, self._legacy_format().decimal_point, num_frac
         )
 
     def _determine_symbol_details(self, negative_value):
         """Determines positioning of required symbols.
 
+            Deprecated: the symbols are part of the compiled layout of
+            ``CurrencyFormat`` and this method is no longer used.
+
             Parameters:
                 negative_value (bool): whether this is a negative
                     value or not.
@@ -382,6 +527,12 @@ class Currency():
             Returns:
                 obj: Currency symbol and positioning details.
         """
+        warnings.warn(
+            'Currency._determine_symbol_details is deprecated and will be '
+            'removed in a future version of django-flexible-subscriptions.',
+            DeprecationWarning,
+        )
+
         # Determine which symbol to use
         if self.international:
             symbol = self.conventions['int_curr_symbol']
@@ -419,41 +570,10 @@ class Currency():
             Returns:
                 str: the final value formatted as a currency value.
         """
-        # '<' and '>' are used as markers of number start and end
-        placeholder_value = '<{}>'.format(value)
-
-        # Determine details of additional formatting
-        symbol = self._determine_symbol_details(negative_value)
-
-        if symbol['precedes']:
-            placeholder_value = '{}{}{}'.format(
-                symbol['symbol'], symbol['separated'], placeholder_value
-            )
-        else:
-            placeholder_value = '{}{}{}'.format(
-                placeholder_value, symbol['separated'], symbol['symbol']
-            )
-
-        # Insert the proper sign for positive/negative values
-        if symbol['sign_position'] == 0:
-            placeholder_value = '({})'.format(placeholder_value)
-        elif symbol['sign_position'] == 1:
-            placeholder_value = '{}{}'.format(symbol['sign'], placeholder_value)
-        elif symbol['sign_position'] == 2:
-            placeholder_value = '{}{}'.format(placeholder_value, symbol['sign'])
-        elif symbol['sign_position'] == 3:
-            placeholder_value = placeholder_value.replace('<', symbol['sign'])
-        elif symbol['sign_position'] == 4:
-            placeholder_value = placeholder_value.replace('>', symbol['sign'])
-        else:
-            placeholder_value = '{}{}'.format(symbol['sign'], placeholder_value)
+        layout = self._legacy_format()
+        prefix, suffix = layout.negative if negative_value else layout.positive
 
-        # Remove the placeholders for number start/end
-        formatted_currency = (
-            placeholder_value.replace('<', '').replace('>', '')
-        )
-
-        return formatted_currency
+        return '{}{}{}'.format(prefix, value, suffix)
 
     def format_currency(self, value, international=False):
         """Returns the provided value in the proper currency format.
@@ -466,22 +586,18 @@ class Currency():
             Returns:
                 str: The formatted currency value.
         """
-        # Assign international status for currency format
-        self.international = international
-
-        # Convert value to decimal for future operations
-        value = Decimal(value)
-
-        # Split value into whole and fractional parts
-        num_whole, num_frac = self._split_value(value)
+        return self.formats[bool(international)].format(value)
 
-        # Apply any grouping to the whole number component
-        grouped_num_whole = self._group_whole_num(num_whole)
+    def format_many(self, values, international=False):
+        """Yields the provided values in the proper currency format.
 
-        # Rejoin whole and fractional numbers with decimal separator
-        formatted_value = self._format_value(grouped_num_whole, num_frac)
-
-        # Add currency and positive/negative symbols
-        formatted_currency = self.add_symbols(formatted_value, bool(value < 0))
+            Parameters:
+                values (iterable): The decimals to represent as
+                    currencies.
+                international (bool): Whether these should follow
+                    international formatting or not.
 
-        return formatted_currency
+            Yields:
+                str: The formatted currency values, in order.
+        """
+        return self.formats[bool(international)].format_many(values)
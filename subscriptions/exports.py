@@ -0,0 +1,194 @@
+"""Streaming exports of the subscription transaction ledger."""
+import csv
+import json
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+from uuid import UUID
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from subscriptions import models
+from subscriptions.conf import SETTINGS
+
+
+# Number of transactions read per query
+DEFAULT_CHUNK_SIZE = 1000
+
+# Leading characters that make spreadsheets evaluate a cell
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+EXPORT_FIELDS = (
+    'id',
+    'date_transaction',
+    'user_id',
+    'username',
+    'plan_cost_id',
+    'amount',
+    'formatted_amount',
+)
+
+
+class _Echo():
+    """File-like object returning what is written, for ``csv.writer``."""
+    def write(self, value):  # pylint: disable=no-self-use
+        """Returns the value instead of buffering it."""
+        return value
+
+
+def parse_export_datetime(value):
+    """Parses a date or datetime filter of an export.
+
+        Parameters:
+            value (str): An ISO 8601 date or datetime.
+
+        Returns:
+            obj: The datetime (midnight for dates), aware if time zone
+                support is active.
+
+        Raises:
+            ValueError: The value is not a valid date or datetime.
+    """
+    parsed = parse_datetime(value)
+
+    if parsed is None:
+        date = parse_date(value)
+
+        if date is None:
+            raise ValueError('{} is not an ISO 8601 date or datetime.'.format(value))
+
+        parsed = datetime.combine(date, time())
+
+    if settings.USE_TZ and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+
+    return parsed
+
+
+def filter_transactions(start=None, end=None, user=None):
+    """Returns the transactions to export.
+
+        Parameters:
+            start (obj): Only include transactions on or after this
+                datetime.
+            end (obj): Only include transactions before this datetime.
+            user (str): Only include transactions of the user with
+                this primary key.
+
+        Returns:
+            obj: A SubscriptionTransaction queryset.
+    """
+    queryset = models.SubscriptionTransaction.objects.all()
+
+    if start is not None:
+        queryset = queryset.filter(date_transaction__gte=start)
+
+    if end is not None:
+        queryset = queryset.filter(date_transaction__lt=end)
+
+    if user is not None:
+        queryset = queryset.filter(user_id=user)
+
+    return queryset
+
+
+def transaction_rows(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields the export rows of transactions.
+
+        Transactions are read in chunks ordered by
+        ``(date_transaction, id)``, each one starting after the last
+        row of the previous chunk, so memory use does not grow with
+        the size of the ledger.
+
+        Parameters:
+            queryset (obj): The SubscriptionTransaction queryset.
+            chunk_size (int): The number of transactions per query.
+
+        Yields:
+            dict: The ``EXPORT_FIELDS`` values of a transaction.
+    """
+    queryset = queryset.order_by('date_transaction', 'id').values_list(
+        'id',
+        'date_transaction',
+        'user_id',
+        'user__{}'.format(get_user_model().USERNAME_FIELD),
+        'subscription_id',
+        'amount',
+    )
+    chunk = list(queryset[:chunk_size])
+
+    while chunk:
+        formatted_amounts = SETTINGS['currency'].format_many(
+            row[5] for row in chunk if row[5] is not None
+        )
+
+        for row in chunk:
+            # Transactions without an amount have no formatted amount
+            formatted_amount = '' if row[5] is None else next(formatted_amounts)
+            yield dict(zip(EXPORT_FIELDS, row + (formatted_amount,)))
+
+        if len(chunk) < chunk_size:
+            return
+
+        last_id, last_date = chunk[-1][0], chunk[-1][1]
+        chunk = list(queryset.filter(
+            Q(date_transaction__gt=last_date)
+            | Q(date_transaction=last_date, id__gt=last_id)
+        )[:chunk_size])
+
+
+def _export_value(value):
+    """Returns a JSON and CSV friendly representation of a value."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+
+    if isinstance(value, (Decimal, UUID)):
+        return str(value)
+
+    return value
+
+
+def _csv_cell(value):
+    """Returns a CSV cell that spreadsheets will not run as a formula.
+
+        Text starting with a formula character (e.g. a username of
+        ``=HYPERLINK(...)``) is prefixed with ``'`` so it is shown as
+        text. Negative numbers are left as numbers.
+    """
+    value = _export_value(value)
+
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        try:
+            Decimal(value)
+        except InvalidOperation:
+            return "'{}".format(value)
+
+    return value
+
+
+def csv_lines(rows):
+    """Yields the rows as CSV lines, starting with a header."""
+    writer = csv.writer(_Echo())
+
+    yield writer.writerow(EXPORT_FIELDS)
+
+    for row in rows:
+        yield writer.writerow([_csv_cell(row[field]) for field in EXPORT_FIELDS])
+
+
+def jsonl_lines(rows):
+    """Yields the rows as JSON lines."""
+    for row in rows:
+        yield '{}\n'.format(json.dumps({
+            field: _export_value(row[field]) for field in EXPORT_FIELDS
+        }))
+
+
+# The line generator and content type of each export format
+EXPORT_FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'jsonl': (jsonl_lines, 'application/x-ndjson'),
+}
@@ -153,13 +153,15 @@ class SubscriptionPlanCostForm(forms.Form):
             Keyword Arguments:
                 subscription_plan (obj): A SubscriptionPlan instance.
         """
-        costs = kwargs.pop('subscription_plan').costs.all()
+        costs = list(kwargs.pop('subscription_plan').costs.all())
         PLAN_COST_CHOICES = []
+        formatted_costs = SETTINGS['currency'].format_many(
+            cost.cost for cost in costs
+        )
 
-        for cost in costs:
+        for cost, formatted_cost in zip(costs, formatted_costs):
             radio_text = '{} {}'.format(
-                SETTINGS['currency'].format_currency(cost.cost),
-                cost.display_billing_frequency_text
+                formatted_cost, cost.display_billing_frequency_text
             )
             PLAN_COST_CHOICES.append((cost.id, radio_text))
 
@@ -1,135 +1,1687 @@
 """Utility/helper functions for Django Flexible Subscriptions."""
-from django.db.models import Q
+import asyncio
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from datetime import timedelta
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+from uuid import UUID
+
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.db.models import Count, F, Q, Sum
 from django.utils import timezone
 from subscriptions import models
+from subscriptions.management.commands import _metrics
+
+
+# Chunk size for claimed processing and for the rows fetched per query
+# when no batch size is set
+DEFAULT_BATCH_SIZE = 100
+
+# Subscriptions with billing due are processed most overdue first, the
+# other phases walk the subscriptions by primary key
+PK_ORDERING = ('pk',)
+DUE_ORDERING = ('date_billing_next', 'pk')
+
+# Policies for charging the missed periods of an overdue subscription
+CATCH_UP_EACH = 'each'
+CATCH_UP_AGGREGATE = 'aggregate'
+
+# The BillingRun fields storing the checkpoint for each ordering field
+_CHECKPOINT_FIELDS = {
+    'date_billing_next': 'last_date_billing_next',
+    'pk': 'last_subscription_id',
+}
+
+
+def _revoke_group_memberships(subscriptions):
+    """Removes users from the groups of their expiring subscriptions.
+
+        A user keeps a group if they have another active subscription
+        to a plan with the same group. All of the (user, group) pairs
+        are checked with a single query and the memberships that are
+        no longer needed are removed with one delete per group on the
+        user groups table (so no ``m2m_changed`` signals are sent).
+
+        Parameters:
+            subscriptions (list): The expiring UserSubscription
+                instances.
+    """
+    subscription_ids = [subscription.pk for subscription in subscriptions]
+    pairs = set(
+        models.UserSubscription.objects.filter(
+            pk__in=subscription_ids,
+            user__isnull=False,
+            subscription_plan__group__isnull=False,
+        ).values_list('user_id', 'subscription_plan__group_id')
+    )
+
+    if not pairs:
+        return
+
+    # Remove pairs where the user has another active subscription
+    pairs -= set(
+        models.UserSubscription.objects.filter(
+            active=True,
+            cancelled=False,
+            user_id__in={user_id for user_id, _ in pairs},
+            subscription_plan__group_id__in={group_id for _, group_id in pairs},
+        ).exclude(
+            pk__in=subscription_ids,
+        ).values_list('user_id', 'subscription_plan__group_id')
+    )
+
+    # Delete per group, as one condition per pair exceeds the expression
+    # depth limit of SQLite for large chunks
+    user_ids_by_group = defaultdict(list)
+
+    for user_id, group_id in pairs:
+        user_ids_by_group[group_id].append(user_id)
+
+    user_groups = get_user_model().groups.through.objects
+
+    for group_id, user_ids in user_ids_by_group.items():
+        user_groups.filter(group_id=group_id, user_id__in=user_ids).delete()
+
+
+def _keyset_condition(ordering, cursor):
+    """Returns a Q object matching the rows after a cursor.
+
+        Parameters:
+            ordering (tuple): The field names the rows are ordered by.
+            cursor (tuple): The ordering values of the last row.
+
+        Returns:
+            obj: A Q object for the rows that follow the cursor.
+    """
+    conditions = []
+    equal = {}
+
+    for field, value in zip(ordering, cursor):
+        conditions.append(Q(**equal, **{'{}__gt'.format(field): value}))
+        equal[field] = value
+
+    return reduce(or_, conditions)
+
+
+def _unclaimed(current):
+    """Returns a Q object for subscriptions no runner has claimed.
+
+        Parameters:
+            current (obj): The datetime to check the claims at.
+
+        Returns:
+            obj: A Q object for subscriptions without a claim or with
+                an expired one.
+    """
+    return (
+        Q(date_claim_expires__isnull=True)
+        | Q(date_claim_expires__lte=current)
+    )
+
+
+def _set_claim(subscriptions, expires):
+    """Claims subscriptions until a datetime or releases them.
+
+        Parameters:
+            subscriptions (list): UserSubscription instances.
+            expires (obj): The datetime the claim expires at, or
+                ``None`` to release the claim.
+    """
+    if subscriptions:
+        models.UserSubscription.objects.filter(
+            pk__in=[subscription.pk for subscription in subscriptions]
+        ).update(date_claim_expires=expires)
+
+
+def _hook_name(func):
+    """Returns the name to record the timings of a hook under."""
+    return getattr(func, '__name__', type(func).__name__)
+
+
+class _Batch():
+    """Collects the database writes for a chunk of subscriptions.
+
+        Subscription updates and new transactions are held in memory
+        and written with a single ``bulk_update`` and ``bulk_create``
+        when the chunk is flushed. Notifications are deferred until
+        the writes have been committed.
+    """
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.subscriptions = {}
+        self.fields = set()
+        self.transactions = []
+        self.expired = []
+        self.notifications = []
+
+    def flush(self):
+        """Writes all collected changes and sends notifications."""
+        with self.metrics.timer('flush'), transaction.atomic():
+            if self.expired:
+                with self.metrics.timer('revoke_groups'):
+                    _revoke_group_memberships(self.expired)
+
+            if self.subscriptions:
+                models.UserSubscription.objects.bulk_update(
+                    list(self.subscriptions.values()), sorted(self.fields)
+                )
+
+            if self.transactions:
+                models.SubscriptionTransaction.objects.bulk_create(
+                    self.transactions
+                )
+
+        for notify, subscription in self.notifications:
+            with self.metrics.timer(_hook_name(notify)):
+                notify(subscription)
+
+
+class Manager():
+    """Manager object to help manage subscriptions & billing.
+
+        Attributes:
+            batch_size (int): when set, subscriptions are processed in
+                chunks of this size (walked by primary key) and the
+                resulting updates and transactions are written in bulk
+                once per chunk. Defaults to ``None``, which saves each
+                subscription as it is processed.
+            claim (bool): whether to claim each chunk of subscriptions
+                (locked with ``SELECT ... FOR UPDATE SKIP LOCKED``)
+                while it is processed. This allows several runners to
+                process subscriptions at the same time without billing
+                any subscription twice.
+            claim_timeout (obj): The timedelta after which the claim of
+                a runner that stopped without releasing it expires.
+            resume (bool): whether to continue the latest BillingRun
+                if it did not complete, instead of starting a new run.
+            time_limit (float): when set, the maximum number of seconds
+                a run may take. Once reached, the run stops before the
+                next subscription and the remaining subscriptions are
+                left for the next run.
+            max_rate (float): when set, the maximum number of payment
+                calls (``process_payment`` and ``reconcile_payment``)
+                per second.
+            retry_delay (obj): The timedelta to wait before retrying
+                the first failed payment of a subscription.
+            retry_backoff (int): The factor the retry delay grows by
+                with each further failed payment.
+            retry_delay_max (obj): The longest timedelta to wait
+                before retrying a failed payment.
+            max_payment_failures (int): when set, a subscription is
+                expired once this many payments in a row have failed.
+            bulk_free_renewals (bool): whether due subscriptions to
+                free plans (a cost of zero or no cost) are renewed with
+                set-based updates by ``process_free_due`` instead of
+                ``process_due``. Defaults to ``False``, as
+                ``process_due`` and its hooks are then skipped for
+                free plans.
+            record_free_transactions (bool): whether a zero amount
+                SubscriptionTransaction is recorded for each renewal
+                of a free plan. Defaults to ``True``.
+            catch_up (bool): whether a subscription that is several
+                periods overdue is charged for all of its missed
+                periods at once (see ``catch_up_policy``) and moved to
+                its first future billing date. Defaults to ``False``,
+                which charges one period per run.
+            counts (obj): A Counter of the subscriptions that were
+                expired, activated and renewed and of the payment
+                errors and unresolved payments during processing.
+            run (obj): The BillingRun recording the progress of the
+                current (unsharded) run.
+            stopped (bool): whether the last run stopped early because
+                the ``time_limit`` was reached.
+            metrics (obj): The Metrics collecting the timings of each
+                phase and hook and the number of processed
+                subscriptions.
+            metrics_sinks (list): The MetricsSink instances the metrics
+                are published to by ``emit_metrics``. Defaults to a
+                LoggingSink.
+    """
+    batch_size = None
+    claim = False
+    claim_timeout = timedelta(hours=1)
+    resume = False
+    time_limit = None
+    max_rate = None
+    retry_delay = timedelta(days=1)
+    retry_backoff = 2
+    retry_delay_max = timedelta(days=7)
+    max_payment_failures = None
+    bulk_free_renewals = False
+    record_free_transactions = True
+    catch_up = False
+
+    _batch = None
+
+    def __init__(self):
+        self.counts = Counter()
+        self.run = None
+        self.stopped = False
+        self.metrics = _metrics.Metrics()
+        self.metrics_sinks = [_metrics.LoggingSink()]
+        self._deadline = None
+        self._next_payment_call = None
+
+    def process_subscriptions(self, shard=None):
+        """Calls all required subscription processing functions.
+
+            Unless a shard is processed, the progress of the run is
+            saved as a BillingRun after every chunk of subscriptions.
+            Subscriptions with billing due are processed most overdue
+            first and are billed at most once per run. If the
+            ``time_limit`` is reached the run stops and is left
+            incomplete.
+
+            Parameters:
+                shard (tuple): An optional ``(index, total)`` tuple to
+                    only process the subscriptions belonging to one of
+                    ``total`` disjoint shards.
+        """
+        with self.metrics.timer('run' if shard is None else 'shard'):
+            self._process_phases(shard)
+
+    def _process_phases(self, shard):
+        """Processes the expired, new and due subscriptions in turn.
+
+            Parameters:
+                shard (tuple): The ``(index, total)`` shard or ``None``.
+        """
+        self.stopped = False
+
+        if self.time_limit is not None:
+            self._deadline = time.monotonic() + self.time_limit
+
+        if shard is None:
+            self.run = self._start_run()
+            current = self.run.date_reference
+        else:
+            current = timezone.now()
+
+        expired, new, due = self._phase_conditions(current)
+        paid_due = self._paid_due_condition(due)
+
+        phases = (
+            # Handle expired subscriptions
+            (
+                models.RUN_EXPIRED,
+                expired,
+                self.process_expired,
+                PK_ORDERING,
+            ),
+            # Handle new subscriptions
+            (
+                models.RUN_NEW,
+                new,
+                self.process_new,
+                PK_ORDERING,
+            ),
+            # Handle subscriptions with billing due
+            (
+                models.RUN_DUE,
+                paid_due,
+                self.process_due,
+                DUE_ORDERING,
+            ),
+        )
+
+        phase_names = dict(models.RUN_PHASE_CHOICES)
+
+        for phase, condition, handler, ordering in phases:
+            cursor = self._start_phase(phase, ordering)
+
+            if cursor is False:
+                # Phase was completed by the resumed run
+                continue
+
+            with self.metrics.timer('phase_{}'.format(phase_names[phase])):
+                if phase == models.RUN_DUE and self.bulk_free_renewals:
+                    # Safe to repeat on resume, renewed rows are no longer due
+                    self.process_free_due(self._shard_queryset(
+                        models.UserSubscription.objects.filter(
+                            due, plan_cost__isnull=False,
+                        ).exclude(plan_cost__cost__gt=0),
+                        shard,
+                    ))
+
+                self._process_queryset(
+                    self._shard_queryset(self.get_subscriptions(condition), shard),
+                    handler,
+                    ordering,
+                    cursor,
+                )
+
+            if self.stopped:
+                # Leave the run incomplete so it can be resumed
+                return
+
+        self._start_phase(models.RUN_COMPLETE)
+
+    @staticmethod
+    def _phase_conditions(current):
+        """Returns the conditions for the subscriptions to process.
+
+            Parameters:
+                current (obj): The datetime of the run.
+
+            Returns:
+                tuple: Q objects for the expired, new and due
+                    subscriptions.
+        """
+        # Subscriptions with failed payments wait for their retry date
+        retry_due = (
+            Q(date_payment_retry__isnull=True)
+            | Q(date_payment_retry__lte=current)
+        )
+        expired = (
+            Q(active=True) & Q(cancelled=False)
+            & Q(date_billing_end__lte=current)
+        )
+        new = (
+            Q(active=False) & Q(cancelled=False)
+            & Q(date_billing_start__lte=current) & retry_due
+        )
+        due = (
+            Q(active=True) & Q(cancelled=False)
+            & Q(date_billing_next__lte=current) & retry_due
+            # Skip subscriptions already billed by this run
+            & ~Q(date_billing_last__gte=current)
+        )
+
+        return expired, new, due
+
+    def _paid_due_condition(self, due):
+        """Returns the condition for the due subscriptions to charge.
+
+            Parameters:
+                due (obj): The Q object for the due subscriptions.
+
+            Returns:
+                obj: A Q object for the due subscriptions renewed by
+                    ``process_due``.
+        """
+        if self.bulk_free_renewals:
+            # Free plans are renewed by process_free_due
+            return due & Q(plan_cost__cost__gt=0)
+
+        return due
+
+    def forecast(self, until=None):
+        """Forecasts the outcome of a run without processing it.
+
+            Only aggregate queries are made: nothing is saved and no
+            payments are processed. Payments are assumed to succeed
+            and are counted like the run makes them: every new
+            subscription is charged, and due subscriptions of free
+            plans are only charged if ``bulk_free_renewals`` is off.
+            In ``catch_up`` mode each missed period is counted as one
+            payment (see ``_forecast_catch_up``).
+
+            Parameters:
+                until (obj): The datetime of the run to forecast
+                    (defaults to the current datetime).
+
+            Returns:
+                dict: The number of subscriptions that would be
+                    ``expired``, activated (``new``) and ``renewed``,
+                    the number of ``payments`` and the expected
+                    ``revenue``.
+        """
+        current = until or timezone.now()
+        expired, new, due = self._phase_conditions(current)
+        subscriptions = models.UserSubscription.objects.order_by()
+        # Every new subscription is charged, even for a free plan
+        new_totals = subscriptions.filter(new).aggregate(
+            count=Count('pk'),
+            payments=Count('pk'),
+            revenue=Sum('plan_cost__cost'),
+        )
+        # Expired subscriptions are no longer active when due ones are
+        due_subscriptions = subscriptions.filter(due).exclude(expired)
+        totals = {
+            'count': Count('pk'),
+            'payments': Count('pk', filter=self._paid_due_condition(due)),
+            'revenue': Sum(
+                'plan_cost__cost', filter=self._paid_due_condition(due)
+            ),
+        }
+
+        if self.catch_up:
+            due_totals = self._forecast_catch_up(
+                due_subscriptions, totals, current
+            )
+        else:
+            due_totals = due_subscriptions.aggregate(**totals)
+
+        return {
+            'until': current,
+            'expired': subscriptions.filter(expired).count(),
+            'new': new_totals['count'],
+            'renewed': due_totals['count'],
+            'payments': new_totals['payments'] + due_totals['payments'],
+            'revenue': (
+                Decimal(new_totals['revenue'] or 0)
+                + Decimal(due_totals['revenue'] or 0)
+            ),
+        }
+
+    def _forecast_catch_up(self, queryset, totals, current):
+        """Forecasts the renewals of due subscriptions in catch-up mode.
+
+            Subscriptions that are due for one period at most are
+            counted with a single aggregate query. Only the ones that
+            can be further overdue are grouped by their billing dates
+            to count their missed periods.
+
+            Parameters:
+                queryset (obj): A UserSubscription queryset of the due
+                    subscriptions.
+                totals (dict): The aggregates to count the ``count``,
+                    ``payments`` and ``revenue`` with.
+                current (obj): The datetime of the run.
+
+            Returns:
+                dict: The ``count``, ``payments`` and ``revenue`` of
+                    the renewals.
+        """
+        recurrences = queryset.values_list(
+            'plan_cost__recurrence_unit', 'plan_cost__recurrence_period',
+        ).distinct()
+        conditions = [
+            Q(plan_cost__recurrence_unit=unit, plan_cost__recurrence_period=period)
+            & self._one_period_condition(models.billing_step(unit, period), current)
+            for unit, period in recurrences
+        ]
+
+        if not conditions:
+            return {'count': 0, 'payments': 0, 'revenue': 0}
+
+        one_period = reduce(or_, conditions)
+        due_totals = queryset.filter(one_period).aggregate(**totals)
+        due_totals['revenue'] = due_totals['revenue'] or 0
+        groups = queryset.exclude(one_period).values(
+            'plan_cost__recurrence_unit',
+            'plan_cost__recurrence_period',
+            'plan_cost__cost',
+            'date_billing_next',
+            'date_billing_start',
+        ).annotate(subscriptions=totals['count'], payments=totals['payments'])
+
+        for group in groups:
+            periods, _ = self._missed_periods(
+                group['date_billing_next'],
+                models.billing_step(
+                    group['plan_cost__recurrence_unit'],
+                    group['plan_cost__recurrence_period'],
+                ),
+                current,
+                group['date_billing_start'],
+            )
+            payments = group['payments'] * periods
+            due_totals['count'] += group['subscriptions']
+            due_totals['payments'] += payments
+            due_totals['revenue'] += payments * (group['plan_cost__cost'] or 0)
+
+        return due_totals
+
+    @staticmethod
+    def _one_period_condition(step, current):
+        """Returns the condition for subscriptions due for one period.
+
+            Parameters:
+                step (obj): The step between billing dates (see
+                    ``models.billing_step``).
+                current (obj): The datetime of the run.
+
+            Returns:
+                obj: A Q object matching due subscriptions whose second
+                    billing period starts after ``current``.
+        """
+        if step is None:
+            return Q()
+
+        if isinstance(step, int):
+            # Billing dates in the last ``step`` months (this month
+            # included) are followed by one after the end of this month
+            month_start = current.replace(
+                day=1, hour=0, minute=0, second=0, microsecond=0
+            )
+
+            return Q(date_billing_next__gte=models.add_months(month_start, 1 - step))
+
+        return Q(date_billing_next__gt=current - step)
+
+    def emit_metrics(self):
+        """Publishes the metrics of the run to the ``metrics_sinks``.
+
+            The ``counts`` are added to the metrics as counters first,
+            so this should be called once at the end of a run.
+        """
+        for name, value in self.counts.items():
+            self.metrics.increment(name, value)
+
+        for sink in self.metrics_sinks:
+            sink.emit(self.metrics)
+
+    def _start_run(self):
+        """Returns the BillingRun to record the progress of this run in.
+
+            Returns:
+                obj: The latest BillingRun if ``resume`` is set and it
+                    did not complete, otherwise a new BillingRun.
+        """
+        if self.resume:
+            run = models.BillingRun.objects.order_by('-date_started').first()
+
+            if run and run.phase != models.RUN_COMPLETE:
+                return run
+
+        return models.BillingRun.objects.create(date_reference=timezone.now())
+
+    def _start_phase(self, phase, ordering=PK_ORDERING):
+        """Records the start of a processing phase.
+
+            Parameters:
+                phase (str): The phase being started.
+                ordering (tuple): The fields the phase processes the
+                    subscriptions by.
+
+            Returns:
+                obj: ``False`` if a resumed run already completed this
+                    phase, otherwise the cursor to continue after
+                    (``None`` to start from the beginning).
+        """
+        if self.run is None:
+            return None
+
+        if self.run.phase > phase:
+            return False
+
+        if self.run.phase == phase:
+            if self.run.last_subscription_id is None:
+                return None
+
+            return tuple(
+                getattr(self.run, _CHECKPOINT_FIELDS[field])
+                for field in ordering
+            )
+
+        self.run.phase = phase
+        fields = sorted(_CHECKPOINT_FIELDS.values())
+
+        for field in fields:
+            setattr(self.run, field, None)
+
+        self.run.save(update_fields=['phase', *fields, 'date_updated'])
+
+        return None
+
+    def _save_checkpoint(self, ordering, cursor):
+        """Records the last subscription processed in the current phase.
+
+            Parameters:
+                ordering (tuple): The fields the phase processes the
+                    subscriptions by.
+                cursor (tuple): The ordering values of the last
+                    processed subscription.
+        """
+        if self.run is None:
+            return
+
+        fields = [_CHECKPOINT_FIELDS[field] for field in ordering]
+
+        for field, value in zip(fields, cursor):
+            setattr(self.run, field, value)
+
+        self.run.save(update_fields=[*fields, 'date_updated'])
+
+    def get_subscriptions(self, condition):  # pylint: disable=no-self-use
+        """Returns the subscriptions to process for a condition.
+
+            Loads the related models used while processing in the same
+            query, so handling a subscription does not require any
+            further lookups.
+
+            Parameters:
+                condition (obj): A Q object to filter the
+                    subscriptions by.
+
+            Returns:
+                obj: A UserSubscription queryset.
+        """
+        return models.UserSubscription.objects.filter(condition).select_related(
+            'user', 'plan_cost', 'subscription_plan__group',
+        )
+
+    def process_subscriptions_parallel(self, workers):
+        """Processes all subscriptions with a pool of worker threads.
+
+            Subscriptions are split into one disjoint shard per worker
+            and each shard is processed by a copy of this manager on
+            its own thread (and therefore its own database connection).
+            The counts of all workers are combined into ``counts`` and
+            the ``max_rate`` is split evenly between the workers.
+
+            Parameters:
+                workers (int): The number of worker threads to use.
+        """
+        with self.metrics.timer('run'), ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(self._process_shard, (index, workers))
+                for index in range(workers)
+            ]
+
+            for future in futures:
+                manager = future.result()
+                self.counts.update(manager.counts)
+                self.stopped = self.stopped or manager.stopped
+
+    def _process_shard(self, shard):
+        """Processes a single shard on a copy of this manager.
+
+            Parameters:
+                shard (tuple): The ``(index, total)`` shard to process.
+
+            Returns:
+                obj: The manager that processed the shard.
+        """
+        manager = copy(self)
+        manager.counts = Counter()
+        manager.run = None
+
+        if self.max_rate:
+            manager.max_rate = self.max_rate / shard[1]
+
+        try:
+            manager.process_subscriptions(shard=shard)
+        finally:
+            # Each worker thread opens its own connections
+            connections.close_all()
+
+        return manager
+
+    @staticmethod
+    def _shard_queryset(queryset, shard):
+        """Restricts a queryset to the subscriptions in one shard.
+
+            UserSubscription IDs are random UUIDs, so splitting the
+            UUID space into equal primary key ranges gives evenly sized
+            shards that can still use the primary key index.
+
+            Parameters:
+                queryset (obj): A UserSubscription queryset.
+                shard (tuple): The ``(index, total)`` shard or ``None``.
+
+            Returns:
+                obj: The filtered queryset.
+        """
+        if shard is None:
+            return queryset
+
+        index, total = shard
+        queryset = queryset.filter(pk__gte=UUID(int=index * 2 ** 128 // total))
+
+        if index + 1 < total:
+            queryset = queryset.filter(
+                pk__lt=UUID(int=(index + 1) * 2 ** 128 // total)
+            )
+
+        return queryset
+
+    def _process_queryset(self, queryset, handler, ordering=PK_ORDERING,
+                          cursor=None):
+        """Applies the handler to every subscription in the queryset.
+
+            Subscriptions are processed in chunks in the given order
+            and a checkpoint is saved after each chunk.
+
+            Parameters:
+                queryset (obj): A UserSubscription queryset.
+                handler (func): The method to process each
+                    subscription with.
+                ordering (tuple): The fields to process the
+                    subscriptions by.
+                cursor (tuple): Only process subscriptions after these
+                    ordering values.
+        """
+        if self.claim:
+            self._process_claimed(queryset, handler, ordering, cursor)
+            return
+
+        for chunk in self._chunk_queryset(
+                queryset, self.batch_size or DEFAULT_BATCH_SIZE, ordering, cursor
+        ):
+            # Read the cursors before the handler changes the subscriptions
+            cursors = [self._cursor(subscription, ordering) for subscription in chunk]
+
+            if self.batch_size:
+                processed = self._process_chunk(chunk, handler)
+            else:
+                processed = self._handle_chunk(chunk, handler)
+
+            if processed:
+                self._save_checkpoint(ordering, cursors[processed - 1])
+
+            if self.stopped:
+                return
+
+    def _process_claimed(self, queryset, handler, ordering=PK_ORDERING,
+                         cursor=None):
+        """Claims and processes the subscriptions chunk by chunk.
+
+            Each chunk is locked with ``SELECT ... FOR UPDATE SKIP
+            LOCKED`` and claimed until ``claim_timeout`` from now in a
+            short transaction, so rows that another runner has claimed
+            are skipped rather than processed twice. The chunk is then
+            processed outside of that transaction, so each billing
+            attempt is committed before its payment is made, and the
+            claim is released once the chunk is saved.
+
+            Parameters:
+                queryset (obj): A UserSubscription queryset.
+                handler (func): The method to process each
+                    subscription with.
+                ordering (tuple): The fields to process the
+                    subscriptions by.
+                cursor (tuple): Only process subscriptions after these
+                    ordering values.
+        """
+        batch_size = self.batch_size or DEFAULT_BATCH_SIZE
+        # Only lock the subscriptions, not the related rows
+        queryset = queryset.select_for_update(skip_locked=True, of=('self',))
+
+        while True:
+            current = timezone.now()
+
+            with transaction.atomic():
+                with self.metrics.timer('scan'):
+                    chunk = self._fetch_chunk(
+                        queryset.filter(_unclaimed(current)),
+                        ordering,
+                        cursor,
+                        batch_size,
+                    )
+
+                # The claim keeps other runners away once the row locks
+                # are released at the end of this transaction
+                _set_claim(chunk, current + self.claim_timeout)
+
+            cursors = [self._cursor(subscription, ordering) for subscription in chunk]
+
+            try:
+                processed = self._process_chunk(chunk, handler)
+            finally:
+                _set_claim(chunk, None)
+
+            if processed:
+                self._save_checkpoint(ordering, cursors[processed - 1])
+
+            if self.stopped or len(chunk) < batch_size:
+                return
+
+            cursor = cursors[-1]
+
+    def _process_chunk(self, chunk, handler):
+        """Applies the handler to a chunk and writes the changes in bulk.
+
+            Parameters:
+                chunk (list): UserSubscription instances to process.
+                handler (func): The method to process each
+                    subscription with.
+
+            Returns:
+                int: The number of subscriptions processed.
+        """
+        self._batch = _Batch(self.metrics)
+
+        try:
+            return self._handle_chunk(chunk, handler)
+        finally:
+            # Flush even if a handler fails so any payments that
+            # already went through are not lost
+            batch, self._batch = self._batch, None
+            batch.flush()
+
+    def _handle_chunk(self, chunk, handler):
+        """Applies the handler to a chunk until the time limit is reached.
+
+            Parameters:
+                chunk (list): UserSubscription instances to process.
+                handler (func): The method to process each
+                    subscription with.
+
+            Returns:
+                int: The number of subscriptions processed.
+        """
+        name = _hook_name(handler)
+
+        for index, subscription in enumerate(chunk):
+            if self._out_of_time():
+                self.stopped = True
+                self.metrics.increment('subscriptions', index)
+                return index
+
+            with self.metrics.timer(name):
+                handler(subscription)
+
+        self.metrics.increment('subscriptions', len(chunk))
+
+        return len(chunk)
+
+    def _out_of_time(self):
+        """Returns whether the ``time_limit`` of the run was reached."""
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
+    def _chunk_queryset(self, queryset, batch_size, ordering=PK_ORDERING,
+                        cursor=None):
+        """Yields lists of subscriptions in the given order.
+
+            Each chunk is retrieved with its own query that resumes
+            after the ordering values of the last row of the previous
+            chunk (keyset pagination), so only one chunk is held in
+            memory at a time. Unlike a long running cursor, rows
+            updated while processing can not shift later chunks.
+
+            Parameters:
+                queryset (obj): A UserSubscription queryset.
+                batch_size (int): The maximum size of each chunk.
+                ordering (tuple): The fields to order the subscriptions
+                    by, ending with the primary key.
+                cursor (tuple): Only yield subscriptions after these
+                    ordering values.
+
+            Yields:
+                list: Up to ``batch_size`` UserSubscription instances.
+        """
+        while True:
+            with self.metrics.timer('scan'):
+                chunk = self._fetch_chunk(queryset, ordering, cursor, batch_size)
+
+            if not chunk:
+                return
+
+            # Read the cursor before the chunk is processed
+            cursor = self._cursor(chunk[-1], ordering)
+
+            yield chunk
+
+            if len(chunk) < batch_size:
+                return
+
+    @staticmethod
+    def _fetch_chunk(queryset, ordering, cursor, batch_size):
+        """Retrieves the next chunk of subscriptions.
+
+            Parameters:
+                queryset (obj): A UserSubscription queryset.
+                ordering (tuple): The fields to order the subscriptions
+                    by, ending with the primary key.
+                cursor (tuple): The ordering values of the last row of
+                    the previous chunk or ``None`` for the first chunk.
+                batch_size (int): The maximum size of the chunk.
+
+            Returns:
+                list: Up to ``batch_size`` UserSubscription instances.
+        """
+        queryset = queryset.order_by(*ordering)
+
+        if cursor is not None:
+            queryset = queryset.filter(_keyset_condition(ordering, cursor))
+
+        return list(queryset[:batch_size])
+
+    @staticmethod
+    def _cursor(subscription, ordering):
+        """Returns the ordering values of a subscription.
+
+            Parameters:
+                subscription (obj): A UserSubscription instance.
+                ordering (tuple): The field names to read.
+
+            Returns:
+                tuple: The values of the ordering fields.
+        """
+        return tuple(getattr(subscription, field) for field in ordering)
+
+    def _throttle(self):
+        """Waits until the ``max_rate`` allows another payment call."""
+        delay = self._payment_delay()
+
+        if delay:
+            time.sleep(delay)
+
+    def _payment_delay(self):
+        """Reserves the next payment call allowed by the ``max_rate``.
+
+            Returns:
+                float: The number of seconds to wait before the call.
+        """
+        if not self.max_rate:
+            return 0
+
+        now = time.monotonic()
+        delay = 0
+
+        if self._next_payment_call is not None and now < self._next_payment_call:
+            delay = self._next_payment_call - now
+            now = self._next_payment_call
+
+        self._next_payment_call = now + 1 / self.max_rate
+
+        return delay
+
+    def _save_subscription(self, subscription, fields):
+        """Saves the subscription or queues it for a bulk update.
+
+            Parameters:
+                subscription (obj): A UserSubscription instance.
+                fields (list): The names of the fields that changed.
+        """
+        if self._batch is None:
+            subscription.save()
+        else:
+            self._batch.subscriptions[subscription.pk] = subscription
+            self._batch.fields.update(fields)
+
+    def _notify(self, notify, subscription):
+        """Sends a notification or defers it until the chunk is saved.
+
+            Parameters:
+                notify (func): The notification method to call.
+                subscription (obj): A UserSubscription instance.
+        """
+        if self._batch is None:
+            with self.metrics.timer(_hook_name(notify)):
+                notify(subscription)
+        else:
+            self._batch.notifications.append((notify, subscription))
+
+    def process_expired(self, subscription):
+        """Handles processing of expired/cancelled subscriptions.
+
+            Parameters:
+                subscription (obj): A UserSubscription instance.
+        """
+        # Remove the user from the plan group unless another active
+        # subscription still provides it
+        if self._batch is None:
+            with self.metrics.timer('revoke_groups'):
+                _revoke_group_memberships([subscription])
+        else:
+            self._batch.expired.append(subscription)
+
+        # Update this specific UserSubscription instance
+        subscription.active = False
+        subscription.cancelled = True
+        self._save_subscription(subscription, ['active', 'cancelled'])
+        self.counts['expired'] += 1
+
+        self._notify(self.notify_expired, subscription)
+
+    def process_new(self, subscription):
+        """Handles processing of a new subscription.
+
+            Parameters:
+                subscription (obj): A UserSubscription instance.
+        """
+        user = subscription.user
+        cost = subscription.plan_cost
+        plan = subscription.subscription_plan
+        transaction_date = self._charge_period(
+            subscription, subscription.date_billing_start
+        )
+
+        if transaction_date:
+            # Add user to the proper group
+            try:
+                with self.metrics.timer('add_group'):
+                    plan.group.user_set.add(user)
+            except AttributeError:
+                # No group available to add user to
+                pass
+
+            # Update subscription details
+            current = timezone.now()
+            next_billing = cost.next_billing_datetime(
+                subscription.date_billing_start
+            )
+            subscription.date_billing_last = current
+            subscription.date_billing_next = next_billing
+            subscription.active = True
+            self._save_subscription(subscription, [
+                'date_billing_last', 'date_billing_next', 'active',
+                *self._clear_payment_failures(subscription),
+            ])
+
+            # Record the transaction details
+            with self.metrics.timer('record_transaction'):
+                self.record_transaction(subscription, transaction_date)
+
+            self.counts['new'] += 1
+
+            # Send notifications
+            self._notify(self.notify_new, subscription)
+
+    def process_due(self, subscription):
+        """Handles processing of a due subscription.
+
+            Parameters:
+                subscription (obj): A UserSubscription instance.
+        """
+        cost = subscription.plan_cost
+        start = subscription.date_billing_next
+        count, next_billing, aggregate = self._due_plan(subscription)
+        step = models.billing_step(cost.recurrence_unit, cost.recurrence_period)
+
+        if aggregate:
+            # One charge for all of the missed periods
+            charges = [(start, count)]
+        else:
+            anchor = subscription.date_billing_start
+            charges = [
+                (self._period_start(start, step, index, anchor), 1)
+                for index in range(count)
+            ]
+
+        paid = 0
+
+        for period_start, periods in charges:
+            transaction_date = self._charge_period(
+                subscription, period_start, periods
+            )
+
+            if not transaction_date:
+                # Stop at the first unpaid period
+                next_billing = period_start
+                break
+
+            # Record the transaction details; like ``process_payment``,
+            # ``periods`` is only passed for aggregate charges so
+            # overrides without the argument keep working
+            record_kwargs = {'periods': periods} if periods != 1 else {}
+
+            with self.metrics.timer('record_transaction'):
+                self.record_transaction(
+                    subscription, transaction_date, **record_kwargs
+                )
+
+            paid += 1
+
+        if paid:
+            # Update subscription details
+            subscription.date_billing_last = timezone.now()
+            subscription.date_billing_next = next_billing
+            fields = ['date_billing_last', 'date_billing_next']
+
+            if paid == len(charges):
+                fields.extend(self._clear_payment_failures(subscription))
+
+            self._save_subscription(subscription, fields)
+
+            self.counts['renewed'] += 1
+
+    def _due_plan(self, subscription):
+        """Works out the periods to charge for a due subscription.
+
+            Parameters:
+                subscription (obj): A UserSubscription instance.
+
+            Returns:
+                tuple: The number of due periods, the next billing
+                    datetime once they are paid and whether they are
+                    charged in aggregate.
+        """
+        cost = subscription.plan_cost
+
+        if not self.catch_up:
+            return 1, cost.next_billing_datetime(
+                subscription.date_billing_next, subscription.date_billing_start
+            ), False
+
+        count, next_billing = self._missed_periods(
+            subscription.date_billing_next,
+            models.billing_step(cost.recurrence_unit, cost.recurrence_period),
+            timezone.now(),
+            subscription.date_billing_start,
+        )
+        aggregate = (
+            count > 1
+            and self.catch_up_policy(subscription, count) == CATCH_UP_AGGREGATE
+        )
+
+        return count, next_billing, aggregate
+
+    def _missed_periods(self, start, step, current, anchor=None):
+        """Counts the billing periods started up to a datetime.
+
+            Parameters:
+                start (obj): The start datetime of the first period.
+                step (obj): The step between billing dates (see
+                    ``models.billing_step``).
+                current (obj): The datetime to count periods up to.
+                anchor (obj): The first billing datetime of the
+                    subscription (see ``models.add_months``).
+
+            Returns:
+                tuple: The number of periods and the start datetime of
+                    the first period after ``current``.
+        """
+        if step is None:
+            return 1, None
+
+        if isinstance(step, int):
+            count = 1
+
+            while self._period_start(start, step, count, anchor) <= current:
+                count += 1
+        else:
+            count = max((current - start) // step + 1, 1)
+
+        return count, self._period_start(start, step, count, anchor)
+
+    @staticmethod
+    def _period_start(start, step, index, anchor=None):
+        """Returns the start of a later billing period.
+
+            Calendar periods are always counted from the first start
+            (or the anchor) so the billing day is kept after shorter
+            months.
+
+            Parameters:
+                start (obj): The start datetime of the first period.
+                step (obj): The step between billing dates.
+                index (int): The number of periods after the first.
+                anchor (obj): The first billing datetime of the
+                    subscription (see ``models.add_months``).
+
+            Returns:
+                obj: The start datetime of the period.
+        """
+        if index == 0:
+            return start
+
+        if isinstance(step, int):
+            return models.add_months(start, step * index, anchor)
+
+        return start + step * index
+
+    def catch_up_policy(self, subscription, periods):  # pylint: disable=unused-argument, no-self-use
+        """Decides how the missed periods of a subscription are charged.
+
+            Only called in ``catch_up`` mode for subscriptions that are
+            more than one period overdue. Method can be overriden to
+            choose the policy per subscription (e.g. by plan).
+
+            Parameters:
+                subscription (obj): A UserSubscription instance.
+                periods (int): The number of missed periods.
+
+            Returns:
+                str: ``CATCH_UP_EACH`` to charge and record each period
+                    separately (stopping at the first failed payment)
+                    or ``CATCH_UP_AGGREGATE`` to charge all of them
+                    with a single payment and transaction.
+        """
+        return CATCH_UP_EACH
 
+    def process_free_due(self, queryset):
+        """Renews due subscriptions of free plans with set-based updates.
 
-class Manager():
-    """Manager object to help manage subscriptions & billing."""
+            Subscriptions are grouped by the recurrence of their plan
+            cost. Fixed length recurrences (seconds to weeks) are
+            advanced with a single UPDATE per group. Months and years
+            can not be added on the calendar in SQL on every database,
+            so those groups (and all groups in ``catch_up`` mode) are
+            read in chunks and written with ``bulk_update``. No payment
+            is processed, and the zero amount transactions (if
+            recorded) are created in bulk.
+
+            With ``claim``, every group is renewed in locked chunks
+            (see ``_advance_claimed``) so runners never renew the same
+            subscription twice.
 
-    def process_subscriptions(self):
-        """Calls all required subscription processing functions."""
+            Parameters:
+                queryset (obj): A UserSubscription queryset of the due
+                    subscriptions of free plans.
+        """
         current = timezone.now()
+        recurrences = queryset.order_by().values_list(
+            'plan_cost__recurrence_unit', 'plan_cost__recurrence_period',
+        ).distinct()
 
-        # Handle expired subscriptions
-        expired_subscriptions = models.UserSubscription.objects.filter(
-            Q(active=True) & Q(cancelled=False)
-            & Q(date_billing_end__lte=current)
+        for unit, period in list(recurrences):
+            if self._out_of_time():
+                self.stopped = True
+                return
+
+            group = queryset.filter(
+                plan_cost__recurrence_unit=unit,
+                plan_cost__recurrence_period=period,
+            )
+            step = models.billing_step(unit, period)
+
+            if self.claim:
+                renewed = self._advance_claimed(group, step, current)
+            else:
+                renewed = self._advance_group(group, step, current)
+
+            self.counts['renewed'] += renewed
+            self.metrics.increment('subscriptions', renewed)
+
+    def _advance_group(self, group, step, current):
+        """Renews the subscriptions of one recurrence in a transaction.
+
+            Parameters:
+                group (obj): A UserSubscription queryset of due
+                    subscriptions with the same recurrence.
+                step (obj): The step between billing dates (see
+                    ``models.billing_step``).
+                current (obj): The datetime of the renewal.
+
+            Returns:
+                int: The number of renewed subscriptions.
+        """
+        with transaction.atomic():
+            if self._needs_bulk_update(step):
+                return self._advance_chunks(group, step, current)
+
+            if self.record_free_transactions:
+                for chunk in self._free_chunks(group):
+                    self._record_free_transactions(chunk, current)
+
+            return group.update(**self._free_renewal_fields(step, current))
+
+    def _advance_claimed(self, queryset, step, current):
+        """Claims and renews subscriptions chunk by chunk.
+
+            Each chunk is locked with ``SELECT ... FOR UPDATE SKIP
+            LOCKED`` and renewed within the same transaction. Only the
+            subscriptions of the chunk are updated, by primary key, so
+            the transactions recorded always match the renewals.
+
+            Parameters:
+                queryset (obj): A UserSubscription queryset.
+                step (obj): The step between billing dates (see
+                    ``models.billing_step``).
+                current (obj): The datetime of the renewal.
+
+            Returns:
+                int: The number of renewed subscriptions.
+        """
+        batch_size = self.batch_size or DEFAULT_BATCH_SIZE
+        # Only lock the subscriptions, not the related rows, and skip the
+        # ones claimed by a runner that is charging them
+        queryset = queryset.filter(_unclaimed(current)).select_for_update(
+            skip_locked=True, of=('self',)
         )
+        renewed = 0
+        last_pk = None
 
-        for subscription in expired_subscriptions:
-            self.process_expired(subscription)
+        while True:
+            with transaction.atomic():
+                with self.metrics.timer('scan'):
+                    chunk = self._free_chunk(queryset, last_pk, batch_size)
 
-        # Handle new subscriptions
-        new_subscriptions = models.UserSubscription.objects.filter(
-            Q(active=False) & Q(cancelled=False)
-            & Q(date_billing_start__lte=current)
+                if chunk:
+                    renewed += self._advance_chunk(chunk, step, current)
+
+            if len(chunk) < batch_size:
+                return renewed
+
+            last_pk = chunk[-1][0]
+
+    def _needs_bulk_update(self, step):
+        """Returns whether renewals by step are computed in Python."""
+        return isinstance(step, int) or (self.catch_up and step is not None)
+
+    @staticmethod
+    def _free_renewal_fields(step, current):
+        """Returns the UPDATE values to renew free subscriptions by step."""
+        return {
+            'date_billing_last': current,
+            'date_billing_next': (
+                None if step is None else F('date_billing_next') + step
+            ),
+            'payment_failures': 0,
+            'payment_error': '',
+            'date_payment_retry': None,
+        }
+
+    def _advance_chunk(self, chunk, step, current):
+        """Renews a chunk of subscriptions by their primary keys.
+
+            Parameters:
+                chunk (list): Tuples from ``_free_chunks``.
+                step (obj): The step between billing dates (see
+                    ``models.billing_step``).
+                current (obj): The datetime of the renewal.
+
+            Returns:
+                int: The number of renewed subscriptions.
+        """
+        if self.record_free_transactions:
+            self._record_free_transactions(chunk, current)
+
+        if not self._needs_bulk_update(step):
+            return models.UserSubscription.objects.filter(
+                pk__in=[row[0] for row in chunk]
+            ).update(**self._free_renewal_fields(step, current))
+
+        models.UserSubscription.objects.bulk_update([
+            models.UserSubscription(
+                pk=pk,
+                date_billing_last=current,
+                date_billing_next=(
+                    self._missed_periods(
+                        date_billing_next, step, current, date_billing_start
+                    )[1]
+                    if self.catch_up
+                    else self._period_start(
+                        date_billing_next, step, 1, date_billing_start
+                    )
+                ),
+                payment_failures=0,
+                payment_error='',
+                date_payment_retry=None,
+            )
+            for pk, _, _, _, date_billing_next, date_billing_start in chunk
+        ], [
+            'date_billing_last', 'date_billing_next',
+            'payment_failures', 'payment_error', 'date_payment_retry',
+        ])
+
+        return len(chunk)
+
+    def _advance_chunks(self, queryset, step, current):
+        """Renews subscriptions in chunks of ``bulk_update`` calls.
+
+            In ``catch_up`` mode the subscriptions are moved to their
+            first billing date after ``current``.
+
+            Parameters:
+                queryset (obj): A UserSubscription queryset.
+                step (obj): The step between billing dates (see
+                    ``models.billing_step``).
+                current (obj): The datetime of the renewal.
+
+            Returns:
+                int: The number of renewed subscriptions.
+        """
+        renewed = 0
+
+        for chunk in self._free_chunks(queryset):
+            renewed += self._advance_chunk(chunk, step, current)
+
+        return renewed
+
+    def _free_chunks(self, queryset):
+        """Yields the details needed to renew subscriptions in chunks.
+
+            Parameters:
+                queryset (obj): A UserSubscription queryset.
+
+            Yields:
+                list: ``(pk, user_id, plan_cost_id, cost,
+                    date_billing_next, date_billing_start)`` tuples in
+                    primary key order.
+        """
+        batch_size = self.batch_size or DEFAULT_BATCH_SIZE
+        last_pk = None
+
+        while True:
+            chunk = self._free_chunk(queryset, last_pk, batch_size)
+
+            if not chunk:
+                return
+
+            yield chunk
+
+            if len(chunk) < batch_size:
+                return
+
+            last_pk = chunk[-1][0]
+
+    @staticmethod
+    def _free_chunk(queryset, last_pk, batch_size):
+        """Returns the renewal details of the next chunk.
+
+            Parameters:
+                queryset (obj): A UserSubscription queryset.
+                last_pk (obj): Only read subscriptions after this
+                    primary key (or from the start if ``None``).
+                batch_size (int): The maximum number of subscriptions.
+
+            Returns:
+                list: Tuples as yielded by ``_free_chunks``.
+        """
+        queryset = queryset.order_by('pk').values_list(
+            'pk', 'user_id', 'plan_cost_id', 'plan_cost__cost',
+            'date_billing_next', 'date_billing_start',
         )
 
-        for subscription in new_subscriptions:
-            self.process_new(subscription)
+        if last_pk is not None:
+            queryset = queryset.filter(pk__gt=last_pk)
 
-        # Handle subscriptions with billing due
-        due_subscriptions = models.UserSubscription.objects.filter(
-            Q(active=True) & Q(cancelled=False)
-            & Q(date_billing_next__lte=current)
+        return list(queryset[:batch_size])
+
+    @staticmethod
+    def _record_free_transactions(chunk, current):
+        """Creates the zero amount transactions of free renewals.
+
+            Parameters:
+                chunk (list): Tuples from ``_free_chunks``.
+                current (obj): The datetime of the renewal.
+        """
+        models.SubscriptionTransaction.objects.bulk_create([
+            models.SubscriptionTransaction(
+                user_id=user_id,
+                subscription_id=plan_cost_id,
+                date_transaction=current,
+                amount=cost,
+            )
+            for _, user_id, plan_cost_id, cost, _, _ in chunk
+        ])
+
+    def _charge_period(self, subscription, period_start, periods=1):
+        """Charges a subscription for a billing period at most once.
+
+            A pending BillingAttempt is saved before the payment is
+            processed and is marked as succeeded right after. If a
+            previous run was interrupted after a successful payment,
+            the period is not charged again. An attempt that is still
+            pending (the outcome of the payment is unknown) is passed
+            to ``reconcile_payment``.
+
+            Parameters:
+                subscription (obj): A UserSubscription instance.
+                period_start (obj): The start datetime of the billing
+                    period being charged.
+                periods (int): The number of consecutive periods
+                    charged with this payment.
+
+            Returns:
+                obj: The transaction datetime if the period has been
+                    paid, otherwise ``None``.
+        """
+        attempt, transaction_date = self._prepare_charge(
+            subscription, period_start
         )
 
-        for subscription in due_subscriptions:
-            self.process_due(subscription)
+        if attempt is None:
+            return transaction_date
 
-    def process_expired(self, subscription):
-        """Handles processing of expired/cancelled subscriptions.
+        self._throttle()
+
+        with self.metrics.timer('process_payment'):
+            payment_transaction = self.process_payment(
+                **self._payment_kwargs(subscription, attempt, periods)
+            )
+
+        if not payment_transaction:
+            self._fail_attempts([attempt])
+            self.process_payment_error(subscription, payment_transaction)
+            return None
+
+        return self._complete_attempt(
+            attempt, self.retrieve_transaction_date(payment_transaction)
+        )
+
+    @staticmethod
+    def _payment_kwargs(subscription, attempt, periods):
+        """Returns the keyword arguments for ``process_payment``.
+
+            ``periods`` is only passed when several periods are
+            charged in aggregate.
+        """
+        kwargs = {
+            'user': subscription.user,
+            'cost': subscription.plan_cost,
+            'attempt': attempt,
+        }
+
+        if periods != 1:
+            kwargs['periods'] = periods
+
+        return kwargs
+
+    def _prepare_charge(self, subscription, period_start):
+        """Saves the BillingAttempt for a period before charging it.
 
             Parameters:
                 subscription (obj): A UserSubscription instance.
+                period_start (obj): The start datetime of the billing
+                    period being charged.
+
+            Returns:
+                tuple: The pending BillingAttempt to process the payment
+                    for, or ``None`` and the transaction datetime (or
+                    ``None``) if no payment should be made.
         """
-        # Get all user subscriptions
-        user = subscription.user
-        user_subscriptions = user.subscriptions.all()
-        subscription_group = subscription.subscription_plan.group
-        group_matches = 0
+        attempt = models.BillingAttempt.objects.filter(
+            subscription=subscription, date_period_start=period_start,
+        ).order_by('-number').first()
 
-        # Check if there is another subscription for this group
-        for user_subscription in user_subscriptions:
-            if user_subscription.subscription_plan.group == subscription_group:
-                group_matches += 1
+        if attempt is not None and attempt.status == models.ATTEMPT_SUCCEEDED:
+            # Already paid, but the subscription was never updated
+            return None, attempt.date_transaction
 
-        # If no other subscription, can remove user from group
-        if group_matches < 2:
-            subscription_group.user_set.remove(user)
+        if attempt is not None and attempt.status == models.ATTEMPT_PENDING:
+            self._throttle()
+            paid = self.reconcile_payment(subscription, attempt)
 
-        # Update this specific UserSubscription instance
-        subscription.active = False
-        subscription.cancelled = True
-        subscription.save()
+            if paid is None:
+                self.counts['payments_unresolved'] += 1
+                return None, None
 
-        self.notify_expired(subscription)
+            if paid:
+                return None, self._complete_attempt(attempt, timezone.now())
 
-    def process_new(self, subscription):
-        """Handles processing of a new subscription.
+            attempt.status = models.ATTEMPT_FAILED
+            attempt.save(update_fields=['status'])
+
+        # Retries get a new attempt (and ID), so payment providers that
+        # cache the outcome per idempotency key charge again
+        number = 1 if attempt is None else attempt.number + 1
+        attempt = models.BillingAttempt.objects.create(
+            id=models.billing_attempt_id(subscription.id, period_start, number),
+            subscription=subscription,
+            date_period_start=period_start,
+            number=number,
+        )
+
+        return attempt, None
+
+    def _fail_attempts(self, attempts):
+        """Marks the attempts of declined payments as failed.
+
+            Nothing was charged, so the periods can be attempted again
+            with the next attempt number.
+
+            Parameters:
+                attempts (list): The BillingAttempt instances.
+        """
+        models.BillingAttempt.objects.filter(
+            pk__in=[attempt.pk for attempt in attempts]
+        ).update(status=models.ATTEMPT_FAILED)
+        self.counts['payment_errors'] += len(attempts)
+
+    def process_payment_error(self, subscription, payment=None):
+        """Handles processing of a declined payment.
+
+            The failure is recorded on the subscription and the payment
+            is retried after ``retry_delay``, which grows by
+            ``retry_backoff`` with each further failure (up to
+            ``retry_delay_max``). Once ``max_payment_failures`` is
+            reached, the subscription ends and is expired.
 
             Parameters:
                 subscription (obj): A UserSubscription instance.
+                payment (obj): The falsy value returned by
+                    ``process_payment``.
         """
-        user = subscription.user
-        cost = subscription.plan_cost
-        plan = subscription.subscription_plan
-        payment_transaction = self.process_payment(user=user, cost=cost)
+        current = timezone.now()
+        failures = subscription.payment_failures + 1
+        delay = self.retry_delay_max
 
-        if payment_transaction:
-            # Add user to the proper group
-            try:
-                plan.group.user_set.add(user)
-            except AttributeError:
-                # No group available to add user to
-                pass
+        if self.retry_backoff ** (failures - 1) < delay / self.retry_delay:
+            delay = self.retry_delay * self.retry_backoff ** (failures - 1)
 
-            # Update subscription details
-            current = timezone.now()
-            next_billing = cost.next_billing_datetime(
-                subscription.date_billing_start
-            )
-            subscription.date_billing_last = current
-            subscription.date_billing_next = next_billing
-            subscription.active = True
-            subscription.save()
+        subscription.payment_failures = failures
+        subscription.payment_error = self.retrieve_payment_error(payment)[:255]
+        subscription.date_payment_retry = current + delay
+        fields = ['payment_failures', 'payment_error', 'date_payment_retry']
 
-            # Record the transaction details
-            self.record_transaction(
-                subscription,
-                self.retrieve_transaction_date(payment_transaction)
-            )
+        dunned = (
+            self.max_payment_failures is not None
+            and failures >= self.max_payment_failures
+        )
 
-            # Send notifications
-            self.notify_new(subscription)
+        if dunned:
+            subscription.date_billing_end = current
+            fields.append('date_billing_end')
 
-    def process_due(self, subscription):
-        """Handles processing of a due subscription.
+        self._save_subscription(subscription, fields)
+        self._notify(self.notify_payment_error, subscription)
+
+        if dunned:
+            self.process_expired(subscription)
+
+    @staticmethod
+    def _clear_payment_failures(subscription):
+        """Resets the payment retry details after a successful payment.
 
             Parameters:
                 subscription (obj): A UserSubscription instance.
+
+            Returns:
+                list: The names of the reset fields.
         """
-        user = subscription.user
-        cost = subscription.plan_cost
+        subscription.payment_failures = 0
+        subscription.payment_error = ''
+        subscription.date_payment_retry = None
 
-        payment_transaction = self.process_payment(user=user, cost=cost)
+        return ['payment_failures', 'payment_error', 'date_payment_retry']
 
-        if payment_transaction:
-            # Update subscription details
-            current = timezone.now()
-            next_billing = cost.next_billing_datetime(
-                subscription.date_billing_next
-            )
-            subscription.date_billing_last = current
-            subscription.date_billing_next = next_billing
-            subscription.save()
+    @staticmethod
+    def _complete_attempt(attempt, transaction_date):
+        """Marks a billing attempt as succeeded.
 
-            # Record the transaction details
-            self.record_transaction(
-                subscription,
-                self.retrieve_transaction_date(payment_transaction)
-            )
+            Parameters:
+                attempt (obj): A BillingAttempt instance.
+                transaction_date (obj): When the payment occurred.
+
+            Returns:
+                obj: The transaction datetime.
+        """
+        attempt.status = models.ATTEMPT_SUCCEEDED
+        attempt.date_transaction = transaction_date
+        attempt.save(update_fields=['status', 'date_transaction'])
+
+        return transaction_date
 
     def process_payment(self, *args, **kwargs):  # pylint: disable=unused-argument, no-self-use
         """Processes payment and confirms if payment is accepted.
@@ -140,9 +1692,57 @@ class Manager():
             Can return value that evalutes to ``True`` to indicate
             payment success and any value that evalutes to ``False`` to
             indicate payment error.
+
+            When called for a subscription renewal, the keyword
+            arguments are the ``user``, the plan ``cost`` and the
+            BillingAttempt (``attempt``) for the billing period. The
+            attempt ID is derived from the subscription, the billing
+            period and the attempt number, so it can be used as an
+            idempotency key with the payment provider (a retry after a
+            declined payment is a new attempt with a new ID). When missed periods are charged in
+            aggregate, the number of ``periods`` to charge for is also
+            passed.
         """
         return True
 
+    def reconcile_payment(self, subscription, attempt):  # pylint: disable=unused-argument, no-self-use
+        """Determines the outcome of an interrupted payment attempt.
+
+            Called when a previous run saved a BillingAttempt but
+            stopped before recording the outcome of the payment. This
+            method should be overriden to check with the payment
+            provider (e.g. using ``attempt.id`` as the idempotency key
+            passed to ``process_payment``).
+
+            Parameters:
+                subscription (obj): A UserSubscription instance.
+                attempt (obj): The pending BillingAttempt instance.
+
+            Returns:
+                bool: ``True`` if the payment went through, ``False``
+                    if it did not (the attempt is marked as failed
+                    and the payment is attempted again) or
+                    ``None`` if it is unknown, in which case the
+                    subscription is skipped until it is resolved.
+        """
+        return None
+
+    def retrieve_payment_error(self, payment):  # pylint: disable=unused-argument, no-self-use
+        """Returns the error message of a declined payment.
+
+            Method should be overriden to accomodate the implemented
+            payment processing (e.g. when ``process_payment`` returns
+            a falsy response object with the decline reason).
+
+            Parameters:
+                payment (obj): The falsy value returned by
+                    ``process_payment``.
+
+            Returns:
+                str: The error message (empty by default).
+        """
+        return ''
+
     def retrieve_transaction_date(self, payment):  # pylint: disable=unused-argument, no-self-use
         """Returns the transaction date from provided payment details.
 
@@ -155,28 +1755,46 @@ class Manager():
         """
         return timezone.now()
 
-    @staticmethod
-    def record_transaction(subscription, transaction_date=None):
+    def record_transaction(self, subscription, transaction_date=None, periods=1):
         """Records transaction details in SubscriptionTransaction.
 
+            When processing in batches the transaction is only created
+            once the current chunk is flushed.
+
             Parameters:
                 subscription (obj): A UserSubscription object.
                 transaction_date (obj): A DateTime object of when
                     payment occurred (defaults to current datetime if
                     none provided).
+                periods (int): The number of periods paid for. Only
+                    passed by the manager when several periods are
+                    charged in aggregate.
 
             Returns:
                 obj: The created SubscriptionTransaction instance.
         """
         if transaction_date is None:
             transaction_date = timezone.now()
-        return models.SubscriptionTransaction.objects.create(
+
+        amount = subscription.plan_cost.cost
+
+        if amount is not None and periods != 1:
+            amount = Decimal(amount) * periods
+
+        subscription_transaction = models.SubscriptionTransaction(
             user=subscription.user,
             subscription=subscription.plan_cost,
             date_transaction=transaction_date,
-            amount=subscription.plan_cost.cost,
+            amount=amount,
         )
 
+        if self._batch is None:
+            subscription_transaction.save(force_insert=True)
+        else:
+            self._batch.transactions.append(subscription_transaction)
+
+        return subscription_transaction
+
     def notify_expired(self, subscription):
         """Sends notification of expired subscription.
 
@@ -204,3 +1822,226 @@ class Manager():
             Parameters:
                 subscription (obj): A UserSubscription instance.
         """
+
+
+class AsyncManager(Manager):
+    """Manager that makes the payment calls of a chunk concurrently.
+
+        ``process_payment`` is a coroutine. For each chunk, the billing
+        attempts are saved first, then the payments are made on an
+        event loop with at most ``concurrency`` calls in flight, and
+        finally the outcomes and subscription updates are written in
+        bulk.
+
+        ``process_payment`` runs on the event loop, so it must not use
+        the ORM directly (wrap any database access with
+        ``asgiref.sync.sync_to_async``). The ``user`` and ``cost``
+        passed to it are already loaded.
+
+        Attributes:
+            concurrency (int): The maximum number of payment calls in
+                flight at the same time.
+    """
+    batch_size = DEFAULT_BATCH_SIZE
+    concurrency = 10
+
+    def __init__(self):
+        super().__init__()
+        self._charges = {}
+        self._due_plans = {}
+
+    def _handle_chunk(self, chunk, handler):
+        """Charges the chunk concurrently, then applies the handler.
+
+            Once the payments of a chunk have been made, the whole
+            chunk is processed even if the time limit is reached.
+
+            Parameters:
+                chunk (list): UserSubscription instances to process.
+                handler (func): The method to process each
+                    subscription with.
+
+            Returns:
+                int: The number of subscriptions processed.
+        """
+        if self._out_of_time():
+            self.stopped = True
+            return 0
+
+        if handler == self.process_new:
+            self._charges = self._charge_many([
+                (subscription, subscription.date_billing_start, 1)
+                for subscription in chunk
+            ])
+        elif handler == self.process_due:
+            charges = []
+
+            for subscription in chunk:
+                plan = super()._due_plan(subscription)
+                self._due_plans[subscription.pk] = plan
+                # Later periods charged separately are paid one by one
+                charges.append((
+                    subscription,
+                    subscription.date_billing_next,
+                    plan[0] if plan[2] else 1,
+                ))
+
+            self._charges = self._charge_many(charges)
+
+        name = _hook_name(handler)
+
+        try:
+            for subscription in chunk:
+                with self.metrics.timer(name):
+                    handler(subscription)
+        finally:
+            self._charges = {}
+            self._due_plans = {}
+
+        self.metrics.increment('subscriptions', len(chunk))
+
+        return len(chunk)
+
+    def _due_plan(self, subscription):
+        """Returns the plan worked out before the chunk was charged."""
+        if subscription.pk in self._due_plans:
+            return self._due_plans.pop(subscription.pk)
+
+        return super()._due_plan(subscription)
+
+    def _charge_period(self, subscription, period_start, periods=1):
+        """Returns the outcome of the charge made for the chunk.
+
+            Parameters:
+                subscription (obj): A UserSubscription instance.
+                period_start (obj): The start datetime of the billing
+                    period being charged.
+                periods (int): The number of consecutive periods
+                    charged with this payment.
+
+            Returns:
+                obj: The transaction datetime if the period has been
+                    paid, otherwise ``None``.
+        """
+        key = (subscription.pk, period_start)
+
+        if key not in self._charges:
+            self._charges.update(
+                self._charge_many([(subscription, period_start, periods)])
+            )
+
+        result = self._charges.pop(key)
+
+        if isinstance(result, Exception):
+            raise result
+
+        return result
+
+    def _charge_many(self, charges):
+        """Charges several billing periods with concurrent payments.
+
+            Parameters:
+                charges (list): ``(subscription, period_start,
+                    periods)`` tuples.
+
+            Returns:
+                dict: The transaction datetime (or ``None``) for each
+                    ``(subscription.pk, period_start)``, or the
+                    exception raised by ``process_payment``.
+        """
+        results = {}
+        pending = []
+
+        for subscription, period_start, periods in charges:
+            attempt, transaction_date = self._prepare_charge(
+                subscription, period_start
+            )
+
+            if attempt is None:
+                results[(subscription.pk, period_start)] = transaction_date
+            else:
+                pending.append((subscription, period_start, attempt, periods))
+
+        if not pending:
+            return results
+
+        # asyncio.run needs Python 3.7
+        loop = asyncio.new_event_loop()
+
+        try:
+            payments = loop.run_until_complete(self._pay_all(pending))
+        finally:
+            loop.close()
+
+        succeeded = []
+        declined = []
+
+        for (subscription, period_start, attempt, _), payment in zip(pending, payments):
+            key = (subscription.pk, period_start)
+
+            if isinstance(payment, Exception):
+                # The outcome is unknown, so the attempt stays pending
+                results[key] = payment
+            elif payment:
+                attempt.status = models.ATTEMPT_SUCCEEDED
+                attempt.date_transaction = self.retrieve_transaction_date(payment)
+                succeeded.append(attempt)
+                results[key] = attempt.date_transaction
+            else:
+                declined.append((subscription, attempt, payment))
+                results[key] = None
+
+        if succeeded:
+            models.BillingAttempt.objects.bulk_update(
+                succeeded, ['status', 'date_transaction']
+            )
+
+        if declined:
+            self._fail_attempts([attempt for _, attempt, _ in declined])
+
+            for subscription, _, payment in declined:
+                self.process_payment_error(subscription, payment)
+
+        return results
+
+    async def _pay_all(self, pending):
+        """Makes the payment calls with bounded concurrency.
+
+            Parameters:
+                pending (list): ``(subscription, period_start,
+                    attempt, periods)`` tuples to make a payment for.
+
+            Returns:
+                list: The result of each ``process_payment`` call (or
+                    the exception it raised) in the same order.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def pay(subscription, attempt, periods):
+            async with semaphore:
+                delay = self._payment_delay()
+
+                if delay:
+                    await asyncio.sleep(delay)
+
+                with self.metrics.timer('process_payment'):
+                    return await self.process_payment(
+                        **self._payment_kwargs(subscription, attempt, periods)
+                    )
+
+        return await asyncio.gather(
+            *(
+                pay(subscription, attempt, periods)
+                for subscription, _, attempt, periods in pending
+            ),
+            return_exceptions=True,
+        )
+
+    async def process_payment(self, *args, **kwargs):  # pylint: disable=unused-argument, invalid-overridden-method
+        """Processes payment and confirms if payment is accepted.
+
+            Coroutine version of ``Manager.process_payment``, which
+            needs to be overriden in a project to call the payment
+            provider.
+        """
+        return True
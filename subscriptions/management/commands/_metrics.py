@@ -0,0 +1,209 @@
+"""Metrics collection for the subscription Manager."""
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Upper bounds (in seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram():
+    """Distribution of the observed durations of a phase or hook.
+
+        Attributes:
+            buckets (tuple): The upper bounds of the buckets.
+            bucket_counts (list): The number of observations in each
+                bucket (not cumulative).
+            count (int): The total number of observations.
+            sum (float): The total of all observations.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Records an observation.
+
+            Parameters:
+                value (float): The observed duration in seconds.
+        """
+        self.count += 1
+        self.sum += value
+
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[index] += 1
+                break
+
+
+class Metrics():
+    """Collects the counters and latency histograms of a run.
+
+        A single instance can be shared between worker threads.
+
+        Attributes:
+            counters (obj): A Counter of named events.
+            histograms (dict): The Histogram for each timed name.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counters = Counter()
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        """Increments a counter.
+
+            Parameters:
+                name (str): The name of the counter.
+                value (int): The amount to increment by.
+        """
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name, seconds):
+        """Records a duration in the histogram of a name.
+
+            Parameters:
+                name (str): The name of the phase or hook.
+                seconds (float): The observed duration.
+        """
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(self.buckets)
+
+            self.histograms[name].observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """Context manager recording the duration of its block.
+
+            Parameters:
+                name (str): The name of the phase or hook.
+        """
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def total(self, name):
+        """Returns the total time recorded for a name in seconds."""
+        histogram = self.histograms.get(name)
+
+        return histogram.sum if histogram else 0.0
+
+
+class MetricsSink():
+    """Interface for publishing the metrics of a run.
+
+        Subclasses implement ``emit``, which is called once at the end
+        of each run.
+    """
+    def emit(self, metrics):
+        """Publishes the metrics.
+
+            Parameters:
+                metrics (obj): The Metrics instance of the run.
+        """
+        raise NotImplementedError
+
+
+class LoggingSink(MetricsSink):
+    """Writes the metrics to a logger at the INFO level."""
+    def __init__(self, logger=None):
+        self.logger = logger or LOGGER
+
+    def emit(self, metrics):
+        """Logs every counter and a summary of every histogram."""
+        for name, value in sorted(metrics.counters.items()):
+            self.logger.info('%s: %s', name, value)
+
+        for name, histogram in sorted(metrics.histograms.items()):
+            self.logger.info(
+                '%s: %s calls, %.3fs total, %.3fs mean',
+                name,
+                histogram.count,
+                histogram.sum,
+                histogram.sum / histogram.count,
+            )
+
+
+class PrometheusTextfileSink(MetricsSink):
+    """Writes the metrics in the Prometheus text exposition format.
+
+        The file is replaced atomically, so it can be collected by the
+        node exporter textfile collector (or any local scraper) while
+        runs are writing it.
+    """
+    def __init__(self, path, prefix='subscriptions'):
+        self.path = path
+        self.prefix = prefix
+
+    def emit(self, metrics):
+        """Writes the metrics file."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory)
+
+        with os.fdopen(descriptor, 'w') as metrics_file:
+            metrics_file.write(self.render(metrics))
+
+        # mkstemp creates the file readable by its owner only, but the
+        # collector may run as another user
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, self.path)
+
+    def render(self, metrics):
+        """Returns the metrics in the Prometheus text format.
+
+            Parameters:
+                metrics (obj): The Metrics instance of the run.
+
+            Returns:
+                str: The formatted metrics.
+        """
+        counter = '{}_events_total'.format(self.prefix)
+        duration = '{}_duration_seconds'.format(self.prefix)
+        lines = [
+            '# HELP {} Subscription manager events.'.format(counter),
+            '# TYPE {} counter'.format(counter),
+        ]
+
+        for name, value in sorted(metrics.counters.items()):
+            lines.append('{}{{name="{}"}} {}'.format(counter, name, value))
+
+        lines.extend([
+            '# HELP {} Time spent in each phase and hook.'.format(duration),
+            '# TYPE {} histogram'.format(duration),
+        ])
+
+        for name, histogram in sorted(metrics.histograms.items()):
+            cumulative = 0
+
+            for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+                cumulative += count
+                lines.append('{}_bucket{{name="{}",le="{}"}} {}'.format(
+                    duration, name, bound, cumulative
+                ))
+
+            lines.extend([
+                '{}_bucket{{name="{}",le="+Inf"}} {}'.format(
+                    duration, name, histogram.count
+                ),
+                '{}_sum{{name="{}"}} {}'.format(duration, name, histogram.sum),
+                '{}_count{{name="{}"}} {}'.format(
+                    duration, name, histogram.count
+                ),
+            ])
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,75 @@
+"""Django management command to export the transaction ledger."""
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from subscriptions import exports
+
+
+class Command(BaseCommand):
+    """Django management command to export the transaction ledger."""
+    help = 'Streams the subscription transactions as CSV or JSONL.'
+
+    def add_arguments(self, parser):
+        """Adds the export format, filter and output arguments."""
+        parser.add_argument(
+            '--format',
+            choices=sorted(exports.EXPORT_FORMATS),
+            default='csv',
+            help='The format of the export.',
+        )
+        parser.add_argument(
+            '--start',
+            help=(
+                'Only export transactions on or after this date or '
+                'datetime (ISO 8601).'
+            ),
+        )
+        parser.add_argument(
+            '--end',
+            help=(
+                'Only export transactions before this date or datetime '
+                '(ISO 8601).'
+            ),
+        )
+        parser.add_argument(
+            '--user',
+            help='Only export the transactions of the user with this ID.',
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the export to this file instead of stdout.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            default=exports.DEFAULT_CHUNK_SIZE,
+            type=int,
+            help='Read this many transactions per query.',
+        )
+
+    def handle(self, *args, **options):
+        """Writes the export line by line."""
+        try:
+            queryset = exports.filter_transactions(
+                start=self._parse_datetime(options['start']),
+                end=self._parse_datetime(options['end']),
+                user=options['user'],
+            )
+        except (ValueError, ValidationError) as error:
+            raise CommandError(str(error)) from error
+
+        line_generator = exports.EXPORT_FORMATS[options['format']][0]
+        lines = line_generator(
+            exports.transaction_rows(queryset, options['chunk_size'])
+        )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output_file:
+                output_file.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
+
+    @staticmethod
+    def _parse_datetime(value):
+        """Returns the parsed datetime of an option or None."""
+        return exports.parse_export_datetime(value) if value else None
@@ -1,23 +1,208 @@
 """Django management command to process subscriptions via task runner."""
 import importlib
+import json
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from subscriptions.conf import SETTINGS
+from subscriptions.management.commands import _metrics
 
 
 class Command(BaseCommand):
     """Django management command to process subscriptions via task runner."""
     help = 'Processes all subscriptions to handle renewal and expiries.'
 
+    def add_arguments(self, parser):
+        """Adds the optional processing arguments."""
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help=(
+                'Process subscriptions in chunks of this size and write '
+                'the updates for each chunk in bulk.'
+            ),
+        )
+        parser.add_argument(
+            '--claim',
+            action='store_true',
+            help=(
+                'Lock each chunk of subscriptions while it is processed '
+                'so several runners can process subscriptions at once.'
+            ),
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help=(
+                'Continue the last run from its checkpoint if it did '
+                'not complete.'
+            ),
+        )
+        parser.add_argument(
+            '--catch-up',
+            action='store_true',
+            help=(
+                'Charge subscriptions that are several periods overdue '
+                'for all missed periods in one run.'
+            ),
+        )
+        parser.add_argument(
+            '--time-limit',
+            type=float,
+            help=(
+                'Stop processing after this many seconds; the remaining '
+                'subscriptions are processed by the next run.'
+            ),
+        )
+        parser.add_argument(
+            '--max-rate',
+            type=float,
+            help='Make at most this many payment calls per second.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help=(
+                'Print a forecast of the subscriptions that would be '
+                'processed instead of processing them.'
+            ),
+        )
+        parser.add_argument(
+            '--forecast-until',
+            help=(
+                'Print a forecast of a run at this datetime (ISO 8601) '
+                'instead of processing subscriptions.'
+            ),
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the forecast as JSON.',
+        )
+        parser.add_argument(
+            '--workers',
+            default=1,
+            type=int,
+            help=(
+                'Split the subscriptions into this many disjoint shards '
+                'and process each shard on its own worker thread.'
+            ),
+        )
+        parser.add_argument(
+            '--metrics-textfile',
+            help=(
+                'Write the run metrics to this file in the Prometheus '
+                'text format.'
+            ),
+        )
+
     def handle(self, *args, **options):
         """Runs Manager methods required to process subscriptions."""
+        if options['resume'] and options['workers'] > 1:
+            raise CommandError('--resume cannot be used with --workers.')
+
         Manager = getattr(  # pylint: disable=invalid-name
             importlib.import_module(SETTINGS['management_manager']['module']),
             SETTINGS['management_manager']['class']
         )
         manager = Manager()
 
+        if options['batch_size']:
+            manager.batch_size = options['batch_size']
+
+        if options['claim']:
+            manager.claim = True
+
+        if options['resume']:
+            manager.resume = True
+
+        if options['catch_up']:
+            manager.catch_up = True
+
+        if options['time_limit']:
+            manager.time_limit = options['time_limit']
+
+        if options['max_rate']:
+            manager.max_rate = options['max_rate']
+
+        if options['metrics_textfile']:
+            manager.metrics_sinks.append(
+                _metrics.PrometheusTextfileSink(options['metrics_textfile'])
+            )
+
+        if options['dry_run'] or options['forecast_until']:
+            self.write_forecast(manager, options)
+            return
+
         self.stdout.write('Processing subscriptions... ', ending='')
-        manager.process_subscriptions()
-        self.stdout.write('Complete!')
+
+        if options['workers'] > 1:
+            manager.process_subscriptions_parallel(options['workers'])
+        else:
+            manager.process_subscriptions()
+
+        if manager.stopped:
+            self.stdout.write(
+                'Time limit reached, the remaining subscriptions will be '
+                'processed by the next run.'
+            )
+        else:
+            self.stdout.write('Complete!')
+
+        self.stdout.write(
+            'Expired: {expired}, new: {new}, renewed: {renewed}, '
+            'payment errors: {payment_errors}, '
+            'unresolved payments: {payments_unresolved}'.format(
+                expired=manager.counts['expired'],
+                new=manager.counts['new'],
+                renewed=manager.counts['renewed'],
+                payment_errors=manager.counts['payment_errors'],
+                payments_unresolved=manager.counts['payments_unresolved'],
+            )
+        )
+        self.write_throughput(manager)
+        manager.emit_metrics()
+
+    def write_throughput(self, manager):
+        """Prints the number of processed subscriptions per second."""
+        rows = manager.metrics.counters['subscriptions']
+        seconds = manager.metrics.total('run')
+
+        self.stdout.write(
+            'Processed {rows} subscriptions in {seconds:.2f}s '
+            '({rate:.1f} rows/sec)'.format(
+                rows=rows,
+                seconds=seconds,
+                rate=rows / seconds if seconds else 0.0,
+            )
+        )
+
+    def write_forecast(self, manager, options):
+        """Prints the forecast of a run without processing it."""
+        until = None
+
+        if options['forecast_until']:
+            until = parse_datetime(options['forecast_until'])
+
+            if until is None:
+                raise CommandError(
+                    '--forecast-until must be an ISO 8601 datetime.'
+                )
+
+            if timezone.is_naive(until) and timezone.is_aware(timezone.now()):
+                until = timezone.make_aware(until)
+
+        forecast = manager.forecast(until)
+
+        if options['json']:
+            self.stdout.write(json.dumps(forecast, cls=DjangoJSONEncoder))
+            return
+
+        self.stdout.write(
+            'Forecast until {until}: expired: {expired}, new: {new}, '
+            'renewed: {renewed}, payments: {payments}, '
+            'revenue: {revenue}'.format(**forecast)
+        )
@@ -0,0 +1,42 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0007_auto_20201007_1539'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='plancost',
+            name='plans',
+            field=models.ManyToManyField(blank=True, help_text='the subscription plan for these cost details', related_name='costs', through='subscriptions.PlanCostLink', to='subscriptions.SubscriptionPlan'),
+        ),
+        migrations.AddIndex(
+            model_name='usersubscription',
+            index=models.Index(fields=['active', 'cancelled', 'date_billing_end'], name='dfs_subscription_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersubscription',
+            index=models.Index(fields=['active', 'cancelled', 'date_billing_start'], name='dfs_subscription_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersubscription',
+            index=models.Index(fields=['active', 'cancelled', 'date_billing_next'], name='dfs_subscription_next_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersubscription',
+            index=models.Index(condition=models.Q(('active', True), ('cancelled', False)), fields=['date_billing_end'], name='dfs_subscription_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersubscription',
+            index=models.Index(condition=models.Q(('active', False), ('cancelled', False)), fields=['date_billing_start'], name='dfs_subscription_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersubscription',
+            index=models.Index(condition=models.Q(('active', True), ('cancelled', False)), fields=['date_billing_next'], name='dfs_subscription_due_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0008_usersubscription_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingAttempt',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_period_start', models.DateTimeField(help_text='the start of the billing period being billed', verbose_name='billing period start date')),
+                ('status', models.CharField(choices=[('0', 'pending'), ('1', 'succeeded')], default='0', help_text='the status of the payment for this billing period', max_length=1)),
+                ('date_created', models.DateTimeField(auto_now_add=True, help_text='the datetime the attempt was started', verbose_name='attempt date')),
+                ('date_transaction', models.DateTimeField(blank=True, help_text='the datetime the payment was completed', null=True, verbose_name='transaction date')),
+                ('subscription', models.ForeignKey(help_text='the user subscription being billed', on_delete=django.db.models.deletion.CASCADE, related_name='billing_attempts', to='subscriptions.usersubscription')),
+            ],
+            options={
+                'ordering': ('date_created',),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='billingattempt',
+            constraint=models.UniqueConstraint(fields=('subscription', 'date_period_start'), name='dfs_unique_billing_period'),
+        ),
+    ]
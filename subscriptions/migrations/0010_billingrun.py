@@ -0,0 +1,28 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:03
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0009_billingattempt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingRun',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_reference', models.DateTimeField(help_text='the datetime subscriptions are processed up to', verbose_name='reference date')),
+                ('phase', models.CharField(choices=[('0', 'expired'), ('1', 'new'), ('2', 'due'), ('3', 'complete')], default='0', help_text='the processing phase the run has reached', max_length=1)),
+                ('last_subscription_id', models.UUIDField(blank=True, help_text='the ID of the last subscription processed in this phase', null=True, verbose_name='last subscription ID')),
+                ('date_started', models.DateTimeField(auto_now_add=True, help_text='the datetime the run started', verbose_name='start date')),
+                ('date_updated', models.DateTimeField(auto_now=True, help_text='the datetime of the last checkpoint', verbose_name='checkpoint date')),
+            ],
+            options={
+                'ordering': ('-date_started',),
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0010_billingrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billingrun',
+            name='last_date_billing_next',
+            field=models.DateTimeField(blank=True, help_text='the next billing date of the last subscription processed in this phase, when subscriptions are processed by billing date', null=True, verbose_name='last next billing date'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0011_billingrun_last_date_billing_next'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersubscription',
+            name='date_payment_retry',
+            field=models.DateTimeField(blank=True, help_text='the date to retry a failed payment after', null=True, verbose_name='payment retry date'),
+        ),
+        migrations.AddField(
+            model_name='usersubscription',
+            name='payment_error',
+            field=models.CharField(blank=True, default='', help_text='the error of the last failed payment', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='usersubscription',
+            name='payment_failures',
+            field=models.PositiveIntegerField(default=0, help_text='the number of failed payments since the last success'),
+        ),
+    ]
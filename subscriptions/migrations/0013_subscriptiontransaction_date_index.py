@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0012_usersubscription_payment_retry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscriptiontransaction',
+            index=models.Index(fields=['date_transaction', 'id'], name='dfs_transaction_date_idx'),
+        ),
+    ]
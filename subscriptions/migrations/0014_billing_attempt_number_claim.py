@@ -0,0 +1,36 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0013_subscriptiontransaction_date_index'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='billingattempt',
+            name='dfs_unique_billing_period',
+        ),
+        migrations.AddField(
+            model_name='billingattempt',
+            name='number',
+            field=models.PositiveIntegerField(default=1, help_text='the number of this attempt for the billing period', verbose_name='attempt number'),
+        ),
+        migrations.AddField(
+            model_name='usersubscription',
+            name='date_claim_expires',
+            field=models.DateTimeField(blank=True, help_text='the date a runner stops holding its claim on this subscription', null=True, verbose_name='claim expiry date'),
+        ),
+        migrations.AlterField(
+            model_name='billingattempt',
+            name='status',
+            field=models.CharField(choices=[('0', 'pending'), ('1', 'succeeded'), ('2', 'failed')], default='0', help_text='the status of the payment for this billing period', max_length=1),
+        ),
+        migrations.AddConstraint(
+            model_name='billingattempt',
+            constraint=models.UniqueConstraint(fields=('subscription', 'date_period_start', 'number'), name='dfs_unique_billing_attempt'),
+        ),
+    ]
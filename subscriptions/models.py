@@ -1,11 +1,15 @@
 """Models for the Flexible Subscriptions app."""
+from calendar import monthrange
 from datetime import timedelta
-from uuid import uuid4
+from functools import lru_cache
+from uuid import UUID, uuid4, uuid5
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import DatabaseError, connections, models
+from django.db.models import Q
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 # Convenience references for units for plan recurrence billing
@@ -29,6 +33,47 @@ RECURRENCE_UNIT_CHOICES = (
     (YEAR, 'year'),
 )
 
+# Keyword for timedelta of each fixed length unit and months per
+# calendar unit
+_TIMEDELTA_UNITS = {
+    SECOND: 'seconds',
+    MINUTE: 'minutes',
+    HOUR: 'hours',
+    DAY: 'days',
+    WEEK: 'weeks',
+}
+_MONTH_UNITS = {
+    MONTH: 1,
+    YEAR: 12,
+}
+
+# Convenience references for billing attempt statuses
+# ----------------------------------------------------------------------------
+ATTEMPT_PENDING = '0'
+ATTEMPT_SUCCEEDED = '1'
+ATTEMPT_FAILED = '2'
+ATTEMPT_STATUS_CHOICES = (
+    (ATTEMPT_PENDING, 'pending'),
+    (ATTEMPT_SUCCEEDED, 'succeeded'),
+    (ATTEMPT_FAILED, 'failed'),
+)
+
+# Namespace of the deterministic billing attempt IDs
+BILLING_ATTEMPT_NAMESPACE = UUID('22ab827e-8742-4149-b7e8-3b7b7c13edad')
+
+# Convenience references for billing run phases (in processing order)
+# ----------------------------------------------------------------------------
+RUN_EXPIRED = '0'
+RUN_NEW = '1'
+RUN_DUE = '2'
+RUN_COMPLETE = '3'
+RUN_PHASE_CHOICES = (
+    (RUN_EXPIRED, 'expired'),
+    (RUN_NEW, 'new'),
+    (RUN_DUE, 'due'),
+    (RUN_COMPLETE, 'complete'),
+)
+
 
 class PlanTag(models.Model):
     """A tag for a subscription plan."""
@@ -197,45 +242,172 @@ class PlanCost(models.Model):
             self.recurrence_period, conversion[self.recurrence_unit]['plural']
         )
 
-    def next_billing_datetime(self, current):
+    def next_billing_datetime(self, current, anchor=None):
         """Calculates next billing date for provided datetime.
 
+            Months and years are added on the calendar: the billing
+            day of the month is kept and clamped to the end of shorter
+            months (e.g. January 31st is followed by February 28th).
+
             Parameters:
                 current (datetime): The current datetime to compare
                     against.
+                anchor (datetime): The first billing datetime of the
+                    schedule (e.g. the billing start date), so a
+                    clamped day is not kept for later months.
 
             Returns:
                 datetime: The next time billing will be due.
         """
-        if self.recurrence_unit == SECOND:
-            delta = timedelta(seconds=self.recurrence_period)
-        elif self.recurrence_unit == MINUTE:
-            delta = timedelta(minutes=self.recurrence_period)
-        elif self.recurrence_unit == HOUR:
-            delta = timedelta(hours=self.recurrence_period)
-        elif self.recurrence_unit == DAY:
-            delta = timedelta(days=self.recurrence_period)
-        elif self.recurrence_unit == WEEK:
-            delta = timedelta(weeks=self.recurrence_period)
-        elif self.recurrence_unit == MONTH:
-            # Adds the average number of days per month as per:
-            # http://en.wikipedia.org/wiki/Month#Julian_and_Gregorian_calendars
-            # This handle any issues with months < 31 days and leap years
-            delta = timedelta(
-                days=30.4368 * self.recurrence_period
-            )
-        elif self.recurrence_unit == YEAR:
-            # Adds the average number of days per year as per:
-            # http://en.wikipedia.org/wiki/Year#Calendar_year
-            # This handle any issues with leap years
-            delta = timedelta(
-                days=365.2425 * self.recurrence_period
-            )
-        else:
-            # If no recurrence period, no next billing datetime
-            return None
+        return _apply_billing_step(
+            current,
+            billing_step(self.recurrence_unit, self.recurrence_period),
+            anchor,
+        )
+
+
+@lru_cache(maxsize=None)
+def _days_in_month(year, month):
+    """Returns the number of days in a month."""
+    return monthrange(year, month)[1]
+
+
+def add_months(value, months, anchor=None):
+    """Adds calendar months to a datetime.
+
+        The day of the month is kept, or clamped to the last day of
+        the resulting month if that month is shorter.
+
+        If ``value`` is on the monthly schedule of ``anchor`` (e.g. the
+        billing start date), the months are counted from the anchor
+        instead, so a clamped day does not carry over to later months
+        (January 31st is followed by February 28th, then March 31st).
+
+        Parameters:
+            value (datetime): The datetime to add the months to.
+            months (int): The number of months to add.
+            anchor (datetime): The first datetime of the schedule.
+
+        Returns:
+            datetime: The resulting datetime.
+    """
+    if anchor is not None:
+        elapsed = (value.year - anchor.year) * 12 + value.month - anchor.month
+
+        if add_months(anchor, elapsed) == value:
+            value, months = anchor, elapsed + months
+
+    month_index = value.month - 1 + months
+    year = value.year + month_index // 12
+    month = month_index % 12 + 1
+
+    return value.replace(
+        year=year, month=month, day=min(value.day, _days_in_month(year, month))
+    )
+
+
+@lru_cache(maxsize=None)
+def billing_step(unit, period):
+    """Returns the step between billing dates for a recurrence.
+
+        Parameters:
+            unit (str): The recurrence unit.
+            period (int): The number of units between billings.
 
-        return current + delta
+        Returns:
+            obj: A timedelta for fixed length units, the number of
+                months (int) for calendar units or ``None`` if there
+                is no next billing.
+    """
+    if unit in _TIMEDELTA_UNITS:
+        return timedelta(**{_TIMEDELTA_UNITS[unit]: period})
+
+    if unit in _MONTH_UNITS:
+        return _MONTH_UNITS[unit] * period
+
+    # If no recurrence period, no next billing datetime
+    return None
+
+
+def _apply_billing_step(current, step, anchor=None):
+    """Returns the billing datetime following current by step."""
+    if step is None:
+        return None
+
+    if isinstance(step, int):
+        return add_months(current, step, anchor)
+
+    return current + step
+
+
+def next_billing_datetimes(schedules):
+    """Calculates the next billing dates of many billing schedules.
+
+        The step for each distinct recurrence is only worked out once,
+        so millions of schedules can be processed in a single pass
+        (e.g. from a ``values_list`` query).
+
+        Parameters:
+            schedules (iterable): ``(current, recurrence_unit,
+                recurrence_period)`` tuples, optionally followed by the
+                billing anchor (see ``add_months``).
+
+        Returns:
+            list: The next billing datetime (or ``None``) for each
+                schedule, in the same order.
+    """
+    return [
+        _apply_billing_step(current, billing_step(unit, period), *anchor)
+        for current, unit, period, *anchor in schedules
+    ]
+
+
+def estimate_count(model, using='default'):
+    """Estimates the number of rows of a model from table statistics.
+
+        Unlike ``COUNT(*)``, this does not scan the table, so it stays
+        fast for tables with millions of rows. The estimate is only as
+        recent as the last ``ANALYZE`` (or autovacuum) of the table.
+
+        Parameters:
+            model (obj): The model class to estimate.
+            using (str): The database alias to query.
+
+        Returns:
+            int: The estimated number of rows or ``None`` if the
+                backend has no statistics for the table.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)'
+    elif connection.vendor == 'mysql':
+        sql = (
+            'SELECT table_rows FROM information_schema.tables '
+            'WHERE table_schema = DATABASE() AND table_name = %s'
+        )
+    elif connection.vendor == 'sqlite':
+        # The first number of each statistic is the number of rows
+        sql = 'SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1'
+    else:
+        return None
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        # e.g. the sqlite_stat1 table only exists after an ANALYZE
+        return None
+
+    if row is None or row[0] is None:
+        return None
+
+    estimate = int(float(str(row[0]).split()[0]))
+
+    # PostgreSQL reports -1 for tables that were never analyzed
+    return estimate if estimate >= 0 else None
 
 
 class PlanCostLink(models.Model):
@@ -305,9 +477,205 @@ class UserSubscription(models.Model):
         default=False,
         help_text=_('whether this subscription is cancelled or not'),
     )
+    payment_failures = models.PositiveIntegerField(
+        default=0,
+        help_text=_('the number of failed payments since the last success'),
+    )
+    date_payment_retry = models.DateTimeField(
+        blank=True,
+        help_text=_('the date to retry a failed payment after'),
+        null=True,
+        verbose_name='payment retry date',
+    )
+    payment_error = models.CharField(
+        blank=True,
+        default='',
+        help_text=_('the error of the last failed payment'),
+        max_length=255,
+    )
+    date_claim_expires = models.DateTimeField(
+        blank=True,
+        help_text=_('the date a runner stops holding its claim on this subscription'),
+        null=True,
+        verbose_name='claim expiry date',
+    )
 
     class Meta:
         ordering = ('user', 'date_billing_start',)
+        # Match the expired, new and due scans of the subscription
+        # manager. Both sets are needed: on SQLite and PostgreSQL the
+        # boolean filters are written as "active AND NOT cancelled",
+        # which SQLite can only match with the partial indexes. MySQL
+        # and Oracle compare the flags with "= 1" but do not support
+        # partial indexes (they are skipped), so they use the
+        # composite ones
+        indexes = [
+            models.Index(
+                fields=['active', 'cancelled', 'date_billing_end'],
+                name='dfs_subscription_end_idx',
+            ),
+            models.Index(
+                fields=['active', 'cancelled', 'date_billing_start'],
+                name='dfs_subscription_start_idx',
+            ),
+            models.Index(
+                fields=['active', 'cancelled', 'date_billing_next'],
+                name='dfs_subscription_next_idx',
+            ),
+            models.Index(
+                condition=Q(active=True, cancelled=False),
+                fields=['date_billing_end'],
+                name='dfs_subscription_expiry_idx',
+            ),
+            models.Index(
+                condition=Q(active=False, cancelled=False),
+                fields=['date_billing_start'],
+                name='dfs_subscription_new_idx',
+            ),
+            models.Index(
+                condition=Q(active=True, cancelled=False),
+                fields=['date_billing_next'],
+                name='dfs_subscription_due_idx',
+            ),
+        ]
+
+
+def billing_attempt_id(subscription_id, period_start, number=1):
+    """Returns the ID of a billing attempt for a billing period.
+
+        The ID only depends on the subscription, the start of the
+        billing period and the number of the attempt, so an attempt
+        that is saved again (e.g. after its transaction was rolled
+        back) gets the same ID and can be used as an idempotency key
+        with the payment provider. Each retry of a declined payment is
+        a new attempt with a new ID.
+
+        Parameters:
+            subscription_id (obj): The UUID of the UserSubscription.
+            period_start (obj): The start datetime of the billing
+                period.
+            number (int): The number of the attempt for the period.
+
+        Returns:
+            obj: A UUID.
+    """
+    if timezone.is_aware(period_start):
+        period_start = period_start.astimezone(timezone.utc)
+
+    return uuid5(
+        BILLING_ATTEMPT_NAMESPACE,
+        '{}:{}:{}'.format(subscription_id, period_start.isoformat(), number),
+    )
+
+
+class BillingAttempt(models.Model):
+    """A payment attempt for one billing period of a user subscription.
+
+        Attempts are saved before a payment is processed and are
+        completed once it succeeds, so a billing period can only be
+        charged once even if processing is interrupted. Declined
+        attempts are kept as failed and the period is retried with
+        the next attempt number.
+    """
+    id = models.UUIDField(
+        default=uuid4,
+        editable=False,
+        primary_key=True,
+        verbose_name='ID',
+    )
+    subscription = models.ForeignKey(
+        UserSubscription,
+        help_text=_('the user subscription being billed'),
+        on_delete=models.CASCADE,
+        related_name='billing_attempts',
+    )
+    date_period_start = models.DateTimeField(
+        help_text=_('the start of the billing period being billed'),
+        verbose_name='billing period start date',
+    )
+    number = models.PositiveIntegerField(
+        default=1,
+        help_text=_('the number of this attempt for the billing period'),
+        verbose_name='attempt number',
+    )
+    status = models.CharField(
+        choices=ATTEMPT_STATUS_CHOICES,
+        default=ATTEMPT_PENDING,
+        help_text=_('the status of the payment for this billing period'),
+        max_length=1,
+    )
+    date_created = models.DateTimeField(
+        auto_now_add=True,
+        help_text=_('the datetime the attempt was started'),
+        verbose_name='attempt date',
+    )
+    date_transaction = models.DateTimeField(
+        blank=True,
+        help_text=_('the datetime the payment was completed'),
+        null=True,
+        verbose_name='transaction date',
+    )
+
+    class Meta:
+        ordering = ('date_created',)
+        constraints = [
+            models.UniqueConstraint(
+                fields=['subscription', 'date_period_start', 'number'],
+                name='dfs_unique_billing_attempt',
+            ),
+        ]
+
+
+class BillingRun(models.Model):
+    """Checkpoint of a run of the subscription manager.
+
+        Records the phase of the run and the last subscription that
+        was processed so an interrupted run can be resumed.
+    """
+    id = models.UUIDField(
+        default=uuid4,
+        editable=False,
+        primary_key=True,
+        verbose_name='ID',
+    )
+    date_reference = models.DateTimeField(
+        help_text=_('the datetime subscriptions are processed up to'),
+        verbose_name='reference date',
+    )
+    phase = models.CharField(
+        choices=RUN_PHASE_CHOICES,
+        default=RUN_EXPIRED,
+        help_text=_('the processing phase the run has reached'),
+        max_length=1,
+    )
+    last_subscription_id = models.UUIDField(
+        blank=True,
+        help_text=_('the ID of the last subscription processed in this phase'),
+        null=True,
+        verbose_name='last subscription ID',
+    )
+    last_date_billing_next = models.DateTimeField(
+        blank=True,
+        help_text=_(
+            'the next billing date of the last subscription processed in '
+            'this phase, when subscriptions are processed by billing date'
+        ),
+        null=True,
+        verbose_name='last next billing date',
+    )
+    date_started = models.DateTimeField(
+        auto_now_add=True,
+        help_text=_('the datetime the run started'),
+        verbose_name='start date',
+    )
+    date_updated = models.DateTimeField(
+        auto_now=True,
+        help_text=_('the datetime of the last checkpoint'),
+        verbose_name='checkpoint date',
+    )
+
+    class Meta:
+        ordering = ('-date_started',)
 
 
 class SubscriptionTransaction(models.Model):
@@ -346,6 +714,13 @@ class SubscriptionTransaction(models.Model):
 
     class Meta:
         ordering = ('date_transaction', 'user',)
+        # Serves the keyset pagination of the transaction list
+        indexes = [
+            models.Index(
+                fields=['date_transaction', 'id'],
+                name='dfs_transaction_date_idx',
+            ),
+        ]
 
 
 class PlanList(models.Model):
@@ -0,0 +1,50 @@
+"""Signal receivers for django-flexible-subscriptions."""
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from subscriptions import models
+from subscriptions.cache import invalidate_subscribe_list
+
+
+# Models displayed on the public plan list
+SUBSCRIBE_LIST_MODELS = (
+    models.PlanList,
+    models.PlanListDetail,
+    models.SubscriptionPlan,
+    models.PlanCost,
+    models.PlanCostLink,
+)
+
+
+def _invalidate_subscribe_list(**kwargs):  # pylint: disable=unused-argument
+    """Invalidates the cached plan list now and after the commit.
+
+        The second invalidation stops a request that read the database
+        before the commit from serving the old plan list afterwards.
+    """
+    invalidate_subscribe_list()
+    transaction.on_commit(invalidate_subscribe_list)
+
+
+for subscribe_list_model in SUBSCRIBE_LIST_MODELS:
+    post_save.connect(
+        _invalidate_subscribe_list,
+        sender=subscribe_list_model,
+        dispatch_uid='dfs_subscribe_list_save_{}'.format(
+            subscribe_list_model.__name__
+        ),
+    )
+    post_delete.connect(
+        _invalidate_subscribe_list,
+        sender=subscribe_list_model,
+        dispatch_uid='dfs_subscribe_list_delete_{}'.format(
+            subscribe_list_model.__name__
+        ),
+    )
+
+# Linking plans to costs only sends m2m_changed
+m2m_changed.connect(
+    _invalidate_subscribe_list,
+    sender=models.PlanCost.plans.through,
+    dispatch_uid='dfs_subscribe_list_plan_costs',
+)
@@ -1,4 +1,6 @@
 """Template filters for Django Flexible Subscriptions."""
+from functools import lru_cache
+
 from django import template
 
 from subscriptions.conf import SETTINGS
@@ -7,7 +9,63 @@ from subscriptions.conf import SETTINGS
 register = template.Library()
 
 
+def _format_currency(currency_object, value, international):
+    """Formats a value with the provided Currency instance."""
+    return currency_object.format_currency(value, international)
+
+
+# Formatted values keyed by (Currency, value, international); the
+# Currency instance identifies the locale the value was formatted for
+if SETTINGS['currency_cache_size']:
+    _cached_format_currency = lru_cache(
+        maxsize=SETTINGS['currency_cache_size']
+    )(_format_currency)
+else:
+    _cached_format_currency = None
+
+
+def currency_cache_info():
+    """Returns the statistics of the currency filter cache.
+
+        Returns:
+            obj: The ``hits``, ``misses``, ``maxsize`` and
+                ``currsize`` of the cache, or ``None`` if the cache is
+                disabled.
+    """
+    if _cached_format_currency is None:
+        return None
+
+    return _cached_format_currency.cache_info()
+
+
+def currency_cache_clear():
+    """Removes all values from the currency filter cache."""
+    if _cached_format_currency is not None:
+        _cached_format_currency.cache_clear()
+
+
 @register.filter(name='currency')
-def currency(value):
-    """Displays value as a currency based on the provided settings."""
-    return SETTINGS['currency'].format_currency(value)
+def currency(value, international=False):
+    """Displays value as a currency based on the provided settings.
+
+        Formatted values are kept in a bounded LRU cache (see the
+        ``DFS_CURRENCY_CACHE_SIZE`` setting), as the same prices are
+        usually displayed on every render.
+    """
+    currency_object = SETTINGS['currency']
+    international = bool(international)
+
+    if _cached_format_currency is None:
+        return _format_currency(currency_object, value, international)
+
+    try:
+        return _cached_format_currency(currency_object, value, international)
+    except TypeError:
+        # Unhashable values cannot be cached
+        return _format_currency(currency_object, value, international)
+
+
+@register.filter(name='currency_list')
+def currency_list(values):
+    """Displays a list of values as currencies in a single pass."""
+    return list(SETTINGS['currency'].format_many(values))
@@ -146,6 +146,11 @@ urlpatterns = [
         views.TransactionListView.as_view(),
         name='dfs_transaction_list',
     ),
+    path(
+        'dfs/transactions/export/',
+        views.TransactionExportView.as_view(),
+        name='dfs_transaction_export',
+    ),
     path(
         'dfs/transactions/<uuid:transaction_id>/',
         views.TransactionDetailView.as_view(),
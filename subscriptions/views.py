@@ -1,23 +1,32 @@
 """Views for the Flexible Subscriptions app."""
 # pylint: disable=too-many-lines, no-self-use
+import hashlib
 from copy import copy
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import (
     LoginRequiredMixin, PermissionRequiredMixin
 )
 from django.contrib.messages.views import SuccessMessageMixin
+from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
 from django.forms import HiddenInput
 from django.forms.models import inlineformset_factory
-from django.http import HttpResponseRedirect
+from django.http import (
+    HttpResponseBadRequest, HttpResponseRedirect, StreamingHttpResponse
+)
 from django.http.response import HttpResponseNotAllowed, HttpResponseNotFound
 from django.shortcuts import get_object_or_404
 from django.template.response import TemplateResponse
 from django.urls import reverse_lazy
 from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.http import condition
 
-from subscriptions import models, forms, abstract
+from subscriptions import models, forms, abstract, cache, exports
 
 
 # Dashboard View
@@ -330,16 +339,28 @@ class PlanDeleteView(PermissionRequiredMixin, abstract.DeleteView):
 
 # User Subscription Views
 # -----------------------------------------------------------------------------.
-class SubscriptionListView(PermissionRequiredMixin, abstract.ListView):
+class SubscriptionListView(
+        PermissionRequiredMixin, abstract.KeysetPaginationMixin, abstract.ListView
+):
     """List of all subscriptions for the users"""
     model = get_user_model()
     permission_required = 'subscriptions.subscriptions'
     raise_exception = True
     context_object_name = 'users'
-    queryset = model.objects.all().exclude(subscriptions=None)
     paginate_by = 100
     template_name = 'subscriptions/subscription_list.html'
 
+    def get_queryset(self):
+        """Returns users with subscriptions and their plans prefetched."""
+        return self.model.objects.exclude(subscriptions=None).prefetch_related(
+            Prefetch(
+                'subscriptions',
+                queryset=models.UserSubscription.objects.select_related(
+                    'plan_cost', 'subscription_plan'
+                ).order_by('date_billing_start', 'pk'),
+            )
+        )
+
 
 class SubscriptionCreateView(
         PermissionRequiredMixin, SuccessMessageMixin, abstract.CreateView
@@ -401,15 +422,36 @@ class SubscriptionDeleteView(PermissionRequiredMixin, abstract.DeleteView):
 
 # Subscription Transaction Views
 # -----------------------------------------------------------------------------
-class TransactionListView(PermissionRequiredMixin, abstract.ListView):
-    """List of all subscription payment transactions."""
+class TransactionListView(
+        PermissionRequiredMixin, abstract.KeysetPaginationMixin, abstract.ListView
+):
+    """List of all subscription payment transactions.
+
+        Attributes:
+            show_estimated_count (bool): Whether to display the number
+                of transactions estimated from the table statistics.
+    """
     model = models.SubscriptionTransaction
+    queryset = models.SubscriptionTransaction.objects.select_related(
+        'user', 'subscription'
+    )
     permission_required = 'subscriptions.subscriptions'
     raise_exception = True
     context_object_name = 'transactions'
     paginate_by = 50
+    keyset_ordering = ('date_transaction', 'id')
+    show_estimated_count = False
     template_name = 'subscriptions/transaction_list.html'
 
+    def get_context_data(self, *, object_list=None, **kwargs):
+        """Adds the estimated number of transactions if enabled."""
+        context = super().get_context_data(object_list=object_list, **kwargs)
+
+        if self.show_estimated_count:
+            context['estimated_count'] = models.estimate_count(self.model)
+
+        return context
+
 
 class TransactionDetailView(PermissionRequiredMixin, abstract.DetailView):
     """Shows details of a specific subscription payment transaction."""
@@ -421,6 +463,55 @@ class TransactionDetailView(PermissionRequiredMixin, abstract.DetailView):
     template_name = 'subscriptions/transaction_detail.html'
 
 
+class TransactionExportView(PermissionRequiredMixin, View):
+    """Streams the subscription payment transactions as CSV or JSONL.
+
+        Accepts the ``format`` (``csv`` or ``jsonl``), ``start`` and
+        ``end`` (ISO 8601 dates or datetimes) and ``user`` (primary
+        key) query parameters.
+    """
+    permission_required = 'subscriptions.subscriptions'
+    raise_exception = True
+
+    def get(self, request, *args, **kwargs):
+        """Returns the streaming export response."""
+        export_format = request.GET.get('format', 'csv')
+
+        if export_format not in exports.EXPORT_FORMATS:
+            return HttpResponseBadRequest(
+                'format must be one of: {}'.format(
+                    ', '.join(sorted(exports.EXPORT_FORMATS))
+                )
+            )
+
+        try:
+            queryset = exports.filter_transactions(
+                start=self._get_datetime(request, 'start'),
+                end=self._get_datetime(request, 'end'),
+                user=request.GET.get('user') or None,
+            )
+        except (ValueError, ValidationError) as error:
+            return HttpResponseBadRequest(str(error))
+
+        line_generator, content_type = exports.EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(
+            line_generator(exports.transaction_rows(queryset)),
+            content_type=content_type,
+        )
+        response['Content-Disposition'] = (
+            'attachment; filename="transactions.{}"'.format(export_format)
+        )
+
+        return response
+
+    @staticmethod
+    def _get_datetime(request, name):
+        """Returns the parsed datetime of a query parameter or None."""
+        value = request.GET.get(name)
+
+        return exports.parse_export_datetime(value) if value else None
+
+
 # PlanList Views
 # -----------------------------------------------------------------------------
 class PlanListListView(PermissionRequiredMixin, abstract.ListView):
@@ -601,6 +692,42 @@ class PlanListDetailDeleteView(PermissionRequiredMixin, abstract.DeleteView):
 
 # Subscribe Views
 # -----------------------------------------------------------------------------
+def _subscribe_list_version(request):
+    """Returns the version of the plan list page for a request.
+
+        The page renders the user (e.g. in the base template), so no
+        version is returned for authenticated users and their pages are
+        never answered with ``304 Not Modified``.
+    """
+    if request.user.is_authenticated:
+        return None
+
+    return cache.get_subscribe_list_version()
+
+
+def subscribe_list_etag(request, *args, **kwargs):  # pylint: disable=unused-argument
+    """Returns the ETag of the plan list page.
+
+        The CSRF cookie is part of the tag, as the page embeds a token
+        for it in each subscribe form.
+    """
+    version = _subscribe_list_version(request)
+
+    if version is None:
+        return None
+
+    return hashlib.sha1('{}:{}'.format(
+        version[0], request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    ).encode()).hexdigest()
+
+
+def subscribe_list_last_modified(request, *args, **kwargs):  # pylint: disable=unused-argument
+    """Returns the time the plan list last changed."""
+    version = _subscribe_list_version(request)
+
+    return version[1] if version else None
+
+
 class SubscribeList(abstract.TemplateView):
     """Detail view of the first active PlanList instance.
 
@@ -610,21 +737,14 @@ class SubscribeList(abstract.TemplateView):
     context_object_name = 'plan_list'
     template_name = 'subscriptions/subscribe_list.html'
 
+    @method_decorator(condition(
+        etag_func=subscribe_list_etag,
+        last_modified_func=subscribe_list_last_modified,
+    ))
     def get(self, request, *args, **kwargs):
         """Ensures content is available to display, then returns page."""
-        # Get the appropriate plan list
-        plan_list = models.PlanList.objects.filter(active=True).first()
-
-        # Retrieve the plan details for template display
-        details = models.PlanListDetail.objects.filter(
-            plan_list=plan_list,
-            # TODO: if plan_lists are going to be used,
-            # we need to figure out how to check that a plan
-            # has an attached cost.
-            # NOTE: check offers/management cmd
-            # plan__costs__exists=1,
-            # plan__costs__isnull=False
-        ).order_by('order')
+        # Get the appropriate plan list and its details (with plans)
+        plan_list, details = cache.get_subscribe_list()
 
         if plan_list:
             response = TemplateResponse(
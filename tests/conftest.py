@@ -43,6 +43,14 @@ def pytest_configure():
     django.setup()
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Clears the cache between tests, as database changes are rolled back."""
+    from django.core.cache import cache  # pylint: disable=import-outside-toplevel
+
+    cache.clear()
+
+
 @pytest.fixture
 def dfs():
     """Fixture that returns all required models for testing DFS."""
@@ -121,20 +121,24 @@ def test__determine_currency_settings__not_declared():
 @override_settings(
     DFS_ENABLE_ADMIN=1,
     DFS_CURRENCY='en_us',
+    DFS_CURRENCY_CACHE_SIZE=2,
     DFS_BASE_TEMPLATE='3',
     DFS_SUBSCRIBE_VIEW='a.b',
+    DFS_SUBSCRIBE_LIST_CACHE='default',
     DFS_MANAGER_CLASS='a.b',
 )
 def test__compile_settings__assigned_properly():
     """Tests that Django settings all proper populate SETTINGS."""
     subscription_settings = conf.compile_settings()
 
-    assert len(subscription_settings) == 5
+    assert len(subscription_settings) == 7
     assert subscription_settings['enable_admin'] == 1
     assert subscription_settings['currency'].locale == 'en_us'
+    assert subscription_settings['currency_cache_size'] == 2
     assert subscription_settings['base_template'] == '3'
     assert subscription_settings['subscribe_view']['module'] == 'a'
     assert subscription_settings['subscribe_view']['class'] == 'b'
+    assert subscription_settings['subscribe_list_cache'] == 'default'
     assert subscription_settings['management_manager']['module'] == 'a'
     assert subscription_settings['management_manager']['class'] == 'b'
 
@@ -151,9 +155,10 @@ def test__compile_settings__defaults():
 
     subscription_settings = conf.compile_settings()
 
-    assert len(subscription_settings) == 5
+    assert len(subscription_settings) == 7
     assert subscription_settings['enable_admin'] is False
     assert subscription_settings['currency'].locale == 'en_us'
+    assert subscription_settings['currency_cache_size'] == 256
     assert subscription_settings['base_template'] == 'subscriptions/base.html'
     assert subscription_settings['subscribe_view']['module'] == (
         'subscriptions.views'
@@ -161,6 +166,7 @@ def test__compile_settings__defaults():
     assert subscription_settings['subscribe_view']['class'] == (
         'SubscribeView'
     )
+    assert subscription_settings['subscribe_list_cache'] is None
     assert subscription_settings['management_manager']['module'] == (
         'subscriptions.management.commands._manager'
     )
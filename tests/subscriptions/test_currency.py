@@ -2,6 +2,8 @@
 # pylint: disable=protected-access, too-many-lines
 from decimal import Decimal
 
+import pytest
+
 from subscriptions import currency
 
 
@@ -287,7 +289,8 @@ def test__currency__determine_symbol_details__local_positive():
     test_currency = currency.Currency(conventions)
     test_currency.international = False
 
-    details = test_currency._determine_symbol_details(False)
+    with pytest.deprecated_call():
+        details = test_currency._determine_symbol_details(False)
 
     assert details['symbol'] == 1
     assert details['precedes'] == 3
@@ -313,7 +316,8 @@ def test__currency__determine_symbol_details__local_negative():
     test_currency = currency.Currency(conventions)
     test_currency.international = False
 
-    details = test_currency._determine_symbol_details(True)
+    with pytest.deprecated_call():
+        details = test_currency._determine_symbol_details(True)
 
     assert details['symbol'] == 1
     assert details['precedes'] == 4
@@ -339,7 +343,8 @@ def test__currency__determine_symbol_details__international_positive():
     test_currency = currency.Currency(conventions)
     test_currency.international = True
 
-    details = test_currency._determine_symbol_details(False)
+    with pytest.deprecated_call():
+        details = test_currency._determine_symbol_details(False)
 
     assert details['symbol'] == 2
     assert details['precedes'] == 3
@@ -365,7 +370,8 @@ def test__currency__determine_symbol_details__international_negative():
     test_currency = currency.Currency(conventions)
     test_currency.international = True
 
-    details = test_currency._determine_symbol_details(True)
+    with pytest.deprecated_call():
+        details = test_currency._determine_symbol_details(True)
 
     assert details['symbol'] == 2
     assert details['precedes'] == 4
@@ -391,7 +397,8 @@ def test__currency__determine_symbol_details__positive_not_sep_by_space():
     test_currency = currency.Currency(conventions)
     test_currency.international = False
 
-    details = test_currency._determine_symbol_details(False)
+    with pytest.deprecated_call():
+        details = test_currency._determine_symbol_details(False)
 
     assert details['separated'] == ''
 
@@ -413,7 +420,8 @@ def test__currency__determine_symbol_details__negative_not_sep_by_space():
     test_currency = currency.Currency(conventions)
     test_currency.international = False
 
-    details = test_currency._determine_symbol_details(True)
+    with pytest.deprecated_call():
+        details = test_currency._determine_symbol_details(True)
 
     assert details['separated'] == ''
 
@@ -1178,3 +1186,104 @@ def test__currency__format_currency__output__sign_position_other_negative_follow
     test_currency = currency.Currency(conventions)
 
     assert test_currency.format_currency('-1.00') == '-1.00$'
+
+
+def test__currency__format_currency__does_not_mutate_currency():
+    """Confirms formatting does not change the shared instance."""
+    test_currency = currency.Currency('en_us')
+
+    assert test_currency.format_currency('1.00', international=True) == 'USD1.00'
+    assert test_currency.international is False
+
+
+def test__currency__format_currency__international_symbol():
+    """Confirms the international format uses the compiled formatter."""
+    conventions = {
+        'currency_symbol': '$',
+        'int_curr_symbol': 'USD ',
+        'frac_digits': 2,
+        'int_frac_digits': 0,
+    }
+    test_currency = currency.Currency(conventions)
+
+    assert test_currency.format_currency('1234.56') == '$1234.56'
+    assert test_currency.format_currency('1234.56', international=True) == 'USD 1235'
+
+
+def test__currency_format__immutable():
+    """Confirms compiled formatters cannot be modified."""
+    currency_format = currency.CurrencyFormat(currency.CURRENCY['en_us'])
+
+    with pytest.raises(AttributeError):
+        currency_format.grouping = 2
+
+    with pytest.raises(AttributeError):
+        del currency_format.grouping
+
+    with pytest.raises(AttributeError):
+        currency_format.other = 1
+
+
+def test__currency_format__format__grouping():
+    """Confirms whole numbers are grouped from the right."""
+    currency_format = currency.CurrencyFormat(currency.CURRENCY['de_de'])
+
+    assert currency_format.format('1') == '1,00 €'
+    assert currency_format.format('1000') == '1.000,00 €'
+    assert currency_format.format('1234567.891') == '1.234.567,89 €'
+    assert currency_format.format('-1234') == '(1.234,00 €)'
+
+
+def test__currency_format__matches_add_symbols():
+    """Confirms the compiled layout matches the symbol placement."""
+    for sign_position in range(6):
+        test_currency = currency.Currency({
+            'currency_symbol': '$',
+            'p_cs_precedes': False,
+            'p_sep_by_space': True,
+            'positive_sign': '+',
+            'p_sign_posn': sign_position,
+            'mon_thousands_sep': ',',
+        })
+
+        assert test_currency.format_currency('1234.5') == test_currency.add_symbols(
+            '1,234.50', False
+        )
+
+
+def test__currency__legacy_helpers_use_compiled_format():
+    """Confirms the helper methods delegate to the compiled formatters."""
+    test_currency = currency.Currency('de_de')
+    test_currency.international = True
+
+    num_whole, num_frac = test_currency._split_value(Decimal('-1234.567'))
+    formatted = test_currency._format_value(
+        test_currency._group_whole_num(num_whole), num_frac
+    )
+
+    assert test_currency.add_symbols(formatted, True) == (
+        test_currency.format_currency('-1234.567', international=True)
+    )
+
+
+def test__currency__format_many():
+    """Confirms format_many matches format_currency for each value."""
+    test_currency = currency.Currency('fr_ca')
+    values = ['0', '1000', '-1234567.891', Decimal('0.005'), 12]
+
+    assert list(test_currency.format_many(values)) == [
+        test_currency.format_currency(value) for value in values
+    ]
+    assert list(test_currency.format_many(values, international=True)) == [
+        test_currency.format_currency(value, international=True)
+        for value in values
+    ]
+
+
+def test__currency__format_many__streams_values():
+    """Confirms format_many yields values lazily."""
+    test_currency = currency.Currency('en_us')
+    formatted = test_currency.format_many(iter(['1', '2']))
+
+    assert next(formatted) == '$1.00'
+    assert next(formatted) == '$2.00'
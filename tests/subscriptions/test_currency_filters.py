@@ -1,10 +1,44 @@
 """Tests the currency_filters module."""
 from unittest.mock import patch
 
-from subscriptions.templatetags.currency_filters import currency
+from subscriptions.templatetags import currency_filters
+from subscriptions.templatetags.currency_filters import currency, currency_list
 
 
 @patch.dict('subscriptions.conf.SETTINGS', currency_locale='en_us')
 def test_currency_filter():
     """Tests that value is properly returned as currency."""
     assert currency('1000.005') == '$1,000.01'
+
+
+@patch.dict('subscriptions.conf.SETTINGS', currency_locale='en_us')
+def test_currency_list_filter():
+    """Tests that each value is returned as currency."""
+    assert currency_list(['1000.005', '-2']) == ['$1,000.01', '($2.00)']
+
+
+def test_currency_filter_international():
+    """Tests that the international format can be requested."""
+    assert currency('1000.005', True) == 'USD1,000.01'
+
+
+def test_currency_filter_cache_hits():
+    """Tests that repeated values are served from the cache."""
+    currency_filters.currency_cache_clear()
+
+    assert currency('9.99') == '$9.99'
+    assert currency('9.99') == '$9.99'
+    assert currency('9.99', True) == 'USD9.99'
+
+    cache_info = currency_filters.currency_cache_info()
+
+    assert cache_info.hits == 1
+    assert cache_info.misses == 2
+    assert cache_info.maxsize == 256
+
+
+@patch.object(currency_filters, '_cached_format_currency', None)
+def test_currency_filter_cache_disabled():
+    """Tests that values are formatted without a cache when disabled."""
+    assert currency('9.99') == '$9.99'
+    assert currency_filters.currency_cache_info() is None
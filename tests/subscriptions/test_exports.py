@@ -0,0 +1,137 @@
+"""Tests for the exports module."""
+import json
+from datetime import datetime
+
+import pytest
+
+from subscriptions import exports, models
+
+
+pytestmark = pytest.mark.django_db  # pylint: disable=invalid-name
+
+
+def create_transactions(user, count, day=1):
+    """Creates transactions a minute apart on one day."""
+    return [
+        models.SubscriptionTransaction.objects.create(
+            user=user,
+            date_transaction=datetime(2020, 1, day, 0, index),
+            amount='{}.50'.format(index),
+        )
+        for index in range(count)
+    ]
+
+
+def test_parse_export_datetime():
+    """Tests that dates are parsed as midnight."""
+    assert exports.parse_export_datetime('2020-01-02') == datetime(2020, 1, 2)
+    assert exports.parse_export_datetime('2020-01-02T03:04:05') == (
+        datetime(2020, 1, 2, 3, 4, 5)
+    )
+
+
+def test_parse_export_datetime_invalid():
+    """Tests that invalid values raise a ValueError."""
+    with pytest.raises(ValueError):
+        exports.parse_export_datetime('January')
+
+
+def test_transaction_rows_chunks(django_user_model):
+    """Tests that every transaction is read once across chunks."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    transactions = create_transactions(user, 5)
+
+    rows = list(exports.transaction_rows(
+        models.SubscriptionTransaction.objects.all(), chunk_size=2
+    ))
+
+    assert [row['id'] for row in rows] == [
+        transaction.id for transaction in transactions
+    ]
+    assert rows[1]['username'] == 'a'
+    assert rows[1]['formatted_amount'] == '$1.50'
+
+
+def test_transaction_rows_without_amount(django_user_model):
+    """Tests that a transaction without an amount is not formatted."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    transactions = create_transactions(user, 3)
+    transactions[1].amount = None
+    transactions[1].save()
+
+    rows = list(exports.transaction_rows(
+        models.SubscriptionTransaction.objects.all()
+    ))
+
+    assert [row['formatted_amount'] for row in rows] == ['$0.50', '', '$2.50']
+
+
+def test_filter_transactions(django_user_model):
+    """Tests the date range and user filters."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    other_user = django_user_model.objects.create_user(username='c', password='d')
+    create_transactions(user, 2, day=1)
+    create_transactions(user, 2, day=2)
+    create_transactions(other_user, 2, day=2)
+
+    assert exports.filter_transactions(
+        start=datetime(2020, 1, 2), end=datetime(2020, 1, 3), user=user.id,
+    ).count() == 2
+    assert exports.filter_transactions(end=datetime(2020, 1, 2)).count() == 2
+
+
+def test_csv_lines(django_user_model):
+    """Tests that the CSV export starts with a header."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    transaction = create_transactions(user, 1)[0]
+
+    lines = list(exports.csv_lines(exports.transaction_rows(
+        models.SubscriptionTransaction.objects.all()
+    )))
+
+    assert lines == [
+        'id,date_transaction,user_id,username,plan_cost_id,amount,'
+        'formatted_amount\r\n',
+        '{},2020-01-01T00:00:00,{},a,,0.5000,$0.50\r\n'.format(
+            transaction.id, user.id
+        ),
+    ]
+
+
+def test_jsonl_lines(django_user_model):
+    """Tests that each JSONL line is a JSON object."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    create_transactions(user, 2)
+
+    lines = list(exports.jsonl_lines(exports.transaction_rows(
+        models.SubscriptionTransaction.objects.all()
+    )))
+
+    assert len(lines) == 2
+    assert json.loads(lines[1]) == {
+        'id': json.loads(lines[1])['id'],
+        'date_transaction': '2020-01-01T00:01:00',
+        'user_id': user.id,
+        'username': 'a',
+        'plan_cost_id': None,
+        'amount': '1.5000',
+        'formatted_amount': '$1.50',
+    }
+
+
+def test_csv_lines_escape_formulas(django_user_model):
+    """Tests that user-controlled text cannot run as a formula."""
+    user = django_user_model.objects.create_user(
+        username='=HYPERLINK("http://example.com")', password='b'
+    )
+    models.SubscriptionTransaction.objects.create(
+        user=user, date_transaction=datetime(2020, 1, 1), amount='-1.00',
+    )
+
+    lines = list(exports.csv_lines(exports.transaction_rows(
+        models.SubscriptionTransaction.objects.all()
+    )))
+
+    assert '"\'=HYPERLINK(""http://example.com"")"' in lines[1]
+    assert ',-1.0000,' in lines[1]
+    assert lines[1].endswith(',($1.00)\r\n')
@@ -0,0 +1,58 @@
+"""Tests for the export_transactions management command."""
+from datetime import datetime
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from subscriptions import models
+
+pytestmark = pytest.mark.django_db  # pylint: disable=invalid-name
+
+
+def create_transaction(user, day):
+    """Creates a transaction on a day of January 2020."""
+    return models.SubscriptionTransaction.objects.create(
+        user=user, date_transaction=datetime(2020, 1, day), amount='1.00',
+    )
+
+
+def test_export_transactions_csv(django_user_model):
+    """Tests that the CSV export is written to stdout."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    create_transaction(user, 1)
+    create_transaction(user, 2)
+    out = StringIO()
+
+    call_command('export_transactions', '--start=2020-01-02', stdout=out)
+
+    lines = out.getvalue().splitlines()
+
+    assert len(lines) == 2
+    assert lines[0].startswith('id,date_transaction')
+    assert '2020-01-02T00:00:00' in lines[1]
+
+
+def test_export_transactions_jsonl_output(django_user_model, tmp_path):
+    """Tests that the JSONL export can be written to a file."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    create_transaction(user, 1)
+    create_transaction(user, 2)
+    path = tmp_path / 'transactions.jsonl'
+
+    call_command(
+        'export_transactions',
+        '--format=jsonl',
+        '--chunk-size=1',
+        '--output={}'.format(path),
+        '--user={}'.format(user.id),
+    )
+
+    assert len(path.read_text().splitlines()) == 2
+
+
+def test_export_transactions_invalid_date():
+    """Tests that an invalid date raises a CommandError."""
+    with pytest.raises(CommandError):
+        call_command('export_transactions', '--end=soon', stdout=StringIO())
@@ -1,11 +1,16 @@
 """Tests for the _manager module."""
+import asyncio
+import tracemalloc
 from datetime import datetime
+from decimal import Decimal
 from unittest.mock import patch
 
 import pytest
 from django.contrib.auth.models import Group
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from subscriptions import models
-from subscriptions.management.commands import _manager
+from subscriptions.management.commands import _manager, _metrics
 from tests.subscriptions import test_forms
 
 pytestmark = pytest.mark.django_db  # pylint: disable=invalid-name
@@ -282,7 +287,7 @@ def test_manager_process_new_next_date(django_user_model):
     user_subscription_id = user_subscription.id
     user_subscription = models.UserSubscription.objects.get(
         id=user_subscription_id)
-    next_date = datetime(2018, 1, 31, 11, 30, 0, 520000)
+    next_date = datetime(2018, 2, 1, 1, 1, 1)
 
     assert user_subscription.date_billing_next == next_date
 
@@ -338,12 +343,37 @@ def test_manager_process_due_billing_dates(django_user_model):
 
     user_subscription = models.UserSubscription.objects.get(
         id=user_subscription_id)
-    next_date = datetime(2018, 3, 3, 11, 30, 0, 520000)
+    next_date = datetime(2018, 3, 1, 1, 1, 1)
 
     assert user_subscription.date_billing_next == next_date
     assert user_subscription.date_billing_last == datetime(2018, 2, 1, 2, 2, 2)
 
 
+def test_manager_process_due_keeps_billing_day(django_user_model):
+    """Tests that monthly renewals keep the billing day after short months."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_due_user_subscription(user)
+    user_subscription.date_billing_start = datetime(2018, 1, 31, 1, 1, 1)
+    user_subscription.date_billing_next = datetime(2018, 1, 31, 1, 1, 1)
+    user_subscription.save()
+    billing_dates = []
+
+    manager = _manager.Manager()
+
+    for _ in range(4):
+        user_subscription.refresh_from_db()
+        manager.process_due(user_subscription)
+        user_subscription.refresh_from_db()
+        billing_dates.append(user_subscription.date_billing_next)
+
+    assert billing_dates == [
+        datetime(2018, 2, 28, 1, 1, 1),
+        datetime(2018, 3, 31, 1, 1, 1),
+        datetime(2018, 4, 30, 1, 1, 1),
+        datetime(2018, 5, 31, 1, 1, 1),
+    ]
+
+
 @patch(
     'subscriptions.management.commands._manager.Manager.process_payment',
     lambda self, **kwargs: False
@@ -500,3 +530,1877 @@ def test_manager_record_transaction_with_date(django_user_model):
         transaction_count + 1
     )
     assert transaction.date_transaction == transaction_date
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_batch_with_due(django_user_model):
+    """Tests that batch processing renews every due subscription."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    subscription_ids = [
+        create_due_user_subscription(user).id for _ in range(5)
+    ]
+    transaction_count = models.SubscriptionTransaction.objects.all().count()
+
+    manager = _manager.Manager()
+    manager.batch_size = 2
+    manager.process_subscriptions()
+
+    for subscription_id in subscription_ids:
+        user_subscription = models.UserSubscription.objects.get(
+            id=subscription_id
+        )
+        assert user_subscription.date_billing_last == datetime(2018, 2, 2)
+        assert user_subscription.date_billing_next == datetime(
+            2018, 3, 1, 1, 1, 1
+        )
+
+    assert models.SubscriptionTransaction.objects.all().count() == (
+        transaction_count + 5
+    )
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_batch_bulk_writes(django_user_model):
+    """Tests that batch processing writes once per chunk."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+
+    for _ in range(4):
+        create_due_user_subscription(user)
+
+    manager = _manager.Manager()
+    manager.batch_size = 2
+
+    with CaptureQueriesContext(connection) as context:
+        manager.process_subscriptions()
+
+    updates = [
+        query for query in context.captured_queries
+        if query['sql'].startswith('UPDATE "subscriptions_usersubscription"')
+    ]
+    inserts = [
+        query for query in context.captured_queries
+        if query['sql'].startswith(
+            'INSERT INTO "subscriptions_subscriptiontransaction"'
+        )
+    ]
+
+    assert len(updates) == 2
+    assert len(inserts) == 2
+
+
+@patch(
+    'subscriptions.management.commands._manager.Manager.process_payment',
+    lambda self, **kwargs: False
+)
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_batch_payment_error(django_user_model):
+    """Tests that batch processing skips subscriptions with payment errors."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_due_user_subscription(user)
+    transaction_count = models.SubscriptionTransaction.objects.all().count()
+
+    manager = _manager.Manager()
+    manager.batch_size = 2
+    manager.process_subscriptions()
+
+    user_subscription = models.UserSubscription.objects.get(
+        id=user_subscription.id
+    )
+
+    assert user_subscription.date_billing_last == datetime(2018, 1, 1, 1, 1, 1)
+    assert user_subscription.date_billing_next == datetime(2018, 2, 1, 1, 1, 1)
+    assert models.SubscriptionTransaction.objects.all().count() == (
+        transaction_count
+    )
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 1, 2)
+)
+def test_manager_process_subscriptions_batch_notifies(django_user_model):
+    """Tests that batch processing still calls the notification hooks."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    subscription_plan = create_subscription_plan()
+    plan_cost = create_cost(subscription_plan)
+    user_subscription = models.UserSubscription.objects.create(
+        user=user,
+        plan_cost=plan_cost,
+        subscription_plan=subscription_plan,
+        date_billing_start=datetime(2018, 1, 1, 1, 1, 1),
+        date_billing_end=None,
+        date_billing_last=None,
+        date_billing_next=None,
+        active=False,
+        cancelled=False,
+    )
+
+    manager = _manager.Manager()
+    manager.batch_size = 2
+
+    with patch.object(manager, 'notify_new') as notify_new:
+        manager.process_subscriptions()
+
+    notify_new.assert_called_once_with(user_subscription)
+    assert models.UserSubscription.objects.get(
+        id=user_subscription.id
+    ).active is True
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_batch_flushes_on_error(django_user_model):
+    """Tests that processed subscriptions are saved if a later one fails."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    subscription_ids = sorted(
+        create_due_user_subscription(user).id for _ in range(2)
+    )
+    payments = iter([True, ValueError('Gateway error')])
+
+    def process_payment(**kwargs):  # pylint: disable=unused-argument
+        result = next(payments)
+
+        if isinstance(result, Exception):
+            raise result
+
+        return result
+
+    manager = _manager.Manager()
+    manager.batch_size = 2
+    manager.process_payment = process_payment
+
+    with pytest.raises(ValueError):
+        manager.process_subscriptions()
+
+    first = models.UserSubscription.objects.get(id=subscription_ids[0])
+    second = models.UserSubscription.objects.get(id=subscription_ids[1])
+
+    assert first.date_billing_last == datetime(2018, 2, 2)
+    assert second.date_billing_last == datetime(2018, 1, 1, 1, 1, 1)
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_counts(django_user_model):
+    """Tests that processed subscriptions and payment errors are counted."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    create_due_user_subscription(user)
+    create_due_user_subscription(user)
+
+    manager = _manager.Manager()
+    manager.process_subscriptions()
+
+    assert manager.counts['renewed'] == 2
+    assert manager.counts['payment_errors'] == 0
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_shards_are_disjoint(django_user_model):
+    """Tests that every subscription is processed by exactly one shard."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+
+    for _ in range(10):
+        create_due_user_subscription(user)
+
+    processed = []
+    manager = _manager.Manager()
+    manager.process_due = processed.append
+
+    for index in range(3):
+        manager.process_subscriptions(shard=(index, 3))
+
+    assert len(processed) == 10
+    assert len({subscription.id for subscription in processed}) == 10
+
+
+def test_manager_shard_queryset_bounds():
+    """Tests the primary key ranges of the first and last shards."""
+    queryset = models.UserSubscription.objects.all()
+
+    first = str(_manager.Manager._shard_queryset(queryset, (0, 4)).query)
+    last = str(_manager.Manager._shard_queryset(queryset, (3, 4)).query)
+
+    assert '00000000000000000000000000000000' in first
+    assert '40000000000000000000000000000000' in first
+    assert 'c0000000000000000000000000000000' in last
+    assert '<' not in last
+
+
+def test_manager_process_subscriptions_parallel():
+    """Tests that each worker processes one shard and counts are combined."""
+    shards = []
+
+    def process_subscriptions(self, shard=None):
+        shards.append(shard)
+        self.counts['renewed'] += shard[0] + 1
+
+    manager = _manager.Manager()
+
+    with patch.object(
+        _manager.Manager, 'process_subscriptions', process_subscriptions
+    ):
+        manager.process_subscriptions_parallel(3)
+
+    assert sorted(shards) == [(0, 3), (1, 3), (2, 3)]
+    assert manager.counts['renewed'] == 6
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_claim(django_user_model):
+    """Tests that claimed processing renews every due subscription."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    subscription_ids = [
+        create_due_user_subscription(user).id for _ in range(3)
+    ]
+
+    manager = _manager.Manager()
+    manager.claim = True
+    manager.batch_size = 2
+    manager.process_subscriptions()
+
+    assert manager.counts['renewed'] == 3
+    assert models.UserSubscription.objects.filter(
+        id__in=subscription_ids, date_billing_last=datetime(2018, 2, 2)
+    ).count() == 3
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_claim_skips_locked(django_user_model):
+    """Tests that claimed chunks are locked with SKIP LOCKED."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    create_due_user_subscription(user)
+    querysets = []
+    fetch_chunk = _manager.Manager._fetch_chunk
+
+    def capture_fetch_chunk(queryset, ordering, cursor, batch_size):
+        querysets.append(queryset)
+        return fetch_chunk(queryset, ordering, cursor, batch_size)
+
+    manager = _manager.Manager()
+    manager.claim = True
+    manager._fetch_chunk = capture_fetch_chunk  # pylint: disable=protected-access
+    manager.process_subscriptions()
+
+    assert querysets
+    for queryset in querysets:
+        assert queryset.query.select_for_update is True
+        assert queryset.query.select_for_update_skip_locked is True
+        assert queryset.query.select_for_update_of == ('self',)
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_claim_commits_on_error(django_user_model):
+    """Tests that a failing claimed chunk keeps the processed subscriptions."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    subscription_ids = sorted(
+        create_due_user_subscription(user).id for _ in range(2)
+    )
+    payments = iter([True, ValueError('Gateway error')])
+
+    def process_payment(**kwargs):  # pylint: disable=unused-argument
+        result = next(payments)
+
+        if isinstance(result, Exception):
+            raise result
+
+        return result
+
+    manager = _manager.Manager()
+    manager.claim = True
+    manager.process_payment = process_payment
+
+    with pytest.raises(ValueError):
+        manager.process_subscriptions()
+
+    first = models.UserSubscription.objects.get(id=subscription_ids[0])
+    second = models.UserSubscription.objects.get(id=subscription_ids[1])
+
+    assert first.date_billing_last == datetime(2018, 2, 2)
+    assert second.date_billing_last == datetime(2018, 1, 1, 1, 1, 1)
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_claim_crash_no_second_charge(
+        django_user_model
+):
+    """Tests that a claimed chunk interrupted after payment is not charged twice."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    subscription = create_due_user_subscription(user)
+    charges = []
+    reconciled = []
+
+    def process_payment(**kwargs):
+        charges.append(kwargs['attempt'].id)
+        return True
+
+    def reconcile_payment(subscription, attempt):  # pylint: disable=unused-argument
+        reconciled.append(attempt.id)
+        return attempt.id in charges
+
+    def crash(*args, **kwargs):  # pylint: disable=unused-argument
+        raise KeyboardInterrupt
+
+    manager = _manager.Manager()
+    manager.claim = True
+    manager.process_payment = process_payment
+
+    with patch.object(manager, '_complete_attempt', crash):
+        with pytest.raises(KeyboardInterrupt):
+            manager.process_subscriptions()
+
+    # The attempt was committed before the payment and the claim released
+    attempt = models.BillingAttempt.objects.get()
+    subscription.refresh_from_db()
+
+    assert attempt.status == models.ATTEMPT_PENDING
+    assert subscription.date_claim_expires is None
+
+    manager = _manager.Manager()
+    manager.claim = True
+    manager.process_payment = process_payment
+    manager.reconcile_payment = reconcile_payment
+    manager.process_subscriptions()
+
+    attempt.refresh_from_db()
+    subscription.refresh_from_db()
+
+    assert charges == reconciled == [attempt.id]
+    assert attempt.status == models.ATTEMPT_SUCCEEDED
+    assert subscription.date_billing_last == datetime(2018, 2, 2)
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_claim_skips_claimed(django_user_model):
+    """Tests that subscriptions claimed by another runner are skipped."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    claimed = create_due_user_subscription(user)
+    expired_claim = create_due_user_subscription(user)
+    models.UserSubscription.objects.filter(id=claimed.id).update(
+        date_claim_expires=datetime(2018, 2, 2, 1),
+    )
+    models.UserSubscription.objects.filter(id=expired_claim.id).update(
+        date_claim_expires=datetime(2018, 2, 1, 23),
+    )
+
+    manager = _manager.Manager()
+    manager.claim = True
+    manager.process_subscriptions()
+
+    claimed.refresh_from_db()
+    expired_claim.refresh_from_db()
+
+    assert manager.counts['renewed'] == 1
+    assert claimed.date_billing_last == datetime(2018, 1, 1, 1, 1, 1)
+    assert claimed.date_claim_expires == datetime(2018, 2, 2, 1)
+    assert expired_claim.date_billing_last == datetime(2018, 2, 2)
+    assert expired_claim.date_claim_expires is None
+
+
+def create_expired_user_subscription(user, subscription_plan, active=True):
+    """Creates a UserSubscription that has reached its billing end date."""
+    return models.UserSubscription.objects.create(
+        user=user,
+        plan_cost=create_cost(subscription_plan),
+        subscription_plan=subscription_plan,
+        date_billing_start=datetime(2018, 1, 1, 1, 1, 1),
+        date_billing_end=datetime(2018, 12, 31, 1, 1, 1),
+        date_billing_last=datetime(2018, 12, 1, 1, 1, 1),
+        date_billing_next=None,
+        active=active,
+        cancelled=False,
+    )
+
+
+def test_manager_process_expired_ignores_inactive_subscriptions(django_user_model):
+    """Tests that inactive subscriptions do not keep a user in a group."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    group = Group.objects.create(name='test')
+    group.user_set.add(user)
+    subscription_plan = create_subscription_plan(group)
+    user_subscription = create_expired_user_subscription(user, subscription_plan)
+    create_expired_user_subscription(user, subscription_plan, active=False)
+
+    manager = _manager.Manager()
+    manager.process_expired(user_subscription)
+
+    assert group.user_set.filter(id=user.id).exists() is False
+
+
+def test_manager_process_expired_many_group_memberships(django_user_model):
+    """Tests that large chunks of memberships are revoked."""
+    groups = [Group.objects.create(name=str(i)) for i in range(40)]
+    users = [
+        django_user_model.objects.create(username=str(i)) for i in range(30)
+    ]
+    django_user_model.groups.through.objects.bulk_create(
+        django_user_model.groups.through(user=user, group=group)
+        for user in users for group in groups
+    )
+    subscriptions = []
+
+    for group in groups:
+        cost = create_cost(create_subscription_plan(group))
+        subscriptions.extend(
+            models.UserSubscription(
+                user=user, plan_cost=cost, subscription_plan=cost.plans.get(),
+                active=True, cancelled=False,
+            )
+            for user in users
+        )
+
+    models.UserSubscription.objects.bulk_create(subscriptions)
+    subscriptions = list(models.UserSubscription.objects.all())
+
+    _manager._revoke_group_memberships(subscriptions)  # pylint: disable=protected-access
+
+    assert django_user_model.groups.through.objects.exists() is False
+
+
+def test_manager_process_expired_without_group(django_user_model):
+    """Tests handling expiry of a subscription to a plan without a group."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_expired_user_subscription(
+        user, create_subscription_plan()
+    )
+
+    manager = _manager.Manager()
+    manager.process_expired(user_subscription)
+
+    user_subscription = models.UserSubscription.objects.get(
+        id=user_subscription.id
+    )
+
+    assert user_subscription.active is False
+    assert user_subscription.cancelled is True
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2019, 1, 1)
+)
+def test_manager_process_subscriptions_batch_with_expired(django_user_model):
+    """Tests batch expiry handling of shared and separate groups."""
+    group_shared = Group.objects.create(name='shared')
+    group_single = Group.objects.create(name='single')
+    plan_shared = create_subscription_plan(group_shared)
+    plan_single = create_subscription_plan(group_single)
+
+    user_1 = django_user_model.objects.create_user(username='a', password='b')
+    user_2 = django_user_model.objects.create_user(username='c', password='d')
+    group_shared.user_set.add(user_1, user_2)
+    group_single.user_set.add(user_1)
+
+    create_expired_user_subscription(user_1, plan_shared)
+    create_expired_user_subscription(user_1, plan_single)
+    create_expired_user_subscription(user_2, plan_shared)
+
+    # user_2 has another active subscription for the shared group
+    models.UserSubscription.objects.create(
+        user=user_2,
+        plan_cost=create_cost(plan_shared),
+        subscription_plan=plan_shared,
+        date_billing_start=datetime(2018, 1, 1, 1, 1, 1),
+        date_billing_next=datetime(2019, 2, 1),
+        active=True,
+        cancelled=False,
+    )
+
+    manager = _manager.Manager()
+    manager.batch_size = 10
+    manager.process_subscriptions()
+
+    assert manager.counts['expired'] == 3
+    assert list(group_shared.user_set.all()) == [user_2]
+    assert group_single.user_set.exists() is False
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2019, 1, 1)
+)
+def test_manager_process_subscriptions_batch_expired_query_count(django_user_model):
+    """Tests that batch expiry queries do not grow with the chunk size."""
+    group = Group.objects.create(name='test')
+
+    def expire_chunk(count):
+        """Expires a chunk of subscriptions and returns the query count."""
+        for index in range(count):
+            user = django_user_model.objects.create_user(
+                username='{}-{}'.format(count, index), password='b'
+            )
+            group.user_set.add(user)
+            create_expired_user_subscription(
+                user, create_subscription_plan(group)
+            )
+
+        manager = _manager.Manager()
+        manager.batch_size = 50
+
+        with CaptureQueriesContext(connection) as context:
+            manager.process_subscriptions()
+
+        return len(context.captured_queries)
+
+    assert expire_chunk(2) == expire_chunk(10)
+
+
+def capture_process_queries(manager):
+    """Runs process_subscriptions and returns the executed SQL.
+
+        Queries for the BillingAttempt ledger (written for each
+        payment), the BillingRun checkpoints and savepoint statements
+        are excluded.
+    """
+    with CaptureQueriesContext(connection) as context:
+        manager.process_subscriptions()
+
+    return [
+        query['sql'] for query in context.captured_queries
+        if 'subscriptions_billingattempt' not in query['sql']
+        and 'subscriptions_billingrun' not in query['sql']
+        and 'SAVEPOINT' not in query['sql']
+    ]
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_loads_related(django_user_model):
+    """Tests that subscriptions are processed without lazy lookups."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    group = Group.objects.create(name='test')
+
+    for _ in range(5):
+        create_due_user_subscription(user, group=group)
+
+    queries = capture_process_queries(_manager.Manager())
+    selects = [query for query in queries if query.startswith('SELECT')]
+
+    # One query for each of the expired, new and due scans
+    assert len(selects) == 3
+    assert len(queries) == 3 + 5 * 2
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_batch_queries_per_chunk(django_user_model):
+    """Tests that each chunk costs a fixed number of queries."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    group = Group.objects.create(name='test')
+
+    for _ in range(5):
+        create_due_user_subscription(user, group=group)
+
+    manager = _manager.Manager()
+    manager.batch_size = 5
+    one_chunk = capture_process_queries(manager)
+
+    # Reset the processed subscriptions and add a second chunk
+    models.UserSubscription.objects.update(
+        date_billing_last=datetime(2018, 1, 1, 1, 1, 1),
+        date_billing_next=datetime(2018, 2, 1, 1, 1, 1),
+    )
+    models.BillingAttempt.objects.all().delete()
+
+    for _ in range(5):
+        create_due_user_subscription(user, group=group)
+
+    two_chunks = capture_process_queries(manager)
+
+    # Chunk select, bulk update and bulk insert
+    assert len(two_chunks) - len(one_chunk) == 3
+
+
+def measure_scan_peak_memory(count):
+    """Returns the peak memory used to stream ``count`` due subscriptions."""
+    plan_cost = create_cost(create_subscription_plan())
+    models.UserSubscription.objects.all().delete()
+    models.UserSubscription.objects.bulk_create([
+        models.UserSubscription(
+            plan_cost=plan_cost,
+            date_billing_start=datetime(2018, 1, 1),
+            date_billing_next=datetime(2018, 2, 1),
+            active=True,
+            cancelled=False,
+        )
+        for _ in range(count)
+    ])
+
+    processed = []
+    manager = _manager.Manager()
+    manager.process_due = lambda subscription: processed.append(1)
+
+    tracemalloc.start()
+
+    try:
+        manager.process_subscriptions()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(processed) == count
+
+    return peak
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+@patch('subscriptions.management.commands._manager.DEFAULT_BATCH_SIZE', 20)
+def test_manager_process_subscriptions_streaming_memory():
+    """Tests that peak memory does not grow with the number of due rows."""
+    small_peak = measure_scan_peak_memory(100)
+    large_peak = measure_scan_peak_memory(1000)
+
+    # Ten times the rows must not need anywhere near ten times the memory
+    assert large_peak < small_peak * 2
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+@patch('subscriptions.management.commands._manager.DEFAULT_BATCH_SIZE', 2)
+def test_manager_process_subscriptions_streams_chunks(django_user_model):
+    """Tests that unbatched processing fetches one chunk per query."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+
+    for _ in range(5):
+        create_due_user_subscription(user)
+
+    manager = _manager.Manager()
+    queries = capture_process_queries(manager)
+    selects = [query for query in queries if query.startswith('SELECT')]
+
+    # Expired and new scans and three chunks of due subscriptions
+    assert len(selects) == 5
+    assert manager.counts['renewed'] == 5
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_due_records_billing_attempt(django_user_model):
+    """Tests that a successful payment completes a billing attempt."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_due_user_subscription(user)
+    payments = []
+
+    manager = _manager.Manager()
+    manager.process_payment = lambda **kwargs: payments.append(kwargs) or True
+    manager.process_due(user_subscription)
+
+    attempt = models.BillingAttempt.objects.get(subscription=user_subscription)
+
+    assert attempt.date_period_start == datetime(2018, 2, 1, 1, 1, 1)
+    assert attempt.status == models.ATTEMPT_SUCCEEDED
+    assert attempt.date_transaction == datetime(2018, 2, 2)
+    assert payments[0]['attempt'] == attempt
+
+
+@patch(
+    'subscriptions.management.commands._manager.Manager.process_payment',
+    lambda self, **kwargs: False
+)
+def test_manager_process_due_payment_error_fails_attempt(django_user_model):
+    """Tests that a failed payment leaves the period open for a retry."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_due_user_subscription(user)
+
+    manager = _manager.Manager()
+    manager.process_due(user_subscription)
+
+    attempt = models.BillingAttempt.objects.get()
+    assert attempt.status == models.ATTEMPT_FAILED
+    assert attempt.number == 1
+    assert manager.counts['payment_errors'] == 1
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_due_retry_uses_new_attempt_id(django_user_model):
+    """Tests that a retry of a declined period gets a new attempt ID."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_due_user_subscription(user)
+    period_start = user_subscription.date_billing_next
+    attempt_ids = []
+
+    def process_payment(**kwargs):
+        attempt_ids.append(kwargs['attempt'].id)
+        return len(attempt_ids) > 1
+
+    manager = _manager.Manager()
+    manager.process_payment = process_payment
+    manager.process_due(user_subscription)
+    user_subscription.refresh_from_db()
+    manager.process_due(user_subscription)
+
+    attempts = models.BillingAttempt.objects.order_by('number')
+    assert [attempt.status for attempt in attempts] == [
+        models.ATTEMPT_FAILED, models.ATTEMPT_SUCCEEDED
+    ]
+    assert attempt_ids == [
+        models.billing_attempt_id(user_subscription.id, period_start, 1),
+        models.billing_attempt_id(user_subscription.id, period_start, 2),
+    ]
+    assert attempt_ids[0] != attempt_ids[1]
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_due_resumes_paid_attempt(django_user_model):
+    """Tests that an already paid period is not charged again."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_due_user_subscription(user)
+    models.BillingAttempt.objects.create(
+        subscription=user_subscription,
+        date_period_start=user_subscription.date_billing_next,
+        status=models.ATTEMPT_SUCCEEDED,
+        date_transaction=datetime(2018, 2, 1, 12, 0, 0),
+    )
+
+    manager = _manager.Manager()
+
+    with patch.object(manager, 'process_payment') as process_payment:
+        manager.process_due(user_subscription)
+
+    user_subscription = models.UserSubscription.objects.get(
+        id=user_subscription.id
+    )
+    transaction = models.SubscriptionTransaction.objects.get(user=user)
+
+    assert process_payment.called is False
+    assert user_subscription.date_billing_last == datetime(2018, 2, 2)
+    assert transaction.date_transaction == datetime(2018, 2, 1, 12, 0, 0)
+    assert manager.counts['renewed'] == 1
+
+
+def test_manager_process_due_skips_unresolved_attempt(django_user_model):
+    """Tests that a pending attempt is not charged by default."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_due_user_subscription(user)
+    models.BillingAttempt.objects.create(
+        subscription=user_subscription,
+        date_period_start=user_subscription.date_billing_next,
+    )
+
+    manager = _manager.Manager()
+
+    with patch.object(manager, 'process_payment') as process_payment:
+        manager.process_due(user_subscription)
+
+    user_subscription = models.UserSubscription.objects.get(
+        id=user_subscription.id
+    )
+
+    assert process_payment.called is False
+    assert user_subscription.date_billing_next == datetime(2018, 2, 1, 1, 1, 1)
+    assert manager.counts['payments_unresolved'] == 1
+
+
+def test_manager_process_due_reconciles_paid_attempt(django_user_model):
+    """Tests that a pending attempt confirmed as paid is completed."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_due_user_subscription(user)
+    attempt = models.BillingAttempt.objects.create(
+        subscription=user_subscription,
+        date_period_start=user_subscription.date_billing_next,
+    )
+
+    manager = _manager.Manager()
+    manager.reconcile_payment = lambda subscription, attempt: True
+
+    with patch.object(manager, 'process_payment') as process_payment:
+        manager.process_due(user_subscription)
+
+    attempt.refresh_from_db()
+
+    assert process_payment.called is False
+    assert attempt.status == models.ATTEMPT_SUCCEEDED
+    assert manager.counts['renewed'] == 1
+
+
+def test_manager_process_due_reconciles_unpaid_attempt(django_user_model):
+    """Tests that a pending attempt confirmed as unpaid is charged."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_due_user_subscription(user)
+    attempt = models.BillingAttempt.objects.create(
+        subscription=user_subscription,
+        date_period_start=user_subscription.date_billing_next,
+    )
+
+    manager = _manager.Manager()
+    manager.reconcile_payment = lambda subscription, attempt: False
+
+    with patch.object(manager, 'process_payment') as process_payment:
+        manager.process_due(user_subscription)
+
+    attempt.refresh_from_db()
+    retry = process_payment.call_args[1]['attempt']
+    assert attempt.status == models.ATTEMPT_FAILED
+    assert retry.number == 2
+    assert retry.id != attempt.id
+    assert manager.counts['renewed'] == 1
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_records_run(django_user_model):
+    """Tests that a completed run is recorded as a BillingRun."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    create_due_user_subscription(user)
+
+    manager = _manager.Manager()
+    manager.process_subscriptions()
+
+    run = models.BillingRun.objects.get()
+
+    assert manager.run == run
+    assert run.phase == models.RUN_COMPLETE
+    assert run.date_reference == datetime(2018, 2, 2)
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+@patch('subscriptions.management.commands._manager.DEFAULT_BATCH_SIZE', 2)
+def test_manager_process_subscriptions_checkpoints_chunks(django_user_model):
+    """Tests that the last processed subscription is saved per chunk."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    subscription_ids = sorted(
+        create_due_user_subscription(user).id for _ in range(3)
+    )
+    checkpoints = []
+
+    manager = _manager.Manager()
+    save_checkpoint = manager._save_checkpoint  # pylint: disable=protected-access
+
+    def capture_checkpoint(ordering, cursor):
+        checkpoints.append(cursor)
+        save_checkpoint(ordering, cursor)
+
+    manager._save_checkpoint = capture_checkpoint  # pylint: disable=protected-access
+    manager.process_subscriptions()
+
+    # All due at the same time, so processed in primary key order
+    assert checkpoints == [
+        (datetime(2018, 2, 1, 1, 1, 1), subscription_ids[1]),
+        (datetime(2018, 2, 1, 1, 1, 1), subscription_ids[2]),
+    ]
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_resume(django_user_model):
+    """Tests that a resumed run continues after its checkpoint."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    subscription_ids = sorted(
+        create_due_user_subscription(user).id for _ in range(3)
+    )
+    run = models.BillingRun.objects.create(
+        date_reference=datetime(2018, 2, 2),
+        phase=models.RUN_DUE,
+        last_subscription_id=subscription_ids[0],
+        last_date_billing_next=datetime(2018, 2, 1, 1, 1, 1),
+    )
+    processed = []
+
+    manager = _manager.Manager()
+    manager.resume = True
+    manager.process_expired = processed.append
+    manager.process_due = lambda subscription: processed.append(subscription.id)
+    manager.process_subscriptions()
+
+    run.refresh_from_db()
+
+    assert manager.run == run
+    assert processed == subscription_ids[1:]
+    assert run.phase == models.RUN_COMPLETE
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_resume_completed_run(django_user_model):
+    """Tests that resuming after a completed run starts a new run."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    create_due_user_subscription(user)
+    models.BillingRun.objects.create(
+        date_reference=datetime(2018, 1, 1), phase=models.RUN_COMPLETE,
+    )
+
+    manager = _manager.Manager()
+    manager.resume = True
+    manager.process_subscriptions()
+
+    assert models.BillingRun.objects.count() == 2
+    assert manager.run.date_reference == datetime(2018, 2, 2)
+    assert manager.counts['renewed'] == 1
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_due_most_overdue_first(django_user_model):
+    """Tests that due subscriptions are processed most overdue first."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    subscriptions = [create_due_user_subscription(user) for _ in range(3)]
+
+    for day, subscription in zip([20, 5, 12], subscriptions):
+        subscription.date_billing_next = datetime(2018, 1, day)
+        subscription.save()
+
+    processed = []
+
+    manager = _manager.Manager()
+    manager.batch_size = 2
+    manager.process_due = lambda subscription: processed.append(
+        subscription.date_billing_next.day
+    )
+    manager.process_subscriptions()
+
+    assert processed == [5, 12, 20]
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_due_once_per_run(django_user_model):
+    """Tests that a subscription overdue for several periods is billed once."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_due_user_subscription(user)
+    user_subscription.date_billing_next = datetime(2017, 10, 1)
+    user_subscription.save()
+
+    manager = _manager.Manager()
+    manager.batch_size = 1
+    manager.process_subscriptions()
+
+    assert manager.counts['renewed'] == 1
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_time_limit(django_user_model):
+    """Tests that a run stops once its time limit is reached."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    subscriptions = [create_due_user_subscription(user) for _ in range(3)]
+
+    for day, subscription in enumerate(subscriptions, 1):
+        subscription.date_billing_next = datetime(2018, 1, day)
+        subscription.save()
+
+    manager = _manager.Manager()
+    manager.batch_size = 2
+    manager.time_limit = 10
+
+    # Start of the run, then one check per subscription
+    with patch.object(
+        _manager.time, 'monotonic', side_effect=[0, 1, 2, 11, 12]
+    ):
+        manager.process_subscriptions()
+
+    renewed = models.UserSubscription.objects.filter(
+        date_billing_last=datetime(2018, 2, 2)
+    )
+
+    assert manager.stopped is True
+    assert manager.counts['renewed'] == 2
+    assert set(renewed.values_list('id', flat=True)) == {
+        subscriptions[0].id, subscriptions[1].id,
+    }
+    assert manager.run.phase == models.RUN_DUE
+    assert manager.run.last_subscription_id == subscriptions[1].id
+
+
+def test_manager_throttle():
+    """Tests that payment calls are spaced out to the maximum rate."""
+    manager = _manager.Manager()
+    manager.max_rate = 4
+
+    with patch.object(_manager.time, 'monotonic', side_effect=[0, 0.1, 0.6]):
+        with patch.object(_manager.time, 'sleep') as sleep:
+            for _ in range(3):
+                manager._throttle()  # pylint: disable=protected-access
+
+    # The second call waits, the third is already past its slot
+    sleep.assert_called_once_with(0.15)
+
+
+def test_manager_throttle_without_max_rate():
+    """Tests that payment calls are not delayed without a maximum rate."""
+    manager = _manager.Manager()
+
+    with patch.object(_manager.time, 'sleep') as sleep:
+        manager._throttle()  # pylint: disable=protected-access
+        manager._throttle()  # pylint: disable=protected-access
+
+    sleep.assert_not_called()
+
+
+def test_manager_process_subscriptions_parallel_splits_rate():
+    """Tests that the maximum rate is shared between the workers."""
+    rates = []
+
+    def process_subscriptions(self, shard=None):  # pylint: disable=unused-argument
+        rates.append(self.max_rate)
+
+    manager = _manager.Manager()
+    manager.max_rate = 6
+
+    with patch.object(
+        _manager.Manager, 'process_subscriptions', process_subscriptions
+    ):
+        manager.process_subscriptions_parallel(3)
+
+    assert rates == [2, 2, 2]
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_async_manager_bounds_concurrency(django_user_model):
+    """Tests that AsyncManager makes concurrent payments up to its limit."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+
+    for _ in range(5):
+        create_due_user_subscription(user)
+
+    in_flight = []
+    peak = []
+
+    async def process_payment(**kwargs):  # pylint: disable=unused-argument
+        in_flight.append(1)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.pop()
+        return True
+
+    manager = _manager.AsyncManager()
+    manager.concurrency = 2
+    manager.process_payment = process_payment
+    manager.process_subscriptions()
+
+    assert max(peak) == 2
+    assert manager.counts['renewed'] == 5
+    assert models.BillingAttempt.objects.filter(
+        status=models.ATTEMPT_SUCCEEDED
+    ).count() == 5
+    assert models.UserSubscription.objects.filter(
+        date_billing_last=datetime(2018, 2, 2)
+    ).count() == 5
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_async_manager_closes_event_loop(django_user_model):
+    """Tests that AsyncManager runs its own event loop without asyncio.run."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    create_due_user_subscription(user)
+    loops = []
+    new_event_loop = asyncio.new_event_loop
+
+    def capture_new_event_loop():
+        loops.append(new_event_loop())
+        return loops[-1]
+
+    async def process_payment(**kwargs):  # pylint: disable=unused-argument
+        return True
+
+    manager = _manager.AsyncManager()
+    manager.process_payment = process_payment
+
+    with patch('asyncio.run', side_effect=AssertionError('Needs Python 3.7')):
+        with patch('asyncio.new_event_loop', capture_new_event_loop):
+            manager.process_subscriptions()
+
+    assert manager.counts['renewed'] == 1
+    assert loops
+    assert all(loop.is_closed() for loop in loops)
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_async_manager_payment_errors(django_user_model):
+    """Tests that AsyncManager skips subscriptions with declined payments."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    subscription_ids = [
+        create_due_user_subscription(user).id for _ in range(2)
+    ]
+    declined = subscription_ids[0]
+
+    async def process_payment(**kwargs):
+        return kwargs['attempt'].subscription_id != declined
+
+    manager = _manager.AsyncManager()
+    manager.process_payment = process_payment
+    manager.process_subscriptions()
+
+    assert manager.counts['renewed'] == 1
+    assert manager.counts['payment_errors'] == 1
+    assert list(
+        models.BillingAttempt.objects.filter(
+            status=models.ATTEMPT_SUCCEEDED,
+        ).values_list('subscription_id', flat=True)
+    ) == [subscription_ids[1]]
+    assert models.BillingAttempt.objects.get(
+        subscription_id=declined
+    ).status == models.ATTEMPT_FAILED
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_async_manager_payment_exception(django_user_model):
+    """Tests that a failing payment keeps the payments that succeeded."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    subscription_ids = sorted(
+        create_due_user_subscription(user).id for _ in range(2)
+    )
+
+    async def process_payment(**kwargs):
+        if kwargs['attempt'].subscription_id == subscription_ids[1]:
+            raise ValueError('Gateway error')
+
+        return True
+
+    manager = _manager.AsyncManager()
+    manager.process_payment = process_payment
+
+    with pytest.raises(ValueError):
+        manager.process_subscriptions()
+
+    first = models.UserSubscription.objects.get(id=subscription_ids[0])
+    second_attempt = models.BillingAttempt.objects.get(
+        subscription_id=subscription_ids[1]
+    )
+
+    assert first.date_billing_last == datetime(2018, 2, 2)
+    assert second_attempt.status == models.ATTEMPT_PENDING
+
+
+@patch(
+    'subscriptions.management.commands._manager.Manager.process_payment',
+    lambda self, **kwargs: False
+)
+@patch(
+    'subscriptions.management.commands._manager.Manager.retrieve_payment_error',
+    lambda self, payment: 'Card declined'
+)
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_due_payment_error_schedules_retry(django_user_model):
+    """Tests that a declined payment is recorded and retried later."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_due_user_subscription(user)
+
+    manager = _manager.Manager()
+
+    with patch.object(manager, 'notify_payment_error') as notify:
+        manager.process_due(user_subscription)
+
+    user_subscription.refresh_from_db()
+
+    assert user_subscription.payment_failures == 1
+    assert user_subscription.payment_error == 'Card declined'
+    assert user_subscription.date_payment_retry == datetime(2018, 2, 3)
+    notify.assert_called_once_with(user_subscription)
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+@pytest.mark.parametrize('failures, retry', [
+    (1, datetime(2018, 2, 4)),
+    (2, datetime(2018, 2, 6)),
+    (20, datetime(2018, 2, 9)),
+])
+def test_manager_process_payment_error_backoff(failures, retry, django_user_model):
+    """Tests that the retry delay doubles up to the maximum delay."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_due_user_subscription(user)
+    user_subscription.payment_failures = failures
+
+    manager = _manager.Manager()
+    manager.process_payment_error(user_subscription)
+
+    assert user_subscription.payment_failures == failures + 1
+    assert user_subscription.date_payment_retry == retry
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_payment_error_dunning(django_user_model):
+    """Tests that a subscription is expired after too many failures."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_due_user_subscription(user)
+    user_subscription.payment_failures = 2
+
+    manager = _manager.Manager()
+    manager.max_payment_failures = 3
+
+    with patch.object(manager, 'notify_expired') as notify_expired:
+        manager.process_payment_error(user_subscription)
+
+    user_subscription.refresh_from_db()
+
+    assert user_subscription.payment_failures == 3
+    assert user_subscription.date_billing_end == datetime(2018, 2, 2)
+    assert user_subscription.active is False
+    assert user_subscription.cancelled is True
+    assert manager.counts['expired'] == 1
+    notify_expired.assert_called_once_with(user_subscription)
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_waits_for_retry(django_user_model):
+    """Tests that subscriptions are not billed before their retry date."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    waiting = create_due_user_subscription(user)
+    waiting.payment_failures = 1
+    waiting.date_payment_retry = datetime(2018, 2, 3)
+    waiting.save()
+    retried = create_due_user_subscription(user)
+    retried.payment_failures = 1
+    retried.payment_error = 'Card declined'
+    retried.date_payment_retry = datetime(2018, 2, 1)
+    retried.save()
+
+    manager = _manager.Manager()
+    manager.process_subscriptions()
+
+    waiting.refresh_from_db()
+    retried.refresh_from_db()
+
+    assert manager.counts['renewed'] == 1
+    assert waiting.date_billing_last == datetime(2018, 1, 1, 1, 1, 1)
+    assert retried.date_billing_last == datetime(2018, 2, 2)
+    assert retried.payment_failures == 0
+    assert retried.payment_error == ''
+    assert retried.date_payment_retry is None
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_async_manager_payment_error_schedules_retry(django_user_model):
+    """Tests that AsyncManager records declined payments for retry."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_due_user_subscription(user)
+
+    async def process_payment(**kwargs):  # pylint: disable=unused-argument
+        return False
+
+    manager = _manager.AsyncManager()
+    manager.process_payment = process_payment
+    manager.process_subscriptions()
+
+    user_subscription.refresh_from_db()
+
+    assert user_subscription.payment_failures == 1
+    assert user_subscription.date_payment_retry == datetime(2018, 2, 3)
+
+
+def create_free_due_user_subscription(user, unit=models.MONTH, period=1, cost='0.00'):
+    """Creates a due UserSubscription to a free plan."""
+    subscription_plan = create_subscription_plan()
+    plan_cost = test_forms.create_cost(
+        plan=subscription_plan, period=period, unit=unit, cost=cost,
+    )
+
+    return models.UserSubscription.objects.create(
+        user=user,
+        plan_cost=plan_cost,
+        subscription_plan=subscription_plan,
+        date_billing_start=datetime(2018, 1, 1, 1, 1, 1),
+        date_billing_last=datetime(2018, 1, 1, 1, 1, 1),
+        date_billing_next=datetime(2018, 1, 31, 1, 1, 1),
+        active=True,
+        cancelled=False,
+    )
+
+
+def test_manager_process_free_due_keeps_billing_day(django_user_model):
+    """Tests that bulk free renewals keep the billing day after short months."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    subscription = create_free_due_user_subscription(user)
+    models.UserSubscription.objects.filter(id=subscription.id).update(
+        date_billing_start=datetime(2018, 1, 31, 1, 1, 1),
+    )
+    queryset = models.UserSubscription.objects.filter(id=subscription.id)
+    billing_dates = []
+
+    manager = _manager.Manager()
+
+    for _ in range(3):
+        manager.process_free_due(queryset)
+        billing_dates.append(queryset.get().date_billing_next)
+
+    assert billing_dates == [
+        datetime(2018, 2, 28, 1, 1, 1),
+        datetime(2018, 3, 31, 1, 1, 1),
+        datetime(2018, 4, 30, 1, 1, 1),
+    ]
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_free_plans(django_user_model):
+    """Tests that free plans are renewed without processing payments."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    monthly = create_free_due_user_subscription(user)
+    weekly = create_free_due_user_subscription(user, unit=models.WEEK, cost=None)
+    once = create_free_due_user_subscription(user, unit=models.ONCE)
+    transaction_count = models.SubscriptionTransaction.objects.count()
+
+    manager = _manager.Manager()
+    manager.bulk_free_renewals = True
+
+    with patch.object(manager, 'process_payment') as process_payment:
+        with patch.object(manager, 'process_due') as process_due:
+            manager.process_subscriptions()
+
+    monthly.refresh_from_db()
+    weekly.refresh_from_db()
+    once.refresh_from_db()
+
+    process_payment.assert_not_called()
+    process_due.assert_not_called()
+    assert manager.counts['renewed'] == 3
+    assert monthly.date_billing_next == datetime(2018, 2, 28, 1, 1, 1)
+    assert monthly.date_billing_last == datetime(2018, 2, 2)
+    assert weekly.date_billing_next == datetime(2018, 2, 7, 1, 1, 1)
+    assert weekly.date_billing_last == datetime(2018, 2, 2)
+    assert once.date_billing_next is None
+    assert models.SubscriptionTransaction.objects.count() == (
+        transaction_count + 3
+    )
+    assert set(
+        models.SubscriptionTransaction.objects.values_list('amount', flat=True)
+    ) == {0, None}
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_free_plans_one_update(django_user_model):
+    """Tests that a fixed length recurrence is renewed with one UPDATE."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+
+    for _ in range(5):
+        create_free_due_user_subscription(user, unit=models.DAY, period=30)
+
+    manager = _manager.Manager()
+    manager.bulk_free_renewals = True
+    manager.record_free_transactions = False
+    queries = capture_process_queries(manager)
+    updates = [
+        query for query in queries
+        if query.startswith('UPDATE "subscriptions_usersubscription"')
+    ]
+
+    assert len(updates) == 1
+    assert not [query for query in queries if query.startswith('INSERT')]
+    assert models.UserSubscription.objects.filter(
+        date_billing_next=datetime(2018, 3, 2, 1, 1, 1)
+    ).count() == 5
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+@pytest.mark.parametrize('unit', [models.DAY, models.MONTH])
+def test_manager_process_subscriptions_free_plans_claim(django_user_model, unit):
+    """Tests that claimed free renewals only update the locked chunk rows."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    subscription_ids = sorted(
+        create_free_due_user_subscription(user, unit=unit).id for _ in range(5)
+    )
+    # Held by another runner, so SKIP LOCKED leaves it out of the chunks
+    locked_id = subscription_ids[2]
+    querysets = []
+    free_chunk = _manager.Manager._free_chunk
+
+    def claim_free_chunk(queryset, last_pk, batch_size):
+        querysets.append(queryset)
+        return free_chunk(queryset.exclude(pk=locked_id), last_pk, batch_size)
+
+    manager = _manager.Manager()
+    manager.claim = True
+    manager.batch_size = 2
+    manager._free_chunk = claim_free_chunk  # pylint: disable=protected-access
+    manager.process_free_due(models.UserSubscription.objects.all())
+
+    assert querysets
+    for queryset in querysets:
+        assert queryset.query.select_for_update_skip_locked is True
+        assert queryset.query.select_for_update_of == ('self',)
+
+    assert manager.counts['renewed'] == 4
+    assert list(models.UserSubscription.objects.filter(
+        date_billing_last=datetime(2018, 2, 2)
+    ).order_by('pk').values_list('pk', flat=True)) == [
+        pk for pk in subscription_ids if pk != locked_id
+    ]
+    assert models.SubscriptionTransaction.objects.filter(
+        date_transaction=datetime(2018, 2, 2)
+    ).count() == 4
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_subscriptions_free_plans_default(django_user_model):
+    """Tests that free plans are renewed by process_due by default."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    create_free_due_user_subscription(user)
+    processed = []
+
+    manager = _manager.Manager()
+    manager.process_due = processed.append
+    manager.process_subscriptions()
+
+    assert len(processed) == 1
+
+
+def create_overdue_user_subscription(user, unit=models.DAY, cost='1.00'):
+    """Creates a UserSubscription three periods overdue on 2018-02-02."""
+    subscription_plan = create_subscription_plan()
+    plan_cost = test_forms.create_cost(
+        plan=subscription_plan, period=1, unit=unit, cost=cost,
+    )
+
+    return models.UserSubscription.objects.create(
+        user=user,
+        plan_cost=plan_cost,
+        subscription_plan=subscription_plan,
+        date_billing_start=datetime(2018, 1, 1),
+        date_billing_last=datetime(2018, 1, 29),
+        date_billing_next=datetime(2018, 1, 30, 12),
+        active=True,
+        cancelled=False,
+    )
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_due_catch_up_each(django_user_model):
+    """Tests that each missed period is charged and recorded."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_overdue_user_subscription(user)
+    payments = []
+
+    def process_payment(**kwargs):
+        payments.append(kwargs['attempt'].date_period_start)
+        return True
+
+    manager = _manager.Manager()
+    manager.catch_up = True
+    manager.process_payment = process_payment
+    manager.process_due(user_subscription)
+
+    user_subscription.refresh_from_db()
+
+    assert payments == [
+        datetime(2018, 1, 30, 12),
+        datetime(2018, 1, 31, 12),
+        datetime(2018, 2, 1, 12),
+    ]
+    assert user_subscription.date_billing_next == datetime(2018, 2, 2, 12)
+    assert models.SubscriptionTransaction.objects.filter(
+        user=user, amount=1
+    ).count() == 3
+    assert manager.counts['renewed'] == 1
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_due_catch_up_each_stops_at_failure(django_user_model):
+    """Tests that charging stops at the first declined period."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_overdue_user_subscription(user)
+    payments = iter([True, False])
+
+    manager = _manager.Manager()
+    manager.catch_up = True
+    manager.process_payment = lambda **kwargs: next(payments)
+    manager.process_due(user_subscription)
+
+    user_subscription.refresh_from_db()
+
+    assert user_subscription.date_billing_next == datetime(2018, 1, 31, 12)
+    assert user_subscription.date_billing_last == datetime(2018, 2, 2)
+    assert user_subscription.payment_failures == 1
+    assert models.SubscriptionTransaction.objects.filter(user=user).count() == 1
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_due_catch_up_aggregate(django_user_model):
+    """Tests that missed periods can be charged with one payment."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_overdue_user_subscription(user)
+    policies = []
+
+    def catch_up_policy(subscription, periods):
+        policies.append((subscription, periods))
+        return _manager.CATCH_UP_AGGREGATE
+
+    manager = _manager.Manager()
+    manager.catch_up = True
+    manager.catch_up_policy = catch_up_policy
+
+    with patch.object(manager, 'process_payment') as process_payment:
+        manager.process_due(user_subscription)
+
+    user_subscription.refresh_from_db()
+
+    assert policies == [(user_subscription, 3)]
+    assert process_payment.call_count == 1
+    assert process_payment.call_args[1]['periods'] == 3
+    assert user_subscription.date_billing_next == datetime(2018, 2, 2, 12)
+    assert list(models.SubscriptionTransaction.objects.filter(
+        user=user
+    ).values_list('amount', flat=True)) == [3]
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_due_record_transaction_periods(django_user_model):
+    """Tests that periods is only passed to record_transaction in aggregate."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    each = create_overdue_user_subscription(user)
+    aggregate = create_overdue_user_subscription(user)
+    calls = []
+
+    class LegacyManager(_manager.Manager):
+        """Manager with a record_transaction override without periods."""
+        def record_transaction(self, subscription, transaction_date=None, **kwargs):  # pylint: disable=arguments-differ
+            calls.append((subscription, kwargs))
+
+    manager = LegacyManager()
+    manager.catch_up = True
+    manager.process_due(each)
+    manager.catch_up_policy = lambda subscription, periods: (
+        _manager.CATCH_UP_AGGREGATE
+    )
+    manager.process_due(aggregate)
+
+    assert calls == [
+        (each, {}), (each, {}), (each, {}), (aggregate, {'periods': 3}),
+    ]
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 5, 2)
+)
+def test_manager_process_due_catch_up_months(django_user_model):
+    """Tests that monthly catch-up keeps the billing day of the month."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_overdue_user_subscription(user, unit=models.MONTH)
+    user_subscription.date_billing_next = datetime(2018, 1, 31)
+
+    manager = _manager.Manager()
+    manager.catch_up = True
+
+    with patch.object(manager, 'process_payment') as process_payment:
+        manager.process_due(user_subscription)
+
+    assert [
+        call[1]['attempt'].date_period_start
+        for call in process_payment.call_args_list
+    ] == [
+        datetime(2018, 1, 31),
+        datetime(2018, 2, 28),
+        datetime(2018, 3, 31),
+        datetime(2018, 4, 30),
+    ]
+    assert user_subscription.date_billing_next == datetime(2018, 5, 31)
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_async_manager_catch_up_aggregate(django_user_model):
+    """Tests that AsyncManager charges aggregated periods at once."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_overdue_user_subscription(user)
+    payments = []
+
+    async def process_payment(**kwargs):
+        payments.append(kwargs.get('periods'))
+        return True
+
+    manager = _manager.AsyncManager()
+    manager.catch_up = True
+    manager.catch_up_policy = lambda subscription, periods: (
+        _manager.CATCH_UP_AGGREGATE
+    )
+    manager.process_payment = process_payment
+    manager.process_subscriptions()
+
+    user_subscription.refresh_from_db()
+
+    assert payments == [3]
+    assert user_subscription.date_billing_next == datetime(2018, 2, 2, 12)
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_process_free_due_catch_up(django_user_model):
+    """Tests that free plans jump to their first future billing date."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    user_subscription = create_overdue_user_subscription(user, cost='0.00')
+
+    manager = _manager.Manager()
+    manager.catch_up = True
+    manager.process_subscriptions()
+
+    user_subscription.refresh_from_db()
+
+    assert user_subscription.date_billing_next == datetime(2018, 2, 2, 12)
+
+
+def test_manager_forecast(django_user_model):
+    """Tests forecasting a run with aggregate queries."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    create_due_user_subscription(user)
+    create_due_user_subscription(user)
+    create_free_due_user_subscription(user)
+    expiring = create_due_user_subscription(user)
+    expiring.date_billing_end = datetime(2018, 2, 1)
+    expiring.save()
+    new = create_due_user_subscription(user)
+    new.active = False
+    new.date_billing_next = None
+    new.save()
+
+    manager = _manager.Manager()
+
+    with CaptureQueriesContext(connection) as context:
+        forecast = manager.forecast(datetime(2018, 2, 2))
+
+    assert forecast == {
+        'until': datetime(2018, 2, 2),
+        'expired': 1,
+        'new': 1,
+        'renewed': 3,
+        'payments': 4,
+        'revenue': Decimal('3.00'),
+    }
+    assert len(context.captured_queries) == 3
+    assert models.SubscriptionTransaction.objects.count() == 0
+    assert models.BillingRun.objects.count() == 0
+
+
+def test_manager_forecast_catch_up(django_user_model):
+    """Tests that catch-up forecasts count every missed period."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    create_overdue_user_subscription(user)
+    create_overdue_user_subscription(user)
+
+    manager = _manager.Manager()
+    manager.catch_up = True
+    forecast = manager.forecast(datetime(2018, 2, 2))
+
+    assert forecast['renewed'] == 2
+    assert forecast['payments'] == 6
+    assert forecast['revenue'] == Decimal('6.00')
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+@pytest.mark.parametrize('bulk_free_renewals', [True, False])
+def test_manager_forecast_payments_match_run(django_user_model, bulk_free_renewals):
+    """Tests that the forecast counts the payments the run makes."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    create_due_user_subscription(user)
+    create_free_due_user_subscription(user)
+    new_free = create_free_due_user_subscription(user)
+    new_free.active = False
+    new_free.save()
+
+    manager = _manager.Manager()
+    manager.bulk_free_renewals = bulk_free_renewals
+    forecast = manager.forecast()
+
+    with patch.object(manager, 'process_payment') as process_payment:
+        manager.process_subscriptions()
+
+    assert forecast['payments'] == process_payment.call_count
+    assert forecast['payments'] == (2 if bulk_free_renewals else 3)
+    assert forecast['revenue'] == Decimal('1.00')
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 2)
+)
+def test_manager_forecast_catch_up_groups_overdue_only(django_user_model):
+    """Tests that only overdue subscriptions are grouped by billing date."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+
+    for hour in range(3):
+        subscription = create_due_user_subscription(user)
+        subscription.date_billing_next = datetime(2018, 2, 1, hour)
+        subscription.save()
+
+    overdue = create_due_user_subscription(user)
+    overdue.date_billing_start = datetime(2017, 12, 31)
+    overdue.date_billing_next = datetime(2017, 12, 31)
+    overdue.save()
+    missed_periods = []
+
+    manager = _manager.Manager()
+    manager.catch_up = True
+    _missed_periods = manager._missed_periods  # pylint: disable=protected-access
+
+    def capture_missed_periods(start, *args):
+        missed_periods.append(start)
+        return _missed_periods(start, *args)
+
+    with patch.object(manager, '_missed_periods', capture_missed_periods):
+        forecast = manager.forecast()
+
+    assert missed_periods == [datetime(2017, 12, 31)]
+
+    with patch.object(manager, 'process_payment') as process_payment:
+        manager.process_subscriptions()
+
+    assert forecast['renewed'] == 4
+    assert forecast['payments'] == process_payment.call_count == 5
+    assert forecast['revenue'] == Decimal('5.00')
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 1, 2, 2, 2)
+)
+def test_manager_process_subscriptions_metrics(django_user_model):
+    """Tests that the phases and hooks of a run are timed."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    create_due_user_subscription(user)
+    create_due_user_subscription(user)
+
+    manager = _manager.Manager()
+    manager.process_subscriptions()
+
+    histograms = manager.metrics.histograms
+
+    assert manager.metrics.counters['subscriptions'] == 2
+    assert histograms['run'].count == 1
+    assert histograms['phase_expired'].count == 1
+    assert histograms['phase_new'].count == 1
+    assert histograms['phase_due'].count == 1
+    assert histograms['process_due'].count == 2
+    assert histograms['process_payment'].count == 2
+    assert histograms['record_transaction'].count == 2
+
+
+@patch(
+    'subscriptions.management.commands._manager.timezone.now',
+    lambda: datetime(2018, 2, 1, 2, 2, 2)
+)
+def test_manager_emit_metrics(django_user_model):
+    """Tests that the run counts are published to every sink."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    create_due_user_subscription(user)
+    emitted = []
+
+    class ListSink(_metrics.MetricsSink):
+        """Sink collecting the emitted metrics."""
+        def emit(self, metrics):
+            emitted.append(dict(metrics.counters))
+
+    manager = _manager.Manager()
+    manager.metrics_sinks = [ListSink()]
+    manager.process_subscriptions()
+    manager.emit_metrics()
+
+    assert len(emitted) == 1
+    assert emitted[0]['renewed'] == 1
+    assert emitted[0]['subscriptions'] == 1
@@ -0,0 +1,98 @@
+"""Tests for the _metrics module."""
+import logging
+from unittest.mock import patch
+
+from subscriptions.management.commands import _metrics
+
+
+def test_histogram_observe_buckets():
+    """Tests that observations are counted in the first fitting bucket."""
+    histogram = _metrics.Histogram(buckets=(0.1, 1))
+
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert histogram.bucket_counts == [1, 1]
+    assert histogram.count == 3
+    assert histogram.sum == 5.55
+
+
+def test_metrics_increment():
+    """Tests that counters accumulate."""
+    metrics = _metrics.Metrics()
+
+    metrics.increment('renewed')
+    metrics.increment('renewed', 2)
+
+    assert metrics.counters['renewed'] == 3
+
+
+@patch(
+    'subscriptions.management.commands._metrics.time.perf_counter',
+    side_effect=[1.0, 1.25],
+)
+def test_metrics_timer(mock_perf_counter):  # pylint: disable=unused-argument
+    """Tests that timer records the duration of its block."""
+    metrics = _metrics.Metrics()
+
+    with metrics.timer('scan'):
+        pass
+
+    assert metrics.histograms['scan'].count == 1
+    assert metrics.total('scan') == 0.25
+    assert metrics.total('missing') == 0.0
+
+
+def test_logging_sink_emit(caplog):
+    """Tests that the logging sink logs counters and timings."""
+    metrics = _metrics.Metrics()
+    metrics.increment('renewed', 4)
+    metrics.observe('process_payment', 0.5)
+    metrics.observe('process_payment', 1.5)
+
+    with caplog.at_level(logging.INFO):
+        _metrics.LoggingSink().emit(metrics)
+
+    assert caplog.messages == [
+        'renewed: 4',
+        'process_payment: 2 calls, 2.000s total, 1.000s mean',
+    ]
+
+
+def test_prometheus_textfile_sink_render():
+    """Tests that histogram buckets are rendered cumulatively."""
+    metrics = _metrics.Metrics(buckets=(0.1, 1))
+    metrics.increment('renewed', 2)
+    metrics.observe('scan', 0.05)
+    metrics.observe('scan', 0.5)
+
+    lines = _metrics.PrometheusTextfileSink('unused').render(metrics)
+
+    assert lines.splitlines() == [
+        '# HELP subscriptions_events_total Subscription manager events.',
+        '# TYPE subscriptions_events_total counter',
+        'subscriptions_events_total{name="renewed"} 2',
+        '# HELP subscriptions_duration_seconds Time spent in each phase '
+        'and hook.',
+        '# TYPE subscriptions_duration_seconds histogram',
+        'subscriptions_duration_seconds_bucket{name="scan",le="0.1"} 1',
+        'subscriptions_duration_seconds_bucket{name="scan",le="1"} 2',
+        'subscriptions_duration_seconds_bucket{name="scan",le="+Inf"} 2',
+        'subscriptions_duration_seconds_sum{name="scan"} 0.55',
+        'subscriptions_duration_seconds_count{name="scan"} 2',
+    ]
+
+
+def test_prometheus_textfile_sink_emit(tmp_path):
+    """Tests that the file is replaced without leaving temporary files."""
+    path = tmp_path / 'subscriptions.prom'
+    path.write_text('stale')
+    metrics = _metrics.Metrics()
+    metrics.increment('renewed')
+
+    _metrics.PrometheusTextfileSink(str(path), prefix='billing').emit(metrics)
+
+    assert 'billing_events_total{name="renewed"} 1' in path.read_text()
+    assert [entry.name for entry in tmp_path.iterdir()] == ['subscriptions.prom']
+    assert path.stat().st_mode & 0o777 == 0o644
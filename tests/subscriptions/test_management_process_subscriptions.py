@@ -0,0 +1,204 @@
+"""Tests for the process_subscriptions management command."""
+import json
+import re
+from datetime import datetime
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from subscriptions.management.commands import _manager
+
+pytestmark = pytest.mark.django_db  # pylint: disable=invalid-name
+
+
+def test_process_subscriptions_output():
+    """Tests that the command reports completion."""
+    out = StringIO()
+
+    call_command('process_subscriptions', stdout=out)
+
+    lines = out.getvalue().splitlines()
+
+    assert lines[:2] == [
+        'Processing subscriptions... Complete!',
+        'Expired: 0, new: 0, renewed: 0, payment errors: 0, '
+        'unresolved payments: 0',
+    ]
+    assert re.fullmatch(
+        r'Processed 0 subscriptions in \d+\.\d{2}s \(\d+\.\d rows/sec\)',
+        lines[2],
+    )
+    assert len(lines) == 3
+
+
+def test_process_subscriptions_metrics_textfile(tmp_path):
+    """Tests that --metrics-textfile writes the run metrics."""
+    path = tmp_path / 'subscriptions.prom'
+
+    call_command(
+        'process_subscriptions',
+        '--metrics-textfile={}'.format(path),
+        stdout=StringIO(),
+    )
+
+    content = path.read_text()
+
+    assert '# TYPE subscriptions_events_total counter' in content
+    assert 'subscriptions_duration_seconds_count{name="run"} 1' in content
+    assert 'subscriptions_duration_seconds_count{name="phase_due"} 1' in content
+
+
+@patch.object(_manager.Manager, 'process_subscriptions', autospec=True)
+def test_process_subscriptions_default_batch_size(mock_process):
+    """Tests that subscriptions are not batched by default."""
+    call_command('process_subscriptions', stdout=StringIO())
+
+    manager = mock_process.call_args[0][0]
+
+    assert manager.batch_size is None
+
+
+@patch.object(_manager.Manager, 'process_subscriptions', autospec=True)
+def test_process_subscriptions_batch_size(mock_process):
+    """Tests that --batch-size is applied to the manager."""
+    call_command('process_subscriptions', '--batch-size=25', stdout=StringIO())
+
+    manager = mock_process.call_args[0][0]
+
+    assert manager.batch_size == 25
+
+
+@patch.object(_manager.Manager, 'process_subscriptions_parallel', autospec=True)
+def test_process_subscriptions_workers(mock_parallel):
+    """Tests that --workers processes subscriptions in parallel."""
+    call_command('process_subscriptions', '--workers=4', stdout=StringIO())
+
+    assert mock_parallel.call_args[0][1] == 4
+
+
+@patch.object(_manager.Manager, 'process_subscriptions_parallel', autospec=True)
+@patch.object(_manager.Manager, 'process_subscriptions', autospec=True)
+def test_process_subscriptions_single_worker(mock_process, mock_parallel):
+    """Tests that a single worker does not start a thread pool."""
+    call_command('process_subscriptions', '--workers=1', stdout=StringIO())
+
+    assert mock_process.call_count == 1
+    assert mock_parallel.call_count == 0
+
+
+@patch.object(_manager.Manager, 'process_subscriptions', autospec=True)
+def test_process_subscriptions_claim(mock_process):
+    """Tests that --claim enables claimed processing."""
+    call_command('process_subscriptions', '--claim', stdout=StringIO())
+
+    manager = mock_process.call_args[0][0]
+
+    assert manager.claim is True
+
+
+@patch.object(_manager.Manager, 'process_subscriptions', autospec=True)
+def test_process_subscriptions_resume(mock_process):
+    """Tests that --resume continues the last run."""
+    call_command('process_subscriptions', '--resume', stdout=StringIO())
+
+    manager = mock_process.call_args[0][0]
+
+    assert manager.resume is True
+
+
+def test_process_subscriptions_resume_with_workers():
+    """Tests that --resume cannot be combined with --workers."""
+    with pytest.raises(CommandError):
+        call_command(
+            'process_subscriptions', '--resume', '--workers=2',
+            stdout=StringIO(),
+        )
+
+
+@patch.object(_manager.Manager, 'process_subscriptions', autospec=True)
+def test_process_subscriptions_time_limit_and_max_rate(mock_process):
+    """Tests that --time-limit and --max-rate are applied to the manager."""
+    call_command(
+        'process_subscriptions', '--time-limit=300', '--max-rate=2.5',
+        stdout=StringIO(),
+    )
+
+    manager = mock_process.call_args[0][0]
+
+    assert manager.time_limit == 300
+    assert manager.max_rate == 2.5
+
+
+def test_process_subscriptions_time_limit_reached_output():
+    """Tests that the command reports a run stopped by the time limit."""
+    out = StringIO()
+
+    def process_subscriptions(self, shard=None):  # pylint: disable=unused-argument
+        self.stopped = True
+
+    with patch.object(
+        _manager.Manager, 'process_subscriptions', process_subscriptions
+    ):
+        call_command('process_subscriptions', '--time-limit=1', stdout=out)
+
+    assert 'Time limit reached' in out.getvalue()
+    assert 'Complete!' not in out.getvalue()
+
+
+@patch.object(_manager.Manager, 'process_subscriptions', autospec=True)
+def test_process_subscriptions_catch_up(mock_process):
+    """Tests that --catch-up enables catch-up billing."""
+    call_command('process_subscriptions', '--catch-up', stdout=StringIO())
+
+    manager = mock_process.call_args[0][0]
+
+    assert manager.catch_up is True
+
+
+@patch.object(_manager.Manager, 'process_subscriptions', autospec=True)
+def test_process_subscriptions_dry_run(mock_process):
+    """Tests that --dry-run prints a forecast without processing."""
+    out = StringIO()
+
+    with patch.object(
+        _manager.Manager, 'forecast', autospec=True, return_value={
+            'until': datetime(2018, 2, 2), 'expired': 1, 'new': 2,
+            'renewed': 3, 'payments': 4, 'revenue': Decimal('5.00'),
+        }
+    ) as mock_forecast:
+        call_command('process_subscriptions', '--dry-run', stdout=out)
+
+    assert mock_process.call_count == 0
+    assert mock_forecast.call_args[0][1] is None
+    assert out.getvalue() == (
+        'Forecast until 2018-02-02 00:00:00: expired: 1, new: 2, '
+        'renewed: 3, payments: 4, revenue: 5.00\n'
+    )
+
+
+def test_process_subscriptions_forecast_until_json():
+    """Tests that --forecast-until can print the forecast as JSON."""
+    out = StringIO()
+
+    call_command(
+        'process_subscriptions', '--forecast-until=2018-02-02T00:00:00',
+        '--json', stdout=out,
+    )
+
+    assert json.loads(out.getvalue()) == {
+        'until': '2018-02-02T00:00:00', 'expired': 0, 'new': 0,
+        'renewed': 0, 'payments': 0, 'revenue': '0',
+    }
+
+
+def test_process_subscriptions_forecast_until_invalid():
+    """Tests that an invalid --forecast-until datetime is rejected."""
+    with pytest.raises(CommandError):
+        call_command(
+            'process_subscriptions', '--forecast-until=next week',
+            stdout=StringIO(),
+        )
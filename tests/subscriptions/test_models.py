@@ -1,9 +1,12 @@
 """Tests for the models module."""
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
 
 import pytest
+from django.db import IntegrityError, connection
 
 from subscriptions import models
+from subscriptions.management.commands import _manager
 
 
 # PlanTag Model
@@ -615,7 +618,7 @@ def test_plan_cost_next_billing_datetime_months():
     current = datetime(2018, 1, 1, 1, 1, 1)
     next_billing = plan_cost.next_billing_datetime(current)
 
-    assert next_billing == datetime(2018, 1, 31, 11, 30, 0, 520000)
+    assert next_billing == datetime(2018, 2, 1, 1, 1, 1)
 
 
 @pytest.mark.django_db
@@ -631,7 +634,7 @@ def test_plan_cost_next_billing_datetime_12_months():
     current = datetime(2018, 1, 1, 1, 1, 1)
     next_billing = plan_cost.next_billing_datetime(current)
 
-    assert next_billing == datetime(2019, 1, 1, 6, 48, 55, 240000)
+    assert next_billing == datetime(2019, 1, 1, 1, 1, 1)
 
 
 @pytest.mark.django_db
@@ -647,7 +650,7 @@ def test_plan_cost_next_billing_datetime_48_months():
     current = datetime(2018, 1, 1, 1, 1, 1)
     next_billing = plan_cost.next_billing_datetime(current)
 
-    assert next_billing == datetime(2022, 1, 1, 0, 12, 37, 960000)
+    assert next_billing == datetime(2022, 1, 1, 1, 1, 1)
 
 
 @pytest.mark.django_db
@@ -663,7 +666,7 @@ def test_plan_cost_next_billing_datetime_years():
     current = datetime(2018, 1, 1, 1, 1, 1)
     next_billing = plan_cost.next_billing_datetime(current)
 
-    assert next_billing == datetime(2019, 1, 1, 6, 50, 13)
+    assert next_billing == datetime(2019, 1, 1, 1, 1, 1)
 
 
 @pytest.mark.django_db
@@ -679,7 +682,7 @@ def test_plan_cost_next_billing_datetime_4_years():
     current = datetime(2018, 1, 1, 1, 1, 1)
     next_billing = plan_cost.next_billing_datetime(current)
 
-    assert next_billing == datetime(2022, 1, 1, 0, 17, 49)
+    assert next_billing == datetime(2022, 1, 1, 1, 1, 1)
 
 
 @pytest.mark.django_db
@@ -698,6 +701,217 @@ def test_plan_cost_next_billing_datetime_once():
     assert next_billing is None
 
 
+@pytest.mark.django_db
+@pytest.mark.parametrize('current, unit, period, next_billing', [
+    (datetime(2018, 1, 31, 1, 1, 1), models.MONTH, 1, datetime(2018, 2, 28, 1, 1, 1)),
+    (datetime(2020, 1, 31, 1, 1, 1), models.MONTH, 1, datetime(2020, 2, 29, 1, 1, 1)),
+    (datetime(2018, 3, 31, 1, 1, 1), models.MONTH, 3, datetime(2018, 6, 30, 1, 1, 1)),
+    (datetime(2018, 11, 15, 1, 1, 1), models.MONTH, 2, datetime(2019, 1, 15, 1, 1, 1)),
+    (datetime(2020, 2, 29, 1, 1, 1), models.YEAR, 1, datetime(2021, 2, 28, 1, 1, 1)),
+    (datetime(2020, 2, 29, 1, 1, 1), models.YEAR, 4, datetime(2024, 2, 29, 1, 1, 1)),
+])
+def test_plan_cost_next_billing_datetime_month_end(current, unit, period, next_billing):
+    """Tests that calendar units are clamped to the end of the month."""
+    plan_cost = models.PlanCost.objects.create(
+        recurrence_period=period, recurrence_unit=unit
+    )
+
+    assert plan_cost.next_billing_datetime(current) == next_billing
+
+
+def test_next_billing_datetimes():
+    """Tests calculating the next billing dates of many schedules."""
+    current = datetime(2018, 1, 31, 1, 1, 1)
+
+    next_billings = models.next_billing_datetimes([
+        (current, models.DAY, 2),
+        (current, models.MONTH, 1),
+        (current, models.YEAR, 1),
+        (current, models.ONCE, 1),
+        (current, models.MONTH, 1),
+    ])
+
+    assert next_billings == [
+        datetime(2018, 2, 2, 1, 1, 1),
+        datetime(2018, 2, 28, 1, 1, 1),
+        datetime(2019, 1, 31, 1, 1, 1),
+        None,
+        datetime(2018, 2, 28, 1, 1, 1),
+    ]
+
+
+def test_add_months_keeps_timezone():
+    """Tests that adding months keeps the time and timezone."""
+    current = datetime(2018, 1, 31, 23, 59, 59, tzinfo=timezone.utc)
+
+    assert models.add_months(current, -2) == datetime(
+        2017, 11, 30, 23, 59, 59, tzinfo=timezone.utc
+    )
+
+
+def test_plan_cost_next_billing_datetime_anchored_months():
+    """Tests that consecutive months keep the billing day of the anchor."""
+    plan_cost = models.PlanCost(recurrence_period=1, recurrence_unit=models.MONTH)
+    anchor = datetime(2018, 1, 31, 1, 1, 1)
+    billing_dates = [anchor]
+
+    for _ in range(6):
+        billing_dates.append(
+            plan_cost.next_billing_datetime(billing_dates[-1], anchor)
+        )
+
+    assert billing_dates == [
+        datetime(2018, 1, 31, 1, 1, 1),
+        datetime(2018, 2, 28, 1, 1, 1),
+        datetime(2018, 3, 31, 1, 1, 1),
+        datetime(2018, 4, 30, 1, 1, 1),
+        datetime(2018, 5, 31, 1, 1, 1),
+        datetime(2018, 6, 30, 1, 1, 1),
+        datetime(2018, 7, 31, 1, 1, 1),
+    ]
+
+
+def test_add_months_anchor():
+    """Tests counting months from an anchor only for dates on its schedule."""
+    anchor = datetime(2018, 1, 31, 1, 1, 1)
+
+    assert models.add_months(datetime(2018, 2, 15, 1, 1, 1), 1, anchor) == (
+        datetime(2018, 3, 15, 1, 1, 1)
+    )
+    assert models.next_billing_datetimes([
+        (datetime(2018, 2, 28, 1, 1, 1), models.MONTH, 1, anchor),
+        (datetime(2019, 2, 28), models.YEAR, 1, datetime(2016, 2, 29)),
+    ]) == [datetime(2018, 3, 31, 1, 1, 1), datetime(2020, 2, 29)]
+
+
+# UserSubscription Model
+# -----------------------------------------------------------------------------
+def billing_scans():
+    """Returns the queries of the billing scans of the subscription manager.
+
+        The scans are built like a run builds them: from the phase
+        conditions of the manager, with the related models joined and
+        in the order of each phase, for the first chunk and for a later
+        chunk of the due scan.
+    """
+    manager = _manager.Manager()
+    # pylint: disable=protected-access
+    expired, new, due = manager._phase_conditions(datetime(2018, 1, 1))
+    paid_due = manager._paid_due_condition(due)
+    batch_size = _manager.DEFAULT_BATCH_SIZE
+    scans = [
+        manager.get_subscriptions(condition).order_by(*ordering)[:batch_size]
+        for condition, ordering in (
+            (expired, _manager.PK_ORDERING),
+            (new, _manager.PK_ORDERING),
+            (paid_due, _manager.DUE_ORDERING),
+        )
+    ]
+    # Later chunks of the due scan resume after the last row of a chunk
+    scans.append(
+        manager.get_subscriptions(paid_due).filter(
+            _manager._keyset_condition(
+                _manager.DUE_ORDERING, (datetime(2017, 12, 1), uuid4())
+            )
+        ).order_by(*_manager.DUE_ORDERING)[:batch_size]
+    )
+
+    return scans
+
+
+def assert_scans_use_index():
+    """Asserts that each billing scan searches a subscription index."""
+    for scan in billing_scans():
+        plan = scan.explain()
+
+        assert 'USING INDEX dfs_subscription_' in plan
+        assert 'SCAN subscriptions_usersubscription' not in plan
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(
+    connection.vendor != 'sqlite', reason='Query plan format is SQLite specific'
+)
+def test_user_subscription_billing_scans_use_index():
+    """Tests that the billing scans search an index rather than scan."""
+    assert_scans_use_index()
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(
+    connection.vendor != 'sqlite', reason='Query plan format is SQLite specific'
+)
+def test_user_subscription_billing_scans_use_index_with_statistics():
+    """Tests that the billing scans still use an index on a larger table.
+
+        Most subscriptions are not due; once table statistics are
+        available the index search should still be preferred over a
+        full scan, keeping the cost of each scan independent of the
+        total number of subscriptions.
+    """
+    start = datetime(2018, 1, 1)
+    models.UserSubscription.objects.bulk_create([
+        models.UserSubscription(
+            date_billing_start=start + timedelta(days=index),
+            date_billing_end=start + timedelta(days=365 + index),
+            date_billing_next=start + timedelta(days=30 + index),
+            active=index % 10 != 0,
+            cancelled=index % 4 == 0,
+        )
+        for index in range(500)
+    ])
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    assert_scans_use_index()
+
+
+# BillingAttempt Model
+# -----------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_billing_attempt_unique_billing_period():
+    """Tests that a billing period can only have one attempt per number."""
+    subscription = models.UserSubscription.objects.create()
+    models.BillingAttempt.objects.create(
+        subscription=subscription, date_period_start=datetime(2018, 1, 1),
+    )
+    models.BillingAttempt.objects.create(
+        subscription=subscription, date_period_start=datetime(2018, 1, 1),
+        number=2,
+    )
+
+    with pytest.raises(IntegrityError):
+        models.BillingAttempt.objects.create(
+            subscription=subscription, date_period_start=datetime(2018, 1, 1),
+        )
+
+
+def test_billing_attempt_id_is_deterministic():
+    """Tests that the attempt ID only depends on the period and number."""
+    subscription_id = uuid4()
+    period_start = datetime(2018, 1, 1, tzinfo=timezone.utc)
+
+    assert models.billing_attempt_id(subscription_id, period_start) == (
+        models.billing_attempt_id(subscription_id, period_start)
+    )
+    assert models.billing_attempt_id(subscription_id, period_start) == (
+        models.billing_attempt_id(
+            subscription_id,
+            period_start.astimezone(timezone(timedelta(hours=5))),
+        )
+    )
+    assert models.billing_attempt_id(subscription_id, period_start) != (
+        models.billing_attempt_id(subscription_id, datetime(2018, 2, 1))
+    )
+    assert models.billing_attempt_id(subscription_id, period_start) != (
+        models.billing_attempt_id(uuid4(), period_start)
+    )
+    assert models.billing_attempt_id(subscription_id, period_start) != (
+        models.billing_attempt_id(subscription_id, period_start, 2)
+    )
+
+
 # PlanList Model
 # -----------------------------------------------------------------------------
 @pytest.mark.django_db
@@ -756,3 +970,15 @@ def test_plan_list_details_str_():
     )
 
     assert str(plan_list_details) == 'Plan List Test Title - Test Plan'
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(
+    connection.vendor != 'sqlite', reason='sqlite_stat1 is SQLite specific'
+)
+def test_estimate_count_without_statistics():
+    """Tests that no estimate is made before the table is analyzed."""
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS sqlite_stat1')
+
+    assert models.estimate_count(models.SubscriptionTransaction) is None
@@ -330,6 +330,20 @@ def test_transaction_list_exists_at_desired_url(admin_client):
     assert response.status_code == 200
 
 
+def test_transaction_export_exists_at_desired_location(admin_client):
+    """Tests that transaction export URL name works."""
+    response = admin_client.get(reverse('dfs_transaction_export'))
+
+    assert response.status_code == 200
+
+
+def test_transaction_export_exists_at_desired_url(admin_client):
+    """Tests that transaction export URL works."""
+    response = admin_client.get('/dfs/transactions/export/')
+
+    assert response.status_code == 200
+
+
 def test_transaction_detail_exists_at_desired_location(admin_client):
     """Tests that transaction detail URL name works."""
     transaction = models.SubscriptionTransaction.objects.create(
@@ -6,11 +6,12 @@ import pytest
 
 from django.contrib.auth.models import Group
 from django.contrib.messages import get_messages
+from django.core.cache import caches
 from django.forms import HiddenInput
 from django.urls import reverse
 from django.utils import timezone
 
-from subscriptions import models, views, forms
+from subscriptions import cache, models, views, forms
 
 
 pytestmark = pytest.mark.django_db  # pylint: disable=invalid-name
@@ -125,6 +126,191 @@ def test_subscribe_list_expected_ordering(admin_client, dfs):
     assert response.context['details'][1] == details[1]
 
 
+@patch.dict('subscriptions.conf.SETTINGS', subscribe_list_cache='default')
+def test_subscribe_list_cached_without_queries(client, dfs, django_assert_num_queries):
+    """Tests that a repeated request is served from the cache."""
+    dfs.plan_list  # pylint: disable=pointless-statement
+
+    client.get(reverse('dfs_subscribe_list'))
+
+    with django_assert_num_queries(0):
+        response = client.get(reverse('dfs_subscribe_list'))
+
+    assert response.status_code == 200
+    assert len(response.context['details']) == 3
+
+
+@patch.dict('subscriptions.conf.SETTINGS', subscribe_list_cache='default')
+def test_subscribe_list_invalidated_on_save(client, dfs):
+    """Tests that changing a plan refreshes the cached list."""
+    dfs.plan_list  # pylint: disable=pointless-statement
+
+    client.get(reverse('dfs_subscribe_list'))
+
+    plan = dfs.plan_list.plan_list_details.order_by('order').first().plan
+    plan.plan_name = 'Updated plan'
+    plan.save()
+
+    response = client.get(reverse('dfs_subscribe_list'))
+
+    assert 'Updated plan' in response.content.decode()
+
+
+@patch.dict('subscriptions.conf.SETTINGS', subscribe_list_cache='default')
+def test_subscribe_list_invalidated_on_delete(client, dfs):
+    """Tests that deleting the plan list refreshes the cached list."""
+    dfs.plan_list.delete()
+
+    response = client.get(reverse('dfs_subscribe_list'))
+
+    assert response.status_code == 404
+
+
+@patch.dict('subscriptions.conf.SETTINGS', subscribe_list_cache='default')
+def test_subscribe_list_invalidated_on_plan_cost_link(client, dfs):
+    """Tests that linking a plan and cost refreshes the cached list."""
+    dfs.plan_list  # pylint: disable=pointless-statement
+
+    client.get(reverse('dfs_subscribe_list'))
+    cost = models.PlanCost.objects.create()
+
+    with patch('subscriptions.signals.invalidate_subscribe_list') as mock_invalidate:
+        cost.plans.add(dfs.plan)
+
+    assert mock_invalidate.called
+
+
+def test_subscribe_list_cache_disabled(client, dfs, django_assert_num_queries):
+    """Tests that the plan list is queried on every request by default."""
+    dfs.plan_list  # pylint: disable=pointless-statement
+
+    client.get(reverse('dfs_subscribe_list'))
+
+    with django_assert_num_queries(2):
+        client.get(reverse('dfs_subscribe_list'))
+
+
+@patch.dict('subscriptions.conf.SETTINGS', subscribe_list_cache='default')
+def test_subscribe_list_not_modified(client, dfs, django_assert_num_queries):
+    """Tests that a matching ETag returns 304 without any queries."""
+    dfs.plan_list  # pylint: disable=pointless-statement
+
+    response = client.get(reverse('dfs_subscribe_list'))
+
+    assert response.has_header('ETag')
+    assert response.has_header('Last-Modified')
+
+    with django_assert_num_queries(0):
+        not_modified = client.get(
+            reverse('dfs_subscribe_list'),
+            HTTP_IF_NONE_MATCH=response['ETag'],
+        )
+
+    assert not_modified.status_code == 304
+    assert not_modified.content == b''
+
+
+@patch.dict('subscriptions.conf.SETTINGS', subscribe_list_cache='default')
+def test_subscribe_list_if_modified_since(client, dfs):
+    """Tests that Last-Modified validates until the plan list changes."""
+    dfs.plan_list  # pylint: disable=pointless-statement
+
+    response = client.get(reverse('dfs_subscribe_list'))
+    last_modified = response['Last-Modified']
+
+    assert client.get(
+        reverse('dfs_subscribe_list'), HTTP_IF_MODIFIED_SINCE=last_modified,
+    ).status_code == 304
+
+    dfs.plan.save()
+
+    assert client.get(
+        reverse('dfs_subscribe_list'), HTTP_IF_MODIFIED_SINCE=last_modified,
+    ).status_code == 200
+
+
+@patch.dict('subscriptions.conf.SETTINGS', subscribe_list_cache='default')
+def test_subscribe_list_etag_changes_on_save(client, dfs):
+    """Tests that changing plan data changes the ETag."""
+    dfs.plan_list  # pylint: disable=pointless-statement
+
+    etag = client.get(reverse('dfs_subscribe_list'))['ETag']
+    models.PlanCost.objects.create()
+
+    response = client.get(reverse('dfs_subscribe_list'), HTTP_IF_NONE_MATCH=etag)
+
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+
+
+@patch.dict('subscriptions.conf.SETTINGS', subscribe_list_cache='default')
+def test_subscribe_list_etag_varies_by_csrf_cookie(client, dfs):
+    """Tests that a new CSRF cookie does not reuse the cached page."""
+    dfs.plan_list  # pylint: disable=pointless-statement
+
+    etag = client.get(reverse('dfs_subscribe_list'))['ETag']
+    client.cookies['csrftoken'] = 'a' * 64
+
+    response = client.get(reverse('dfs_subscribe_list'), HTTP_IF_NONE_MATCH=etag)
+
+    assert response.status_code == 200
+
+
+@patch.dict('subscriptions.conf.SETTINGS', subscribe_list_cache='default')
+def test_subscribe_list_etag_changes_on_expiry(client, dfs):
+    """Tests that an expired list is served with new validators."""
+    dfs.plan_list  # pylint: disable=pointless-statement
+
+    etag = client.get(reverse('dfs_subscribe_list'))['ETag']
+    # QuerySet.update does not send signals; only the timeout applies
+    models.PlanList.objects.filter(id=dfs.plan_list.id).update(
+        title='Updated title',
+    )
+    caches['default'].delete(cache.SUBSCRIBE_LIST_VERSION_KEY)
+
+    response = client.get(reverse('dfs_subscribe_list'), HTTP_IF_NONE_MATCH=etag)
+
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+    assert response.context['plan_list'].title == 'Updated title'
+
+
+def test_subscribe_list_version_expires_with_entry():
+    """Tests that the version uses the default timeout of the cache."""
+    with patch.dict('subscriptions.conf.SETTINGS', subscribe_list_cache='default'):
+        with patch.object(caches['default'], 'set') as mock_set:
+            cache.get_subscribe_list_version()
+
+    mock_set.assert_called_once()
+    assert len(mock_set.call_args[0]) == 2
+    assert 'timeout' not in mock_set.call_args[1]
+
+
+@patch.dict('subscriptions.conf.SETTINGS', subscribe_list_cache='default')
+def test_subscribe_list_no_validators_when_authenticated(client, dfs):
+    """Tests that pages rendered for a user are never answered with 304."""
+    dfs.plan_list  # pylint: disable=pointless-statement
+
+    etag = client.get(reverse('dfs_subscribe_list'))['ETag']
+    client.force_login(dfs.user)
+
+    response = client.get(reverse('dfs_subscribe_list'), HTTP_IF_NONE_MATCH=etag)
+
+    assert response.status_code == 200
+    assert not response.has_header('ETag')
+    assert not response.has_header('Last-Modified')
+
+
+def test_subscribe_list_no_validators_without_cache(client, dfs):
+    """Tests that no validators are sent if the cache is disabled."""
+    dfs.plan_list  # pylint: disable=pointless-statement
+
+    response = client.get(reverse('dfs_subscribe_list'))
+
+    assert not response.has_header('ETag')
+    assert not response.has_header('Last-Modified')
+
+
 # SubscribeView Tests
 # -----------------------------------------------------------------------------
 def test_subscribe_view_redirect_anonymous(client):
@@ -1,12 +1,16 @@
 """Tests for the django-flexible-subscriptions UserSubscription views."""
+from unittest.mock import patch
+
 import pytest
 
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.messages import get_messages
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from subscriptions import models
+from subscriptions import models, views
 
 from ..factories import PlanCostLinkFactory
 
@@ -109,6 +113,89 @@ def test_subscription_list_retrives_all_users(admin_client, django_user_model):
     assert response.context['users'][2].username == 'user_3'
 
 
+def create_subscribed_users(django_user_model, count):
+    """Creates users with two subscriptions each."""
+    plan_cost = create_plan_cost(plan=create_subscription_plan())
+    subscription_plan = create_subscription_plan()
+    users = []
+
+    for index in range(count):
+        user = django_user_model.objects.create_user(
+            username='user_{}'.format(index), password='password'
+        )
+        create_user_subscription(user, plan_cost, subscription_plan)
+        create_user_subscription(user, plan_cost, subscription_plan)
+        users.append(user)
+
+    return users
+
+
+@pytest.mark.django_db
+@patch.object(views.SubscriptionListView, 'paginate_by', 2)
+def test_subscription_list_keyset_pages(admin_client, django_user_model):
+    """Tests that the list pages forwards and backwards by cursor."""
+    users = create_subscribed_users(django_user_model, 5)
+    url = reverse('dfs_subscription_list')
+
+    response = admin_client.get(url)
+    page = response.context['page_obj']
+
+    assert response.context['users'] == users[:2]
+    assert page.has_next() is True
+    assert page.has_previous() is False
+
+    response = admin_client.get(url, {'after': page.next_cursor})
+    page = response.context['page_obj']
+
+    assert response.context['users'] == users[2:4]
+    assert page.has_previous() is True
+
+    response = admin_client.get(url, {'after': page.next_cursor})
+    last_page = response.context['page_obj']
+
+    assert response.context['users'] == users[4:]
+    assert last_page.has_next() is False
+
+    response = admin_client.get(url, {'before': last_page.previous_cursor})
+
+    assert response.context['users'] == users[2:4]
+
+
+@pytest.mark.django_db
+@patch.object(views.SubscriptionListView, 'paginate_by', 2)
+def test_subscription_list_constant_queries(admin_client, django_user_model):
+    """Tests that a deep page costs the same queries as the first."""
+    create_subscribed_users(django_user_model, 6)
+    url = reverse('dfs_subscription_list')
+
+    with CaptureQueriesContext(connection) as first_page:
+        response = admin_client.get(url)
+
+    response = admin_client.get(
+        url, {'after': response.context['page_obj'].next_cursor}
+    )
+
+    with CaptureQueriesContext(connection) as deep_page:
+        admin_client.get(
+            url, {'after': response.context['page_obj'].next_cursor}
+        )
+
+    sql = ' '.join(query['sql'] for query in deep_page.captured_queries)
+
+    assert len(deep_page.captured_queries) == len(first_page.captured_queries)
+    assert 'COUNT(' not in sql
+    assert 'OFFSET' not in sql
+
+
+@pytest.mark.django_db
+def test_subscription_list_invalid_cursor_404(admin_client):
+    """Tests that an invalid cursor returns a 404 response."""
+    url = reverse('dfs_subscription_list')
+
+    assert admin_client.get(url, {'after': 'invalid'}).status_code == 404
+    assert admin_client.get(url, {'after': 'WyJhIl0='}).status_code == 404
+
+
 # SubscriptionCreateView
 # -----------------------------------------------------------------------------
 @pytest.mark.django_db
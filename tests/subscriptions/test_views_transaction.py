@@ -1,4 +1,10 @@
-from subscriptions import models
+import json
+from base64 import urlsafe_b64encode
+from unittest.mock import patch
+
+from subscriptions import models, views
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.urls import reverse
 from django.contrib.contenttypes.models import ContentType
@@ -162,3 +168,160 @@ def test_transaction_detail_200_if_authorized(client, django_user_model):
     )
 
     assert response.status_code == 200
+
+
+@pytest.mark.django_db
+@patch.object(views.TransactionListView, 'paginate_by', 2)
+def test_transaction_list_keyset_pages(admin_client, django_user_model):
+    """Tests that transactions are paged by date without a count."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    cost = create_cost(plan=create_plan())
+    transactions = [
+        create_transaction(user, cost, '{}.00'.format(index))
+        for index in range(5)
+    ]
+    url = reverse('dfs_transaction_list')
+
+    with CaptureQueriesContext(connection) as context:
+        response = admin_client.get(url)
+
+    page = response.context['page_obj']
+    sql = ' '.join(query['sql'] for query in context.captured_queries)
+
+    assert response.context['transactions'] == transactions[:2]
+    assert response.context['paginator'] is None
+    assert 'COUNT(' not in sql
+
+    response = admin_client.get(url, {'after': page.next_cursor})
+
+    assert response.context['transactions'] == transactions[2:4]
+
+
+@pytest.mark.django_db
+def test_transaction_list_invalid_cursor_types_404(admin_client):
+    """Tests that cursor values of the wrong type return a 404 response."""
+    url = reverse('dfs_transaction_list')
+
+    for values in ([5, 5], [[1], 1], [{'a': 1}, 1], [True, 1], [None, 1]):
+        cursor = urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+        assert admin_client.get(url, {'after': cursor}).status_code == 404
+        assert admin_client.get(url, {'before': cursor}).status_code == 404
+
+
+@pytest.mark.django_db
+def test_transaction_list_related_queries(admin_client, django_user_model):
+    """Tests that users and plan costs are not fetched per row."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    cost = create_cost(plan=create_plan())
+    create_transaction(user, cost)
+
+    with CaptureQueriesContext(connection) as single:
+        admin_client.get(reverse('dfs_transaction_list'))
+
+    for _ in range(5):
+        create_transaction(user, create_cost())
+
+    with CaptureQueriesContext(connection) as several:
+        admin_client.get(reverse('dfs_transaction_list'))
+
+    assert len(several.captured_queries) == len(single.captured_queries)
+
+
+@pytest.mark.django_db
+@patch.object(views.TransactionListView, 'keyset_pagination', False)
+@patch.object(views.TransactionListView, 'paginate_by', 2)
+def test_transaction_list_page_numbers(admin_client, django_user_model):
+    """Tests that page number pagination can still be used."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    cost = create_cost(plan=create_plan())
+
+    for index in range(3):
+        create_transaction(user, cost, '{}.00'.format(index))
+
+    response = admin_client.get(reverse('dfs_transaction_list'), {'page': 2})
+
+    assert response.context['paginator'].num_pages == 2
+    assert len(response.context['transactions']) == 1
+
+
+@pytest.mark.django_db
+@patch.object(views.TransactionListView, 'show_estimated_count', True)
+def test_transaction_list_estimated_count(admin_client, django_user_model):
+    """Tests that the estimated count is taken from table statistics."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    cost = create_cost(plan=create_plan())
+
+    for _ in range(3):
+        create_transaction(user, cost)
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    response = admin_client.get(reverse('dfs_transaction_list'))
+
+    assert response.context['estimated_count'] == 3
+    assert 'About 3 transactions' in response.content.decode()
+
+
+# TransactionExportView
+# -----------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_transaction_export_403_if_not_authorized(client, django_user_model):
+    """Tests for 403 error for the export if inadequate permissions."""
+    django_user_model.objects.create_user(username='user', password='password')
+    client.login(username='user', password='password')
+
+    response = client.get(reverse('dfs_transaction_export'))
+
+    assert response.status_code == 403
+
+
+@pytest.mark.django_db
+def test_transaction_export_csv(admin_client, django_user_model):
+    """Tests that the transactions are streamed as CSV."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    cost = create_cost(plan=create_plan())
+    create_transaction(user, cost, '1.00')
+    create_transaction(user, cost, '2.00')
+
+    response = admin_client.get(reverse('dfs_transaction_export'))
+    content = b''.join(response.streaming_content).decode()
+
+    assert response.streaming is True
+    assert response['Content-Type'] == 'text/csv'
+    assert response['Content-Disposition'] == (
+        'attachment; filename="transactions.csv"'
+    )
+    assert len(content.splitlines()) == 3
+    assert '$2.00' in content
+
+
+@pytest.mark.django_db
+def test_transaction_export_jsonl_user_filter(admin_client, django_user_model):
+    """Tests that the JSONL export can be filtered by user."""
+    user = django_user_model.objects.create_user(username='a', password='b')
+    other_user = django_user_model.objects.create_user(username='c', password='d')
+    cost = create_cost(plan=create_plan())
+    create_transaction(user, cost)
+    create_transaction(other_user, cost)
+
+    response = admin_client.get(
+        reverse('dfs_transaction_export'),
+        {'format': 'jsonl', 'user': user.id},
+    )
+    lines = b''.join(response.streaming_content).decode().splitlines()
+
+    assert response['Content-Type'] == 'application/x-ndjson'
+    assert len(lines) == 1
+    assert '"username": "a"' in lines[0]
+
+
+@pytest.mark.django_db
+def test_transaction_export_400_if_invalid(admin_client):
+    """Tests that invalid export parameters return a 400 response."""
+    url = reverse('dfs_transaction_export')
+
+    assert admin_client.get(url, {'format': 'xml'}).status_code == 400
+    assert admin_client.get(url, {'start': 'soon'}).status_code == 400
+    assert admin_client.get(url, {'user': 'a'}).status_code == 400